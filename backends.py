@@ -0,0 +1,504 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+
+from scheduler import scheduler
+from telemetry import metrics
+
+logger = logging.getLogger(__name__)
+
+HEDGE_PERCENTILE = float(os.getenv('MODEL_HEDGE_PERCENTILE', '95'))
+HEDGE_DEFAULT_DELAY = float(os.getenv('MODEL_HEDGE_DEFAULT_DELAY', '5.0'))
+HEDGE_MIN_DELAY = float(os.getenv('MODEL_HEDGE_MIN_DELAY', '0.5'))
+# Recent latencies needed before the percentile replaces the default delay
+HEDGE_MIN_SAMPLES = 20
+
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('MODEL_HEDGE_POOL_SIZE', '32')),
+    thread_name_prefix="model"
+)
+
+
+def parse_backends(spec: str) -> List[Tuple[str, str]]:
+    """Parse "openai:gpt-4o,anthropic:claude-3-5-sonnet-latest" into (provider, model) pairs."""
+    backends = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        provider, _, model = item.partition(":")
+        backends.append((provider.strip(), model.strip()))
+    return backends
+
+
+class InvalidResponse(Exception):
+    """A backend answered with neither content nor tool calls."""
+
+
+class CircuitBreaker:
+    """Stops sending calls to a backend after repeated failures.
+
+    After `failures` consecutive failures the breaker opens. Once reset_timeout
+    has passed it lets one probe call through; a success closes it again.
+    """
+
+    def __init__(self, failures: int = 5, reset_timeout: float = 30.0):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self._opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                # One probe per reset window
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive += 1
+            if self._opened_at is not None or self._consecutive >= self.failures:
+                self._opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Recent latencies of one backend, for picking the hedge delay."""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+class Backend:
+    """One model backend with its own breaker and latency history."""
+
+    def __init__(self, name: str, model: Any, shared_with: Optional["Backend"] = None):
+        self.name = name
+        self.model = model
+        if shared_with is not None:
+            # Copies bound to other tools are the same provider: share its health and history
+            self.breaker = shared_with.breaker
+            self.latency = shared_with.latency
+            self.counts = shared_with.counts
+            return
+        self.breaker = CircuitBreaker(
+            failures=int(os.getenv('MODEL_BREAKER_FAILURES', '5')),
+            reset_timeout=float(os.getenv('MODEL_BREAKER_RESET_SECONDS', '30'))
+        )
+        # Full response time for invoke, time to first chunk for stream
+        self.latency = {"invoke": LatencyTracker(), "stream": LatencyTracker()}
+        self.counts = {"calls": 0, "wins": 0, "errors": 0}
+
+    def bind_tools(self, tools: List[Any]) -> "Backend":
+        return Backend(self.name, self.model.bind_tools(tools) if tools else self.model, shared_with=self)
+
+    def succeeded(self, mode: str, seconds: float) -> None:
+        self.latency[mode].record(seconds)
+        self.breaker.record_success()
+
+    def failed(self, error: BaseException) -> None:
+        self.counts["errors"] += 1
+        self.breaker.record_failure()
+        metrics.inc("model_backend_errors_total", (("backend", self.name),))
+        logger.warning("Model backend %s failed: %s", self.name, str(error))
+
+
+def _check(ai_msg: Any) -> Any:
+    if not getattr(ai_msg, "content", None) and not getattr(ai_msg, "tool_calls", None):
+        raise InvalidResponse("empty response")
+    return ai_msg
+
+
+class HedgedModel:
+    """Chat model over an ordered list of backends with the invoke/stream surface of one.
+
+    A call goes to the first backend whose breaker is closed. If it hasn't
+    answered within its recent latency percentile, a duplicate goes to the
+    next backend; the first valid response wins and the other is cancelled
+    (or, for a thread that can't be interrupted, ignored). Errors fail over
+    to the next backend straight away. Streams are won by the first backend
+    to produce a chunk.
+
+    A breaker is only asked for its one half-open probe when its backend is
+    actually tried. A hedged duplicate needs a spare FairScheduler slot
+    under the caller's; without one, the call just keeps waiting.
+
+    Every backend is bound to the same tools, so replies carry the same
+    tool_calls whichever backend answers.
+    """
+
+    def __init__(self, backends: List[Backend], hedge_percentile: float = HEDGE_PERCENTILE):
+        self.backends = backends
+        self.hedge_percentile = hedge_percentile
+        self.counts = {"hedges": 0, "hedges_skipped": 0, "failovers": 0}
+
+    def bind_tools(self, tools: List[Any], **kwargs) -> "HedgedModel":
+        bound = HedgedModel([b.bind_tools(tools) for b in self.backends], self.hedge_percentile)
+        bound.counts = self.counts
+        return bound
+
+    def _candidates(self) -> Iterator[Backend]:
+        """Backends in order, each checked against its breaker only when the caller gets to it."""
+        tried = False
+        for backend in self.backends:
+            if backend.breaker.allow():
+                tried = True
+                yield backend
+        if not tried:
+            # With every breaker open, trying anyway beats failing the turn outright
+            yield from self.backends
+
+    def _hedge_slot(self) -> Optional[Callable[[], None]]:
+        """A scheduler slot for a duplicate call, or None if there is no spare one."""
+        release = scheduler.spare_slot()
+        if release is None:
+            self.counts["hedges_skipped"] += 1
+            metrics.inc("model_hedges_skipped_total")
+        return release
+
+    def _hedge_delay(self, backend: Backend, mode: str) -> Optional[float]:
+        if self.hedge_percentile <= 0:
+            return None
+        observed = backend.latency[mode].percentile(self.hedge_percentile)
+        return max(HEDGE_MIN_DELAY, observed if observed is not None else HEDGE_DEFAULT_DELAY)
+
+    def _hedged(self) -> None:
+        self.counts["hedges"] += 1
+        metrics.inc("model_hedges_total")
+
+    def _failed_over(self) -> None:
+        self.counts["failovers"] += 1
+        metrics.inc("model_failovers_total")
+
+    def _won(self, backend: Backend) -> None:
+        backend.counts["wins"] += 1
+        metrics.inc("model_backend_wins_total", (("backend", backend.name),))
+
+    def _timed_invoke(self, backend: Backend, messages: Any, kwargs: Dict[str, Any]) -> Any:
+        backend.counts["calls"] += 1
+        start = time.perf_counter()
+        try:
+            ai_msg = _check(backend.model.invoke(messages, **kwargs))
+        except Exception as e:
+            backend.failed(e)
+            raise
+        backend.succeeded("invoke", time.perf_counter() - start)
+        return ai_msg
+
+    def invoke(self, messages: Any, **kwargs) -> Any:
+        remaining = self._candidates()
+        pending: Dict[Any, Backend] = {}
+        errors: List[Exception] = []
+
+        def start_next(release: Optional[Callable[[], None]] = None) -> bool:
+            backend = next(remaining, None)
+            if backend is None:
+                if release:
+                    release()
+                return False
+            future = _hedge_executor.submit(self._timed_invoke, backend, messages, kwargs)
+            if release:
+                # Held until the call ends, even after another backend has won
+                future.add_done_callback(lambda f: release())
+            pending[future] = backend
+            return True
+
+        start_next()
+        primary = next(iter(pending.values()))
+        delay = self._hedge_delay(primary, "invoke")
+        hedge_at = time.monotonic() + delay if delay is not None else None
+        while pending:
+            timeout = max(0.0, hedge_at - time.monotonic()) if hedge_at is not None else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedge_at = None
+                release = self._hedge_slot()
+                if release is not None and start_next(release):
+                    self._hedged()
+                continue
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    ai_msg = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                for other in pending:
+                    other.cancel()
+                self._won(backend)
+                return ai_msg
+            if not pending and start_next():
+                self._failed_over()
+        raise errors[-1] if errors else RuntimeError("no model backend available")
+
+    async def _timed_ainvoke(self, backend: Backend, messages: Any, kwargs: Dict[str, Any]) -> Any:
+        backend.counts["calls"] += 1
+        start = time.perf_counter()
+        try:
+            ai_msg = _check(await backend.model.ainvoke(messages, **kwargs))
+        except Exception as e:
+            backend.failed(e)
+            raise
+        backend.succeeded("invoke", time.perf_counter() - start)
+        return ai_msg
+
+    async def ainvoke(self, messages: Any, **kwargs) -> Any:
+        remaining = self._candidates()
+        pending: Dict[asyncio.Task, Backend] = {}
+        errors: List[Exception] = []
+
+        def start_next(release: Optional[Callable[[], None]] = None) -> bool:
+            backend = next(remaining, None)
+            if backend is None:
+                if release:
+                    release()
+                return False
+            task = asyncio.ensure_future(self._timed_ainvoke(backend, messages, kwargs))
+            if release:
+                task.add_done_callback(lambda t: release())
+            pending[task] = backend
+            return True
+
+        start_next()
+        primary = next(iter(pending.values()))
+        delay = self._hedge_delay(primary, "invoke")
+        hedge_at = time.monotonic() + delay if delay is not None else None
+        try:
+            while pending:
+                timeout = max(0.0, hedge_at - time.monotonic()) if hedge_at is not None else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_at = None
+                    release = self._hedge_slot()
+                    if release is not None and start_next(release):
+                        self._hedged()
+                    continue
+                for task in done:
+                    backend = pending.pop(task)
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+                    self._won(backend)
+                    return task.result()
+                if not pending and start_next():
+                    self._failed_over()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise errors[-1] if errors else RuntimeError("no model backend available")
+
+    def stream(self, messages: Any, **kwargs) -> Iterator[Any]:
+        events: "queue.Queue[Tuple[int, str, Any]]" = queue.Queue()
+        remaining = self._candidates()
+        started: List[Tuple[Backend, threading.Event]] = []
+        active = 0
+
+        def produce(index: int, backend: Backend, stop: threading.Event,
+                    release: Optional[Callable[[], None]]) -> None:
+            backend.counts["calls"] += 1
+            start = time.perf_counter()
+            first = True
+            try:
+                for chunk in backend.model.stream(messages, **kwargs):
+                    if stop.is_set():
+                        return
+                    if first:
+                        backend.succeeded("stream", time.perf_counter() - start)
+                        first = False
+                    events.put((index, "chunk", chunk))
+                if first:
+                    raise InvalidResponse("empty stream")
+                events.put((index, "end", None))
+            except Exception as e:
+                backend.failed(e)
+                events.put((index, "error", e))
+            finally:
+                if release:
+                    release()
+
+        def start_next(release: Optional[Callable[[], None]] = None) -> bool:
+            nonlocal active
+            backend = next(remaining, None)
+            if backend is None:
+                if release:
+                    release()
+                return False
+            stop = threading.Event()
+            started.append((backend, stop))
+            active += 1
+            threading.Thread(target=produce, args=(len(started) - 1, backend, stop, release),
+                             name=f"stream-{backend.name}", daemon=True).start()
+            return True
+
+        start_next()
+        delay = self._hedge_delay(started[0][0], "stream")
+        hedge_at = time.monotonic() + delay if delay is not None else None
+        winner = None
+        error = None
+        try:
+            while True:
+                timeout = max(0.0, hedge_at - time.monotonic()) if hedge_at is not None else None
+                try:
+                    index, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedge_at = None
+                    release = self._hedge_slot()
+                    if release is not None and start_next(release):
+                        self._hedged()
+                    continue
+                if winner is None:
+                    if kind == "chunk":
+                        winner = index
+                        hedge_at = None
+                        self._won(started[index][0])
+                        for i, (_, stop) in enumerate(started):
+                            if i != winner:
+                                stop.set()
+                        yield payload
+                        continue
+                    # An error before any output: fail over if nothing else is running
+                    error = payload
+                    active -= 1
+                    if not active:
+                        if not start_next():
+                            raise error
+                        self._failed_over()
+                    continue
+                if index != winner:
+                    continue
+                if kind == "chunk":
+                    yield payload
+                elif kind == "end":
+                    return
+                else:
+                    raise payload
+        finally:
+            for _, stop in started:
+                stop.set()
+
+    async def astream(self, messages: Any, **kwargs):
+        events: "asyncio.Queue[Tuple[int, str, Any]]" = asyncio.Queue()
+        remaining = self._candidates()
+        started: List[Tuple[Backend, asyncio.Task]] = []
+        active = 0
+
+        async def produce(index: int, backend: Backend) -> None:
+            backend.counts["calls"] += 1
+            start = time.perf_counter()
+            first = True
+            try:
+                async for chunk in backend.model.astream(messages, **kwargs):
+                    if first:
+                        backend.succeeded("stream", time.perf_counter() - start)
+                        first = False
+                    await events.put((index, "chunk", chunk))
+                if first:
+                    raise InvalidResponse("empty stream")
+                await events.put((index, "end", None))
+            except Exception as e:
+                backend.failed(e)
+                await events.put((index, "error", e))
+
+        def start_next(release: Optional[Callable[[], None]] = None) -> bool:
+            nonlocal active
+            backend = next(remaining, None)
+            if backend is None:
+                if release:
+                    release()
+                return False
+            active += 1
+            task = asyncio.ensure_future(produce(len(started), backend))
+            if release:
+                task.add_done_callback(lambda t: release())
+            started.append((backend, task))
+            return True
+
+        start_next()
+        delay = self._hedge_delay(started[0][0], "stream")
+        hedge_at = time.monotonic() + delay if delay is not None else None
+        winner = None
+        try:
+            while True:
+                timeout = max(0.0, hedge_at - time.monotonic()) if hedge_at is not None else None
+                try:
+                    index, kind, payload = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    hedge_at = None
+                    release = self._hedge_slot()
+                    if release is not None and start_next(release):
+                        self._hedged()
+                    continue
+                if winner is None:
+                    if kind == "chunk":
+                        winner = index
+                        hedge_at = None
+                        self._won(started[index][0])
+                        for i, (_, task) in enumerate(started):
+                            if i != winner:
+                                task.cancel()
+                        yield payload
+                        continue
+                    active -= 1
+                    if not active:
+                        if not start_next():
+                            raise payload
+                        self._failed_over()
+                    continue
+                if index != winner:
+                    continue
+                if kind == "chunk":
+                    yield payload
+                elif kind == "end":
+                    return
+                else:
+                    raise payload
+        finally:
+            for _, task in started:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counts,
+            "backends": {
+                b.name: {
+                    **b.counts,
+                    "breaker": b.breaker.state,
+                    "p50_ms": _ms(b.latency["invoke"].percentile(50)),
+                    "p95_ms": _ms(b.latency["invoke"].percentile(95)),
+                } for b in self.backends
+            },
+        }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return seconds * 1000 if seconds is not None else None
@@ -0,0 +1,266 @@
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+import asyncio
+import itertools
+import logging
+import os
+import threading
+import time
+
+from cache import MISSING, TTLCache
+from intake import ignore_unawaited
+from manager import conversation_managers
+from scheduler import is_rate_limit, retry_after
+from slack_stream import PLACEHOLDER_TEXT
+from telemetry import metrics, span
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_ENABLED = os.getenv('SLACK_BACKFILL', 'true').lower() == 'true'
+
+# Message subtypes that carry something someone said in the thread
+_CONVERSATION_SUBTYPES = (None, "thread_broadcast", "bot_message", "file_share")
+
+
+def thread_history(replies: List[Dict[str, Any]], bot_user_id: str, before_ts: str,
+                   mentioned: bool = False) -> Optional[List[Dict[str, Any]]]:
+    """Map a thread's Slack messages to history messages, or None if the bot isn't part of the thread.
+
+    The bot's replies become assistant messages and everyone else's user
+    messages. Messages at or after before_ts are left out, since the event
+    being handled adds its own. So are the bot's placeholder and its block
+    messages (approvals, statuses and job progress), which aren't replies.
+    """
+    mention = f"<@{bot_user_id}>"
+    related = mentioned
+    history = []
+    for reply in replies:
+        if float(reply["ts"]) >= float(before_ts) or reply.get("subtype") not in _CONVERSATION_SUBTYPES:
+            continue
+        text = reply.get("text", "")
+        if reply.get("user") == bot_user_id:
+            related = True
+            if reply.get("blocks") or text == PLACEHOLDER_TEXT:
+                continue
+            history.append({"role": "assistant", "content": text})
+        else:
+            related = related or mention in text
+            history.append({"role": "user", "content": text})
+    return history if related else None
+
+
+class ThreadBackfill:
+    """Rebuilds conversations for threads this process holds no state for.
+
+    That happens after a restart without a store, after an eviction, or for
+    threads another process handled. The thread is fetched with paginated
+    conversations.replies calls and, if the bot took part in it or was
+    mentioned, imported into a new manager's history. Only the root message
+    and the newest max_messages - 1 replies are imported. Slack returns
+    replies oldest first, so a thread longer than max_pages pages is cut off
+    at the last page read.
+
+    Concurrent events in one thread share a single fetch. Threads found to be
+    unrelated are remembered for cache_ttl seconds, so chatter in them doesn't
+    trigger a fetch per message. Related ones need no cache, since they now
+    live in the conversation registry. Rate-limited calls are retried after
+    the Retry-After Slack sends, or with exponential backoff.
+    """
+
+    def __init__(self, max_messages: int = 200, page_size: int = 200, max_pages: int = 10,
+                 max_retries: int = 5, base_backoff: float = 1.0, max_backoff: float = 30.0,
+                 cache_ttl: float = 60.0, cache_size: int = 4096):
+        self.max_messages = max_messages
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.unrelated = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._ainflight: Dict[str, asyncio.Future] = {}
+        self.fetches = 0
+        self.pages = 0
+        self.rate_limited = 0
+        self.coalesced = 0
+        self.imported = 0
+
+    def _backoff(self, error: Exception, attempt: int) -> float:
+        delay = retry_after(error)
+        if delay is None:
+            delay = min(self.max_backoff, self.base_backoff * 2 ** attempt)
+        with self._lock:
+            self.rate_limited += 1
+        metrics.inc("slack_rate_limited_total", (("method", "conversations.replies"),))
+        logger.warning("conversations.replies rate limited, retrying in %.1fs (attempt %d)", delay, attempt + 1)
+        return delay
+
+    def _collect(self, response: Dict[str, Any], page: int, thread_ts: str, collected: Dict[str, Any]) -> Optional[str]:
+        """Add one page to collected and return the next cursor, if there is one to read."""
+        for reply in response.get("messages", []):
+            if reply.get("ts") == thread_ts:
+                # Every page repeats the parent message
+                collected["root"] = collected["root"] or reply
+            else:
+                collected["recent"].append(reply)
+        cursor = (response.get("response_metadata") or {}).get("next_cursor")
+        if not response.get("has_more") or not cursor or page >= self.max_pages:
+            return None
+        return cursor
+
+    def _new_collection(self) -> Dict[str, Any]:
+        return {"root": None, "recent": deque(maxlen=max(0, self.max_messages - 1))}
+
+    def _finish_fetch(self, collected: Dict[str, Any], pages: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            self.fetches += 1
+            self.pages += pages
+        root = [collected["root"]] if collected["root"] else []
+        return root + list(collected["recent"])
+
+    def fetch(self, client: Any, channel: str, thread_ts: str) -> List[Dict[str, Any]]:
+        """Fetch the thread's root and newest replies, oldest first."""
+        collected = self._new_collection()
+        cursor = None
+        for page in itertools.count(1):
+            for attempt in itertools.count():
+                try:
+                    response = client.conversations_replies(channel=channel, ts=thread_ts, limit=self.page_size,
+                                                            cursor=cursor)
+                    break
+                except Exception as e:
+                    if not is_rate_limit(e) or attempt >= self.max_retries:
+                        raise
+                    time.sleep(self._backoff(e, attempt))
+            cursor = self._collect(response, page, thread_ts, collected)
+            if cursor is None:
+                return self._finish_fetch(collected, page)
+
+    async def afetch(self, client: Any, channel: str, thread_ts: str) -> List[Dict[str, Any]]:
+        """Async variant of fetch."""
+        collected = self._new_collection()
+        cursor = None
+        for page in itertools.count(1):
+            for attempt in itertools.count():
+                try:
+                    response = await client.conversations_replies(channel=channel, ts=thread_ts,
+                                                                  limit=self.page_size, cursor=cursor)
+                    break
+                except Exception as e:
+                    if not is_rate_limit(e) or attempt >= self.max_retries:
+                        raise
+                    await asyncio.sleep(self._backoff(e, attempt))
+            cursor = self._collect(response, page, thread_ts, collected)
+            if cursor is None:
+                return self._finish_fetch(collected, page)
+
+    def _import(self, conversation_id: str, history: Optional[List[Dict[str, Any]]]) -> bool:
+        if history is None:
+            self.unrelated.set(conversation_id, True)
+            metrics.inc("thread_backfills_total", (("result", "unrelated"),))
+            return False
+        manager = conversation_managers.get_or_create(conversation_id)
+        with manager.lock:
+            manager.messages.extend(history)
+        with self._lock:
+            self.imported += 1
+        metrics.inc("thread_backfills_total", (("result", "imported"),))
+        logger.info("Backfilled conversation %s with %d messages", conversation_id, len(history))
+        return True
+
+    def _known(self, conversation_id: str, mentioned: bool, active: bool) -> Optional[bool]:
+        """True or False if the answer is already known without a fetch, else None.
+
+        active says whether the registry already has the conversation.
+        """
+        if active:
+            return True
+        if not mentioned and self.unrelated.get(conversation_id) is not MISSING:
+            return False
+        return None
+
+    def resume(self, client: Any, channel: str, thread_ts: str, before_ts: str, bot_user_id: str,
+               mentioned: bool = False) -> bool:
+        """Make sure the thread has a conversation, backfilling it from Slack if needed.
+
+        Returns False if the bot has nothing to do with the thread.
+        """
+        conversation_id = channel + "::" + thread_ts
+        known = self._known(conversation_id, mentioned, conversation_id in conversation_managers)
+        if known is not None:
+            return known
+        with self._lock:
+            future = self._inflight.get(conversation_id)
+            leader = future is None
+            if leader:
+                future = self._inflight[conversation_id] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            # Another fetch may have finished between the check and taking the lead
+            known = self._known(conversation_id, mentioned, conversation_id in conversation_managers)
+            if known is None:
+                with span("backfill"):
+                    replies = self.fetch(client, channel, thread_ts)
+                known = self._import(conversation_id, thread_history(replies, bot_user_id, before_ts, mentioned))
+            future.set_result(known)
+            return known
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[conversation_id]
+
+    async def aresume(self, client: Any, channel: str, thread_ts: str, before_ts: str, bot_user_id: str,
+                      mentioned: bool = False) -> bool:
+        """Async variant of resume."""
+        conversation_id = channel + "::" + thread_ts
+        known = self._known(conversation_id, mentioned, await conversation_managers.acontains(conversation_id))
+        if known is not None:
+            return known
+        future = self._ainflight.get(conversation_id)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        # Only coalesced callers await it
+        future = self._ainflight[conversation_id] = ignore_unawaited(asyncio.get_running_loop().create_future())
+        try:
+            with span("backfill"):
+                replies = await self.afetch(client, channel, thread_ts)
+            # Creating the conversation may read the store
+            known = await asyncio.to_thread(self._import, conversation_id,
+                                            thread_history(replies, bot_user_id, before_ts, mentioned))
+            future.set_result(known)
+            return known
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._ainflight[conversation_id]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "fetches": self.fetches,
+                "pages": self.pages,
+                "coalesced": self.coalesced,
+                "imported": self.imported,
+                "rate_limited": self.rate_limited,
+                "unrelated_cached": len(self.unrelated),
+            }
+
+
+thread_backfill = ThreadBackfill(
+    max_messages=int(os.getenv('BACKFILL_MAX_MESSAGES', '200')),
+    page_size=int(os.getenv('BACKFILL_PAGE_SIZE', '200')),
+    max_pages=int(os.getenv('BACKFILL_MAX_PAGES', '10')),
+    cache_ttl=float(os.getenv('BACKFILL_CACHE_TTL', '60'))
+)
@@ -0,0 +1,278 @@
+"""Local stand-ins for the chat model and the Slack Web API used by benchmarks.
+
+Nothing here talks to the network: latency, tool calls and token counts are
+scripted so runs are repeatable.
+"""
+import asyncio
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from history import message_content, message_role
+
+Latency = Union[float, Callable[[], float]]
+
+
+def _seconds(latency: Latency) -> float:
+    return latency() if callable(latency) else latency
+
+
+class FakeRateLimitError(Exception):
+    """Stands in for a provider's HTTP 429."""
+    status_code = 429
+
+
+class FakeSlackResponse:
+    def __init__(self, status_code: int, headers: Dict[str, str]):
+        self.status_code = status_code
+        self.headers = headers
+
+
+class FakeSlackRateLimitError(Exception):
+    """Stands in for slack_sdk's SlackApiError on an HTTP 429, with its Retry-After header."""
+
+    def __init__(self, retry_after: str):
+        super().__init__("ratelimited")
+        self.response = FakeSlackResponse(429, {"Retry-After": retry_after})
+
+
+def lognormal_latency(median: float, sigma: float, seed: Optional[int] = None) -> Callable[[], float]:
+    """Latency distribution with the long right tail typical of LLM APIs."""
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    mu = math.log(median) if median > 0 else 0.0
+
+    def sample() -> float:
+        if median <= 0:
+            return 0.0
+        with lock:
+            return rng.lognormvariate(mu, sigma)
+    return sample
+
+
+class FakeChatModel:
+    """Scripted chat model with the invoke/stream surface LangGraphManager uses.
+
+    After a user message it calls to_upper with probability tool_rate, or the
+    approval-gated random_string with probability approval_rate. Otherwise, and
+    after tool results, it answers with reply_tokens words. latency is the time
+    to the first token, either fixed or drawn from a callable; token_latency
+    spaces out streamed words. A share error_rate of calls fails with a rate
+    limit error after the latency.
+    """
+
+    def __init__(self, latency: Latency = 0.0, token_latency: float = 0.0, reply_tokens: int = 50,
+                 tool_rate: float = 0.0, approval_rate: float = 0.0, seed: Optional[int] = None,
+                 name: str = "fake", error_rate: float = 0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.reply_tokens = reply_tokens
+        self.tool_rate = tool_rate
+        self.approval_rate = approval_rate
+        self.error_rate = error_rate
+        self.name = name
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._ids = itertools.count()
+        self.calls = 0
+
+    def bind_tools(self, tools: List[Any], **kwargs) -> "FakeChatModel":
+        return self
+
+    def _roll(self) -> float:
+        with self._random_lock:
+            return self._random.random()
+
+    def _reply(self, messages: List[Any]) -> AIMessage:
+        self.calls += 1
+        if self.error_rate and self._roll() < self.error_rate:
+            raise FakeRateLimitError(f"{self.name} is rate limited")
+        input_tokens = sum(len(message_content(m)) // 4 + 4 for m in messages)
+        if message_role(messages[-1]) == "user":
+            roll = self._roll()
+            if roll < self.approval_rate:
+                return self._tool_call("random_string", {"random_number": 7}, input_tokens)
+            if roll < self.approval_rate + self.tool_rate:
+                return self._tool_call("to_upper", {"input_text": message_content(messages[-1])[:64]}, input_tokens)
+        content = " ".join(f"word{i}" for i in range(self.reply_tokens))
+        return AIMessage(
+            content=content,
+            usage_metadata={"input_tokens": input_tokens, "output_tokens": self.reply_tokens,
+                            "total_tokens": input_tokens + self.reply_tokens}
+        )
+
+    def _tool_call(self, name: str, args: Dict[str, Any], input_tokens: int) -> AIMessage:
+        return AIMessage(
+            content="",
+            tool_calls=[{"name": name, "args": args, "id": f"call_{next(self._ids)}", "type": "tool_call"}],
+            usage_metadata={"input_tokens": input_tokens, "output_tokens": 10, "total_tokens": input_tokens + 10}
+        )
+
+    def invoke(self, messages: List[Any], **kwargs) -> AIMessage:
+        time.sleep(_seconds(self.latency) + self.token_latency * self.reply_tokens)
+        return self._reply(list(messages))
+
+    async def ainvoke(self, messages: List[Any], **kwargs) -> AIMessage:
+        await asyncio.sleep(_seconds(self.latency) + self.token_latency * self.reply_tokens)
+        return self._reply(list(messages))
+
+    def _chunks(self, reply: AIMessage) -> List[AIMessageChunk]:
+        if reply.tool_calls:
+            return [AIMessageChunk(
+                content="",
+                tool_call_chunks=[{"name": tc["name"], "args": json.dumps(tc["args"]), "id": tc["id"], "index": i}
+                                  for i, tc in enumerate(reply.tool_calls)],
+                usage_metadata=reply.usage_metadata
+            )]
+        words = reply.content.split(" ")
+        chunks = [AIMessageChunk(content=(" " if i else "") + w) for i, w in enumerate(words)]
+        chunks[-1] = AIMessageChunk(content=chunks[-1].content, usage_metadata=reply.usage_metadata)
+        return chunks
+
+    def stream(self, messages: List[Any], **kwargs):
+        time.sleep(_seconds(self.latency))
+        for chunk in self._chunks(self._reply(list(messages))):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield chunk
+
+    async def astream(self, messages: List[Any], **kwargs):
+        await asyncio.sleep(_seconds(self.latency))
+        for chunk in self._chunks(self._reply(list(messages))):
+            if self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            yield chunk
+
+
+class FakeSlackClient:
+    """In-memory Slack Web API client that records calls and simulates API latency.
+
+    Posted messages, and user messages added with add_message, are kept per
+    thread and served back by conversations_replies, with pagination. Every
+    rate_limit_every-th call to it fails with a 429 asking for a retry after
+    rate_limit_retry_after seconds.
+    """
+
+    def __init__(self, latency: Latency = 0.0, bot_user_id: str = "UBOT", rate_limit_every: int = 0,
+                 rate_limit_retry_after: str = "1"):
+        self.latency = latency
+        self.bot_user_id = bot_user_id
+        self.rate_limit_every = rate_limit_every
+        self.rate_limit_retry_after = rate_limit_retry_after
+        self.calls: Dict[str, int] = {}
+        self.posted: List[Dict[str, Any]] = []
+        self.threads: Dict[tuple, List[Dict[str, Any]]] = {}
+        self._by_ts: Dict[tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._ts = itertools.count(1)
+
+    def _call(self, method: str) -> None:
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        delay = _seconds(self.latency)
+        if delay:
+            time.sleep(delay)
+
+    def next_ts(self) -> str:
+        with self._lock:
+            return f"{1700000000 + next(self._ts)}.000100"
+
+    def auth_test(self, **kwargs) -> Dict[str, Any]:
+        self._call("auth.test")
+        return {"ok": True, "user_id": self.bot_user_id}
+
+    def add_message(self, channel: str, user: str, text: str, ts: str, thread_ts: Optional[str] = None) -> None:
+        """Record a message someone else sent, as Slack would before delivering its event."""
+        self._store(channel, {"type": "message", "user": user, "text": text, "ts": ts, "thread_ts": thread_ts or ts})
+
+    def _store(self, channel: str, message: Dict[str, Any]) -> None:
+        with self._lock:
+            self.threads.setdefault((channel, message["thread_ts"]), []).append(message)
+            self._by_ts[(channel, message["ts"])] = message
+
+    def chat_postMessage(self, channel: str, text: str = None, blocks=None, thread_ts: str = None, **kwargs) -> Dict[str, Any]:
+        self._call("chat.postMessage")
+        ts = self.next_ts()
+        message = {"channel": channel, "ts": ts, "text": text, "blocks": blocks, "thread_ts": thread_ts}
+        with self._lock:
+            self.posted.append(message)
+        self._store(channel, {"type": "message", "user": self.bot_user_id, "bot_id": "BBOT", "text": text,
+                              "blocks": blocks, "ts": ts, "thread_ts": thread_ts or ts})
+        return {"ok": True, "channel": channel, "ts": ts, "message": message}
+
+    def chat_update(self, channel: str, ts: str, text: str = None, blocks=None, **kwargs) -> Dict[str, Any]:
+        self._call("chat.update")
+        with self._lock:
+            message = self._by_ts.get((channel, ts))
+            if message is not None:
+                message["text"] = text
+                if blocks is not None:
+                    message["blocks"] = blocks
+        return {"ok": True, "channel": channel, "ts": ts}
+
+    def conversations_replies(self, channel: str, ts: str, cursor: Optional[str] = None, limit: int = 200,
+                              **kwargs) -> Dict[str, Any]:
+        self._call("conversations.replies")
+        with self._lock:
+            calls = self.calls["conversations.replies"]
+            thread = sorted(self.threads.get((channel, ts), []), key=lambda m: float(m["ts"]))
+        if self.rate_limit_every and calls % self.rate_limit_every == 0:
+            raise FakeSlackRateLimitError(self.rate_limit_retry_after)
+        if not thread:
+            return {"ok": False, "error": "thread_not_found", "messages": []}
+        # Like Slack, every page starts with the parent message
+        start = int(cursor) if cursor else 1
+        page = [thread[0]] + thread[start:start + limit - 1]
+        has_more = start + limit - 1 < len(thread)
+        return {"ok": True, "messages": [dict(m) for m in page], "has_more": has_more,
+                "response_metadata": {"next_cursor": str(start + limit - 1) if has_more else ""}}
+
+    def say_for(self, channel: str) -> Callable[..., Dict[str, Any]]:
+        """Build the say() Bolt would inject for an event in channel."""
+        def say(text: str = None, blocks=None, thread_ts: str = None, **kwargs):
+            return self.chat_postMessage(channel=channel, text=text, blocks=blocks, thread_ts=thread_ts)
+        return say
+
+
+def install_fake_model(latency: float = 0.0, latency_jitter: float = 0.0, latency_sigma: float = 0.0,
+                       seed: Optional[int] = None, backends: int = 1, **kwargs) -> Any:
+    """Register a FakeChatModel as the shared model, with and without tools bound.
+
+    latency_jitter adds normally distributed noise to latency; latency_sigma
+    instead draws it from a lognormal distribution with latency as median.
+    With several backends, each gets its own fake and latency stream behind a
+    HedgedModel.
+
+    Takes only plain values, so it can be pickled and run as a worker process
+    initializer.
+    """
+    import manager
+    from backends import Backend, HedgedModel
+
+    def fake(index: int) -> FakeChatModel:
+        backend_seed = None if seed is None else seed + index
+        sample: Latency = latency
+        if latency_sigma:
+            sample = lognormal_latency(latency, latency_sigma, backend_seed)
+        elif latency_jitter:
+            jitter = random.Random(backend_seed)
+            sample = lambda: max(0.0, jitter.gauss(latency, latency_jitter))
+        return FakeChatModel(latency=sample, seed=backend_seed, name=f"fake{index}", **kwargs)
+
+    model = fake(0) if backends <= 1 else HedgedModel([Backend(f"fake{i}", fake(i)) for i in range(backends)])
+    manager.register_model(model)
+    manager.register_model(model, tools=[])
+    return model
+
+
+def model_calls(model: Any) -> int:
+    """Calls made to the fake(s) behind model."""
+    if hasattr(model, "backends"):
+        return sum(b.model.calls for b in model.backends)
+    return model.calls
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""Load and latency benchmark driven by a local fake LLM and fake Slack client.
+
+Runs N conversations of T turns each over a pool of C concurrent workers,
+either straight through LangGraphManager.process_message ("manager"),
+through aprocess_message on one event loop ("manager-async"), through the
+slack.py handlers ("slack"), or through the sharding.py front end and its
+worker processes ("sharded"), and writes a JSON report.
+
+    python -m benchmarks.load --mode slack --conversations 200 --turns 3 \\
+        --concurrency 32 --latency 0.2 --tool-rate 0.3 --approval-rate 0.1 \\
+        --output bench.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('SLACK_BOT_TOKEN', 'xoxb-benchmark')
+os.environ.setdefault('SLACK_TOKEN_VERIFICATION', 'false')
+os.environ.setdefault('OPENAI_API_KEY', 'sk-benchmark')
+
+import logging
+
+import functools
+
+from benchmarks.fakes import FakeSlackClient, install_fake_model, model_calls
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    """Collects turn latencies and samples concurrency while a run is in progress."""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._samples: List[Dict[str, int]] = []
+        self._stop = threading.Event()
+
+    def turn(self, fn, *args, **kwargs) -> Any:
+        with self._lock:
+            self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.in_flight -= 1
+                self.latencies.append(elapsed)
+
+    async def aturn(self, coro) -> Any:
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            return await coro
+        except Exception:
+            self.errors += 1
+        finally:
+            self.in_flight -= 1
+            self.latencies.append(time.perf_counter() - start)
+
+    def sample(self, interval: float = 0.01) -> None:
+        import manager
+        from scheduler import scheduler
+        while not self._stop.wait(interval):
+            self._samples.append({
+                "in_flight": self.in_flight,
+                "tool_queue": manager._tool_pool.qsize(),
+                "model_queue": scheduler.stats()["queued"],
+                "threads": threading.active_count(),
+            })
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def saturation(self) -> Dict[str, Any]:
+        samples = self._samples or [{"in_flight": 0, "tool_queue": 0, "model_queue": 0, "threads": threading.active_count()}]
+        return {
+            "workers": self.concurrency,
+            "mean_busy_workers": statistics.mean(s["in_flight"] for s in samples),
+            "busy_fraction": statistics.mean(s["in_flight"] for s in samples) / self.concurrency,
+            "max_tool_queue": max(s["tool_queue"] for s in samples),
+            "mean_tool_queue": statistics.mean(s["tool_queue"] for s in samples),
+            "max_model_queue": max(s["model_queue"] for s in samples),
+            "max_os_threads": max(s["threads"] for s in samples),
+        }
+
+
+def approves(args, conversation: int, turn: int) -> bool:
+    """Deterministically approve or cancel a pending approval according to --cancel-rate."""
+    return (conversation * 31 + turn) % 100 >= args.cancel_rate * 100
+
+
+def run_manager(args, recorder: Recorder) -> None:
+    import manager
+
+    def conversation(c: int) -> None:
+        conversation_id = f"C{c % args.channels}::{c}"
+        mgr = manager.get_or_create_manager(conversation_id)
+        for t in range(args.turns):
+            response, tool_info = recorder.turn(mgr.process_message, f"turn {t} of conversation {c}", conversation_id) or ("", {})
+            if tool_info and "pending_tool_calls" in tool_info:
+                recorder.turn(mgr.process_message, "", conversation_id, approved_functions=approves(args, c, t))
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(conversation, range(args.conversations)))
+
+
+def run_manager_async(args, recorder: Recorder) -> None:
+    import manager
+
+    async def conversation(c: int, limit: asyncio.Semaphore) -> None:
+        conversation_id = f"C{c % args.channels}::{c}"
+        async with limit:
+            mgr = manager.get_or_create_manager(conversation_id)
+            for t in range(args.turns):
+                result = await recorder.aturn(mgr.aprocess_message(f"turn {t} of conversation {c}", conversation_id))
+                if result and result[1] and "pending_tool_calls" in result[1]:
+                    await recorder.aturn(mgr.aprocess_message("", conversation_id, approved_functions=approves(args, c, t)))
+
+    async def main():
+        limit = asyncio.Semaphore(args.concurrency)
+        await asyncio.gather(*(conversation(c, limit) for c in range(args.conversations)))
+
+    asyncio.run(main())
+
+
+def run_slack(args, recorder: Recorder, client: FakeSlackClient) -> None:
+    import manager
+    import slack
+
+    def wait(future) -> None:
+        if future is not None:
+            future.result()
+
+    def conversation(c: int) -> None:
+        channel = f"C{c % args.channels}"
+        say = client.say_for(channel)
+        root_ts = client.next_ts()
+        for t in range(args.turns):
+            event = {"type": "message", "channel": channel, "user": f"U{c}", "ts": client.next_ts(),
+                     "text": f"<@{client.bot_user_id}> turn {t} of conversation {c}"}
+            if t:
+                event["thread_ts"] = root_ts
+            else:
+                event["ts"] = root_ts
+            client.add_message(channel, event["user"], event["text"], event["ts"], event.get("thread_ts"))
+            if t and (c * 13 + t) % 100 < args.forget_rate * 100:
+                # As if the process had restarted: the thread has to be backfilled from Slack
+                manager.conversation_managers.discard(f"{channel}::{root_ts}")
+            body = {"event_id": f"Ev{c}x{t}", "event": event}
+            # Message events are queued; a turn ends when its work item finishes
+            recorder.turn(lambda: wait(slack.handle_message(event=event, say=say, client=client, body=body)))
+            if (c * 17 + t) % 100 < args.redelivery_rate * 100:
+                # Slack retrying an event it thinks timed out; intake should drop it
+                wait(slack.handle_message(event=event, say=say, client=client, body=body))
+
+            conversation_id = f"{channel}::{root_ts}"
+            mgr = manager.conversation_managers[conversation_id] if conversation_id in manager.conversation_managers else None
+            if mgr is not None and mgr.pendig_approval:
+                body = {"actions": [{"value": conversation_id}], "channel": {"id": channel},
+                        "message": {"ts": mgr.approval_message_ts, "thread_ts": root_ts}}
+                handler = slack.handle_approval if approves(args, c, t) else slack.handle_cancellation
+                # Clicks are queued too; the resumed turn ends when its work item finishes
+                recorder.turn(lambda: wait(handler(ack=lambda: None, body=body, say=say, client=client)))
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(conversation, range(args.conversations)))
+
+
+def init_shard_worker(model_kwargs: Dict[str, Any]) -> None:
+    # Tools print to stdout, which worker processes share with the report
+    sys.stdout = sys.stderr
+    install_fake_model(**model_kwargs)
+
+
+def run_sharded(args, recorder: Recorder, client: FakeSlackClient, model_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    from intake import admission
+    from sharding import ShardRouter
+    router = ShardRouter(
+        workers=args.workers,
+        client_factory=functools.partial(FakeSlackClient, latency=args.slack_latency),
+        initializer=functools.partial(init_shard_worker, model_kwargs),
+        admission=admission
+    )
+    router.start()
+    if args.kill_worker_after:
+        # Simulate a crash; its in-flight events should be replayed on the restarted worker
+        threading.Timer(args.kill_worker_after, router.restart, (0,), {"graceful": False}).start()
+
+    def wait(future) -> Dict[str, Any]:
+        result = future.result() if future is not None else {}
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return result
+
+    def conversation(c: int) -> None:
+        channel = f"C{c % args.channels}"
+        root_ts = client.next_ts()
+        for t in range(args.turns):
+            event = {"type": "message", "channel": channel, "user": f"U{c}", "ts": client.next_ts(),
+                     "text": f"<@{client.bot_user_id}> turn {t} of conversation {c}"}
+            if t:
+                event["thread_ts"] = root_ts
+            else:
+                event["ts"] = root_ts
+            body = {"event_id": f"Ev{c}x{t}", "event": event}
+            context = {"bot_user_id": client.bot_user_id}
+            say = client.say_for(channel)
+            result = recorder.turn(lambda: wait(router.route_event(event, body=body, context=context, say=say)))
+            if result and "approval_message_ts" in result:
+                body = {"actions": [{"value": f"{channel}::{root_ts}"}], "channel": {"id": channel},
+                        "message": {"ts": result["approval_message_ts"], "thread_ts": root_ts}}
+                kind = "approve" if approves(args, c, t) else "cancel"
+                recorder.turn(lambda: wait(router.route_action(kind, body)))
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(conversation, range(args.conversations)))
+    finally:
+        router.stop()
+    return router.stats()
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['manager', 'manager-async', 'slack', 'sharded'], default='manager')
+    parser.add_argument('--conversations', type=int, default=100)
+    parser.add_argument('--turns', type=int, default=3, help="user messages per conversation")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.05, help="fake model time to first token (s)")
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help="std dev added to --latency (s)")
+    parser.add_argument('--latency-sigma', type=float, default=0.0,
+                        help="draw latency from a lognormal with --latency as median and this sigma")
+    parser.add_argument('--backends', type=int, default=1, help="fake model backends behind a HedgedModel")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of fake model calls that are rate limited")
+    parser.add_argument('--token-latency', type=float, default=0.0, help="fake model delay per token (s)")
+    parser.add_argument('--reply-tokens', type=int, default=50)
+    parser.add_argument('--tool-rate', type=float, default=0.2)
+    parser.add_argument('--approval-rate', type=float, default=0.05)
+    parser.add_argument('--cancel-rate', type=float, default=0.5, help="share of approvals answered with Cancel")
+    parser.add_argument('--redelivery-rate', type=float, default=0.0, help="share of Slack events delivered twice")
+    parser.add_argument('--slack-latency', type=float, default=0.01, help="fake Slack API latency (s)")
+    parser.add_argument('--forget-rate', type=float, default=0.0,
+                        help="share of thread replies whose conversation is dropped first, forcing a backfill")
+    parser.add_argument('--slack-rate-limit-every', type=int, default=0,
+                        help="rate limit every Nth conversations.replies call to the fake Slack API")
+    parser.add_argument('--workers', type=int, default=4, help="worker processes in sharded mode")
+    parser.add_argument('--kill-worker-after', type=float, default=0.0, help="kill shard worker 0 after this many seconds")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    model_kwargs = dict(latency=args.latency, latency_jitter=args.latency_jitter, latency_sigma=args.latency_sigma,
+                        backends=args.backends, error_rate=args.error_rate, token_latency=args.token_latency,
+                        reply_tokens=args.reply_tokens, tool_rate=args.tool_rate, approval_rate=args.approval_rate,
+                        seed=args.seed)
+    client = FakeSlackClient(latency=args.slack_latency, rate_limit_every=args.slack_rate_limit_every,
+                             rate_limit_retry_after="0.1")
+
+    import manager
+    # In sharded mode the model runs in the worker processes instead
+    model = install_fake_model(**model_kwargs) if args.mode != 'sharded' else None
+    if args.mode == 'slack':
+        import slack
+    logging.getLogger().setLevel(logging.WARNING)
+
+    recorder = Recorder(args.concurrency)
+    sampler = threading.Thread(target=recorder.sample, daemon=True)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sampler.start()
+    start = time.perf_counter()
+    # Tools print to stdout; keep it clean for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.mode == 'manager':
+            run_manager(args, recorder)
+        elif args.mode == 'manager-async':
+            run_manager_async(args, recorder)
+        elif args.mode == 'slack':
+            run_slack(args, recorder, client)
+        else:
+            shards = run_sharded(args, recorder, client, model_kwargs)
+    elapsed = time.perf_counter() - start
+    recorder.stop()
+    sampler.join()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    registry = manager.conversation_managers.stats()
+    from scheduler import scheduler
+    latencies_ms = [s * 1000 for s in recorder.latencies]
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "turns": len(latencies_ms),
+        "errors": recorder.errors,
+        "elapsed_s": elapsed,
+        "throughput_turns_per_s": len(latencies_ms) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "mean": statistics.mean(latencies_ms) if latencies_ms else 0.0,
+            "p50": percentile(latencies_ms, 50),
+            "p95": percentile(latencies_ms, 95),
+            "p99": percentile(latencies_ms, 99),
+            "max": max(latencies_ms, default=0.0),
+        },
+        "memory": {
+            # ru_maxrss is in KiB on Linux
+            "rss_growth_bytes_per_conversation": (rss_after - rss_before) * 1024 / max(1, args.conversations),
+            "estimated_history_bytes_per_conversation": registry["estimated_bytes"] / max(1, registry["conversations"]),
+        },
+        "saturation": recorder.saturation(),
+        # Counted inside the worker processes in sharded mode
+        "model_calls": model_calls(model) if model else None,
+        "slack_calls": client.calls if model else None,
+        "registry": registry,
+        "scheduler": scheduler.stats(),
+    }
+    if args.mode == 'slack':
+        from intake import event_deduper
+        report["duplicate_events_dropped"] = event_deduper.duplicates
+        from backfill import thread_backfill
+        report["backfill"] = thread_backfill.stats()
+        from intake import admission
+        report["admission"] = admission.stats()
+    if args.mode == 'sharded':
+        report["shards"] = shards
+    if hasattr(model, "stats"):
+        report["backends"] = model.stats()
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Micro-benchmark for the cost of creating a LangGraphManager.
+
+Compares the old per-conversation construction (fresh chat model client,
+bind_tools and a read of system.md for every manager) with the shared model
+and system prompt caches. No requests are sent to the model provider.
+
+    python -m benchmarks.manager_creation --iterations 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('OPENAI_API_KEY', 'sk-benchmark')
+
+from langchain.chat_models import init_chat_model
+
+import manager
+from tool_registry import tool_schemas
+from tools import AVAILABLE_TOOLS
+
+
+def create_uncached() -> None:
+    """Reproduce the construction path from before the shared caches."""
+    llm = init_chat_model(
+        os.getenv('MODEL_NAME', 'gpt-4o'),
+        model_provider=os.getenv('MODEL_PROVIDER', 'openai'),
+        max_tokens=1024*8
+    )
+    llm.bind_tools(tool_schemas(AVAILABLE_TOOLS))
+    with open(manager.SYSTEM_PATH, 'r') as f:
+        f.read()
+
+
+def create_cached() -> None:
+    manager.LangGraphManager()
+
+
+def measure(fn, iterations: int) -> list:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label: str, timings: list) -> None:
+    print(f"{label:<8} mean {statistics.mean(timings):8.3f} ms  "
+          f"p50 {statistics.median(timings):8.3f} ms  max {max(timings):8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    # Warm imports and the shared caches so only steady-state cost is measured.
+    create_uncached()
+    create_cached()
+
+    before = measure(create_uncached, args.iterations)
+    after = measure(create_cached, args.iterations)
+    report("before", before)
+    report("after", after)
+    print(f"speedup  {statistics.mean(before) / statistics.mean(after):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
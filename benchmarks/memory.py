@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Memory benchmark for conversation history.
+
+Builds the same conversations twice, once as the raw tuples, dicts and
+LangChain messages the model and tools return, and once as a
+ConversationHistory of compact records. It measures traced memory per
+conversation for each, then the cost of converting a history back to
+LangChain messages with and without the prefix cache.
+
+    python -m benchmarks.memory --conversations 10000 --turns 50
+"""
+import argparse
+import gc
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+from history import ConversationHistory
+
+SYSTEM = ("system", "You are called Batman")
+
+
+def _response_metadata(finish_reason: str, output_tokens: int):
+    # Shaped like what langchain-openai attaches to every reply
+    return {
+        "response_metadata": {
+            "token_usage": {"completion_tokens": output_tokens, "prompt_tokens": 900,
+                            "total_tokens": 900 + output_tokens},
+            "model_name": "gpt-4o-2024-08-06",
+            "system_fingerprint": "fp_7c9d7c8a4f",
+            "finish_reason": finish_reason,
+            "logprobs": None,
+        },
+        "usage_metadata": {"input_tokens": 900, "output_tokens": output_tokens, "total_tokens": 900 + output_tokens},
+        "id": f"run-{uuid.uuid4()}",
+    }
+
+
+def turn(conversation: int, number: int, tool_every: int):
+    """The messages one user turn adds: the question, a tool round trip every tool_every turns, and the reply."""
+    yield {"role": "user", "content": f"Conversation {conversation}, question {number}: "
+                                      + "could you check the meeting room bookings for next week " * 2}
+    if tool_every and number % tool_every == 0:
+        call_id = f"call_{uuid.uuid4().hex[:24]}"
+        yield AIMessage(content="", tool_calls=[{"name": "to_upper", "args": {"input_text": f"booking {number}"},
+                                                 "id": call_id, "type": "tool_call"}],
+                        **_response_metadata("tool_calls", 24))
+        yield ToolMessage(content=f"BOOKING {number}", tool_call_id=call_id, name="to_upper")
+    yield AIMessage(content=f"Answer {number} for conversation {conversation}: "
+                            + "room 4B is free on Tuesday and Thursday afternoons " * 4,
+                    **_response_metadata("stop", 80))
+
+
+def build(conversations: int, turns: int, tool_every: int, compact: bool):
+    histories = []
+    for c in range(conversations):
+        history = ConversationHistory([SYSTEM], budget=0) if compact else [SYSTEM]
+        for t in range(turns):
+            for msg in turn(c, t, tool_every):
+                history.append(msg)
+        histories.append(history)
+    return histories
+
+
+def measure(args, compact: bool) -> float:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    histories = build(args.conversations, args.turns, args.tool_every, compact)
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    messages = sum(len(h) for h in histories)
+    label = "records" if compact else "raw"
+    print(f"{label:8} {current / 2**20:9.1f} MiB  {current / args.conversations / 1024:7.1f} KiB per conversation  "
+          f"{current / messages:6.0f} B per message  ({messages} messages, built in {elapsed:.1f} s)")
+    del histories
+    return current
+
+
+def conversion(args) -> None:
+    """Time to_langchain() for one history: a full conversion, then one new turn on top of a cached prefix."""
+    cold, warm = [], []
+    for _ in range(args.samples):
+        history = build(1, args.turns, args.tool_every, compact=True)[0]
+        start = time.perf_counter()
+        history.to_langchain()
+        cold.append(time.perf_counter() - start)
+        for msg in turn(0, args.turns, args.tool_every):
+            history.append(msg)
+        start = time.perf_counter()
+        history.to_langchain()
+        warm.append(time.perf_counter() - start)
+    print(f"convert  full history {statistics.mean(cold) * 1000:.2f} ms, "
+          f"with cached prefix {statistics.mean(warm) * 1000:.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--conversations', type=int, default=10000)
+    parser.add_argument('--turns', type=int, default=50, help="user turns per conversation")
+    parser.add_argument('--tool-every', type=int, default=5, help="a tool round trip every N turns (0 for none)")
+    parser.add_argument('--samples', type=int, default=20, help="histories timed for conversion")
+    parser.add_argument('--only', choices=['raw', 'records'], help="measure one representation")
+    args = parser.parse_args()
+
+    print(f"{args.conversations} conversations x {args.turns} turns")
+    results = {}
+    for compact in (False, True):
+        label = "records" if compact else "raw"
+        if args.only in (None, label):
+            results[label] = measure(args, compact)
+    if len(results) == 2:
+        print(f"records use {results['records'] / results['raw']:.0%} of the raw messages' memory")
+    conversion(args)
+
+
+if __name__ == '__main__':
+    main()
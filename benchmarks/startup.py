@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Startup benchmark for the cli.py and slack.py entry points.
+
+Imports each entry point in fresh interpreters, once with tools loaded
+lazily from the manifest and once with TOOL_PRELOAD=true, which imports
+every tool module up front as before. It reports the mean and best import
+time, the number of modules loaded, the slowest imports, and what loading
+each tool costs on its first call. The first tool loaded also pays for
+langchain_core.tools, which every tool module imports.
+
+    python -m benchmarks.startup --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"ms": (time.perf_counter() - start) * 1000, "modules": len(sys.modules)}}))
+"""
+
+FIRST_CALL = """
+import json, time
+import manager
+from tools import TOOL_MAP
+loads = {}
+for name, tool in TOOL_MAP.items():
+    start = time.perf_counter()
+    tool.load()
+    loads[name] = (time.perf_counter() - start) * 1000
+print(json.dumps(loads))
+"""
+
+
+def run(code: str, preload: bool, importtime: bool = False) -> subprocess.CompletedProcess:
+    env = dict(os.environ, TOOL_PRELOAD=str(preload).lower(), SLACK_TOKEN_VERIFICATION="false")
+    # slack.py creates its App at import; no request is made with these
+    env.setdefault("SLACK_BOT_TOKEN", "xoxb-benchmark")
+    env.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    return subprocess.run(args, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+
+def measure(module: str, preload: bool, runs: int) -> None:
+    samples = [json.loads(run(IMPORT.format(module=module), preload).stdout.splitlines()[-1]) for _ in range(runs)]
+    timings = [s["ms"] for s in samples]
+    label = "preload" if preload else "lazy"
+    print(f"import {module:<6} {label:<8} mean {statistics.mean(timings):7.1f} ms  "
+          f"min {min(timings):7.1f} ms  {samples[-1]['modules']} modules")
+
+
+def slowest(module: str, top: int) -> None:
+    """The imports with the largest cumulative time, from -X importtime."""
+    rows = []
+    for line in run(IMPORT.format(module=module), preload=False, importtime=True).stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                rows.append((int(cumulative), name.strip()))
+    for cumulative, name in sorted(rows, reverse=True)[:top]:
+        print(f"    {cumulative / 1000:7.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help="fresh interpreters per measurement")
+    parser.add_argument('--top', type=int, default=8, help="slowest imports to list (0 for none)")
+    args = parser.parse_args()
+
+    for module in ('cli', 'slack'):
+        for preload in (False, True):
+            measure(module, preload, args.runs)
+        if args.top:
+            print(f"  slowest imports of {module} (lazy):")
+            slowest(module, args.top)
+    loads = json.loads(run(FIRST_CALL, preload=False).stdout.splitlines()[-1])
+    print("first call load: " + ", ".join(f"{name} {ms:.1f} ms" for name, ms in loads.items()))
+
+
+if __name__ == '__main__':
+    main()
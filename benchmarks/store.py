@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Benchmark for the SQLite conversation store.
+
+Measures append throughput through the group-committed writer, and the
+latency of rehydrating long threads: reading them from the store, then
+rebuilding their LangGraphManager. No requests are sent to the model
+provider.
+
+    python -m benchmarks.store --messages 10000 --conversations 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('OPENAI_API_KEY', 'sk-benchmark')
+
+from langchain_core.messages import AIMessage
+
+from manager import LangGraphManager
+from store import SQLiteStore
+
+
+def message(i: int):
+    if i % 2:
+        return AIMessage(content=f"Reply number {i}: " + "lorem ipsum " * 20)
+    return {"role": "user", "content": f"Question number {i}: " + "dolor sit amet " * 10}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=10000, help="messages per conversation")
+    parser.add_argument('--conversations', type=int, default=20)
+    parser.add_argument('--rehydrations', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteStore(os.path.join(tmp, "bench.db"))
+        messages = [message(i) for i in range(args.messages)]
+        total = args.messages * args.conversations
+
+        start = time.perf_counter()
+        for i in range(args.messages):
+            for c in range(args.conversations):
+                store.append(f"C{c}::1", messages[i])
+        enqueued = time.perf_counter() - start
+        store.flush()
+        committed = time.perf_counter() - start
+
+        print(f"appended {total} messages across {args.conversations} conversations")
+        print(f"enqueue  {total / enqueued:10.0f} msg/s  ({enqueued * 1e6 / total:.1f} us per append on the caller)")
+        print(f"commit   {total / committed:10.0f} msg/s  ({committed:.2f} s until durable)")
+
+        # The first manager also builds the shared model client; keep that out of the timings
+        LangGraphManager()
+        loads, rebuilds = [], []
+        for r in range(args.rehydrations):
+            conversation_id = f"C{r % args.conversations}::1"
+            start = time.perf_counter()
+            stored = store.load(conversation_id)
+            loaded = time.perf_counter()
+            manager = LangGraphManager.rehydrate(conversation_id, store, stored)
+            loads.append((loaded - start) * 1000)
+            rebuilds.append((time.perf_counter() - loaded) * 1000)
+            assert len(manager.messages) == args.messages
+        totals = [load + rebuild for load, rebuild in zip(loads, rebuilds)]
+        print(f"rehydrate {args.messages} messages:")
+        for label, timings in (("load", loads), ("manager", rebuilds), ("total", totals)):
+            print(f"  {label:<8} mean {statistics.mean(timings):7.1f} ms, max {max(timings):7.1f} ms")
+
+        start = time.perf_counter()
+        store.compact()
+        print(f"compact  {(time.perf_counter() - start) * 1000:.1f} ms")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,17 @@
 #!/usr/bin/env python3
 import os
 from dotenv import load_dotenv
+import argparse
+import contextlib
+import json
 import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, TextIO
 from manager import LangGraphManager
+from jobs import job_engine
 import sys
 import readline  # Enables arrow key navigation and command history
 
@@ -20,8 +29,33 @@ class CliInterface:
     def __init__(self):
         self.manager = LangGraphManager()
         self.conversation_id = "cli_session"
+        self.streamed = False
+        # Everything streamed during the current process() call
+        self.streamed_text = ""
         logger.info("CLI interface initialized")
 
+    def print_token(self, text: str) -> None:
+        """Print streamed text as it arrives."""
+        if not self.streamed:
+            print()
+            self.streamed = True
+        self.streamed_text += text
+        print(text, end="", flush=True)
+
+    def process(self, text: str, approved: bool = False) -> tuple:
+        """Process a message, streaming the reply to stdout."""
+        self.streamed = False
+        self.streamed_text = ""
+        response, tool_info = self.manager.process_message(
+            text=text,
+            conversation_id=self.conversation_id,
+            approved_functions=approved,
+            on_token=self.print_token
+        )
+        if self.streamed:
+            print()
+        return response, tool_info
+
     def handle_approval(self, response: str, tool_info: dict) -> None:
         """Handle approval requests for tools."""
         if tool_info and "pending_tool_calls" in tool_info:
@@ -39,11 +73,31 @@ class CliInterface:
                 print("Please enter 'y' for yes or 'n' for no.")
 
             approved = choice == 'y'
-            response, new_tool_info = self.manager.process_message(
-                text="",
-                conversation_id=self.conversation_id,
-                approved_functions=approved
-            )
+            response, new_tool_info = self.process("", approved=approved)
+            self.handle_response(response, new_tool_info)
+
+    def handle_jobs(self, tool_info: dict) -> None:
+        """Wait for background jobs, printing their progress, then continue the turn."""
+        batch = self.manager.job_batch
+        print("\nRunning in the background: " + ", ".join(job["name"] for job in tool_info["background_jobs"]))
+        print("Press Ctrl+C to cancel.")
+        batch.listen(on_progress=lambda b: print(
+            "; ".join(f"{job.tool_name}: {job.progress_text or job.status}" for job in b.jobs), flush=True))
+        try:
+            batch.wait()
+        except KeyboardInterrupt:
+            job_engine.cancel(batch.conversation_id)
+        response, tool_info = self.process("")
+        self.handle_response(response, tool_info)
+
+    def handle_response(self, response: str, tool_info: dict) -> None:
+        """Show a reply, or follow up on the approvals or background jobs it is waiting on."""
+        if tool_info and "pending_tool_calls" in tool_info:
+            self.handle_approval(response, tool_info)
+        elif tool_info and "background_jobs" in tool_info:
+            self.handle_jobs(tool_info)
+        elif response and not self.streamed_text.endswith(response):
+            # E.g. the turn limit message, added after the text streamed so far
             print(f"\n{response}")
 
     def run(self):
@@ -75,16 +129,10 @@ class CliInterface:
                     continue
                 
                 # Process the message
-                response, tool_info = self.manager.process_message(
-                    text=user_input,
-                    conversation_id=self.conversation_id
-                )
+                response, tool_info = self.process(user_input)
                 
-                # Handle approval if needed
-                if tool_info and "pending_tool_calls" in tool_info:
-                    self.handle_approval(response, tool_info)
-                else:
-                    print(f"\n{response}")
+                # Handle approval or background jobs if needed
+                self.handle_response(response, tool_info)
                 
             except KeyboardInterrupt:
                 print("\nGoodbye!")
@@ -93,8 +141,150 @@ class CliInterface:
                 logger.error(f"Error processing input: {str(e)}", exc_info=True)
                 print(f"\nError: {str(e)}")
 
+class BatchRunner:
+    """Runs JSONL prompts through separate managers and streams results as JSONL.
+
+    Each input line is an item: {"id": ..., "prompt": "..."} or
+    {"id": ..., "turns": ["...", ...]}. Items sharing a "conversation" key
+    continue the same conversation, in file order. Conversations run
+    concurrently; the turns within one run in order.
+    """
+
+    # Bound on approvals and background job rounds within one turn, in case the model keeps asking
+    MAX_APPROVAL_ROUNDS = 10
+
+    def __init__(self, output: TextIO, concurrency: int = 8, approval: str = "reject",
+                 approved_tools: Optional[List[str]] = None):
+        self.output = output
+        self.concurrency = concurrency
+        self.approval = approval
+        self.approved_tools = {t.lower() for t in approved_tools or []}
+        self._write_lock = threading.Lock()
+        self.items = 0
+        self.errors = 0
+
+    @staticmethod
+    def read_items(source: TextIO) -> "OrderedDict[str, List[Dict[str, Any]]]":
+        """Group input items by conversation, keeping file order."""
+        conversations: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        for line_number, line in enumerate(source, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            item.setdefault("id", str(line_number))
+            if "turns" not in item:
+                item["turns"] = [item["prompt"]]
+            conversation = str(item.get("conversation", item["id"]))
+            conversations.setdefault(conversation, []).append(item)
+        return conversations
+
+    def approves(self, tool_info: Dict[str, Any]) -> bool:
+        if self.approval == "approve":
+            return True
+        if self.approval == "per-tool":
+            return all(call["name"].lower() in self.approved_tools for call in tool_info["pending_tool_calls"])
+        return False
+
+    def run_turn(self, manager: LangGraphManager, conversation_id: str, prompt: str) -> Dict[str, Any]:
+        start = time.perf_counter()
+        response, tool_info = manager.process_message(text=prompt, conversation_id=conversation_id)
+        tokens_sent = manager.turn_tokens_sent
+        approvals = []
+        jobs = []
+        while tool_info and len(approvals) + len(jobs) < self.MAX_APPROVAL_ROUNDS:
+            approved = False
+            if "background_jobs" in tool_info:
+                manager.job_batch.wait()
+                jobs.append([{"tool": job.tool_name, "status": job.status} for job in manager.job_batch.jobs])
+            elif "pending_tool_calls" in tool_info:
+                approved = self.approves(tool_info)
+                approvals.append({"tools": [call["name"] for call in tool_info["pending_tool_calls"]], "approved": approved})
+            else:
+                break
+            response, tool_info = manager.process_message(text="", conversation_id=conversation_id,
+                                                          approved_functions=approved)
+            tokens_sent += manager.turn_tokens_sent
+        return {
+            "prompt": prompt,
+            "response": response,
+            "approvals": approvals,
+            "background_jobs": jobs,
+            "pending_approval": bool(tool_info and "pending_tool_calls" in tool_info),
+            "tokens_sent": tokens_sent,
+            "seconds": time.perf_counter() - start,
+        }
+
+    def write(self, record: Dict[str, Any]) -> None:
+        with self._write_lock:
+            self.items += 1
+            self.errors += "error" in record
+            self.output.write(json.dumps(record, default=str) + "\n")
+            self.output.flush()
+
+    def run_conversation(self, conversation: str, items: List[Dict[str, Any]]) -> None:
+        # Each conversation is its own scheduler channel, so the per-channel quota
+        # doesn't cap the whole batch; --concurrency and LLM_MAX_CONCURRENCY do
+        conversation_id = f"batch-{conversation}::0"
+        manager = LangGraphManager(conversation_id)
+        for item in items:
+            start = time.perf_counter()
+            record = {"id": item["id"], "conversation": conversation, "turns": []}
+            try:
+                for prompt in item["turns"]:
+                    record["turns"].append(self.run_turn(manager, conversation_id, prompt))
+            except Exception as e:
+                logger.error("Batch item %s failed: %s", item["id"], str(e), exc_info=True)
+                record["error"] = str(e)
+            record["seconds"] = time.perf_counter() - start
+            self.write(record)
+
+    def run(self, source: TextIO) -> None:
+        conversations = self.read_items(source)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for future in [pool.submit(self.run_conversation, c, items) for c, items in conversations.items()]:
+                future.result()
+        logger.info("Batch finished: %d items in %d conversations, %d errors, %.1fs",
+                    self.items, len(conversations), self.errors, time.perf_counter() - start)
+
+
+def run_batch(args: argparse.Namespace) -> int:
+    source = sys.stdin if args.input == "-" else open(args.input, "r")
+    output = open(args.output, "w") if args.output else sys.stdout
+    runner = BatchRunner(output, concurrency=args.concurrency, approval=args.approval,
+                         approved_tools=args.approve_tool)
+    try:
+        # Tools print to stdout; keep it for the results
+        with contextlib.redirect_stdout(sys.stderr):
+            runner.run(source)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    return 1 if runner.errors else 0
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Office Manager CLI. Without a command, starts an interactive session.")
+    commands = parser.add_subparsers(dest="command")
+    batch = commands.add_parser("batch", help="run prompts from a JSONL file and write results as JSONL")
+    batch.add_argument("input", nargs="?", default="-", help="JSONL prompt file, or - for stdin (default)")
+    batch.add_argument("-o", "--output", help="write results here instead of stdout")
+    batch.add_argument("-c", "--concurrency", type=int, default=8, help="conversations run at once")
+    batch.add_argument("--approval", choices=["approve", "reject", "per-tool"], default="reject",
+                       help="how to answer approval requests (default: reject)")
+    batch.add_argument("--approve-tool", action="append", metavar="TOOL",
+                       help="with --approval per-tool, a tool to approve; repeat for more")
+    return parser.parse_args(argv)
+
+
 def main():
     """Main entry point for the CLI interface."""
+    args = parse_args()
+    if args.command == "batch":
+        sys.exit(run_batch(args))
     try:
         cli = CliInterface()
         cli.run()
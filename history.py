@@ -0,0 +1,302 @@
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import json
+import logging
+import os
+import sys
+import threading
+import weakref
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '32000'))
+HISTORY_KEEP_TOKENS = int(os.getenv('HISTORY_KEEP_TOKENS', str(HISTORY_TOKEN_BUDGET // 2)))
+# Conversations that keep their history converted to LangChain messages between turns
+CONVERTED_HISTORIES = int(os.getenv('HISTORY_CONVERTED_CACHE', '256'))
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+_encoding = None
+
+
+def _count_text(text: str) -> int:
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            # May download the encoding on first use, so it is loaded lazily
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+# Per-message framing tokens added by chat APIs
+MESSAGE_OVERHEAD = 4
+
+
+_LC_ROLES = {"human": "user", "ai": "assistant"}
+
+
+class Message:
+    """Compact history record of one chat message.
+
+    Only what is sent back to the model is kept: provider metadata such as
+    token usage, response IDs and finish reasons is dropped. Roles and tool
+    names are interned, so all records share one copy of each.
+    """
+
+    __slots__ = ("role", "content", "tool_calls", "tool_call_id", "name", "status")
+
+    def __init__(self, role: str, content: Any, tool_calls: Optional[List[Dict[str, Any]]] = None,
+                 tool_call_id: Optional[str] = None, name: Optional[str] = None, status: Optional[str] = None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.tool_calls = [
+            {"name": sys.intern(tc["name"]), "args": tc["args"], "id": tc.get("id")} for tc in tool_calls
+        ] if tool_calls else None
+        self.tool_call_id = tool_call_id
+        self.name = sys.intern(name) if name else None
+        # Only an error status is worth a reference; success is the default
+        self.status = status if status and status != "success" else None
+
+    @classmethod
+    def from_message(cls, msg: Any) -> "Message":
+        """Convert a tuple, dict or LangChain message."""
+        if isinstance(msg, Message):
+            return msg
+        if isinstance(msg, tuple):
+            return cls(msg[0], msg[1])
+        if isinstance(msg, dict):
+            return cls(msg.get("role", "user"), msg.get("content", ""), msg.get("tool_calls"),
+                       msg.get("tool_call_id"), msg.get("name"), msg.get("status"))
+        return cls(_LC_ROLES.get(msg.type, msg.type), msg.content, getattr(msg, "tool_calls", None),
+                   getattr(msg, "tool_call_id", None), msg.name, getattr(msg, "status", None))
+
+    def to_langchain(self) -> BaseMessage:
+        if self.role == "assistant":
+            return AIMessage(content=self.content, tool_calls=[
+                {**tc, "type": "tool_call"} for tc in self.tool_calls or ()
+            ])
+        if self.role == "tool":
+            return ToolMessage(content=self.content, tool_call_id=self.tool_call_id, name=self.name,
+                               status=self.status or "success")
+        if self.role == "system":
+            return SystemMessage(content=self.content)
+        return HumanMessage(content=self.content)
+
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, content={self.content!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {"role": self.role, "content": self.content}
+        for field in ("tool_calls", "tool_call_id", "name", "status"):
+            value = getattr(self, field)
+            if value:
+                data[field] = value
+        return data
+
+
+def message_role(msg: Any) -> str:
+    """Role of a message held in history: system, user, assistant or tool."""
+    if isinstance(msg, Message):
+        return msg.role
+    if isinstance(msg, tuple):
+        return msg[0]
+    if isinstance(msg, dict):
+        return msg.get("role", "user")
+    return _LC_ROLES.get(msg.type, msg.type)
+
+
+def message_content(msg: Any) -> str:
+    """Text content of a message held in history."""
+    if isinstance(msg, tuple):
+        content = msg[1]
+    elif isinstance(msg, dict):
+        content = msg.get("content", "")
+    else:
+        content = msg.content
+    if isinstance(content, str):
+        return content
+    return json.dumps(content, default=str)
+
+
+def count_tokens(msg: Any) -> int:
+    """Estimate the prompt tokens one message adds to a request."""
+    tokens = MESSAGE_OVERHEAD + _count_text(message_content(msg))
+    for tool_call in getattr(msg, "tool_calls", None) or []:
+        tokens += _count_text(tool_call["name"]) + _count_text(json.dumps(tool_call["args"], default=str))
+    return tokens
+
+
+class _ConvertedHistories:
+    """LRU of the histories holding a converted copy of their messages.
+
+    Converting a whole history on every model call is wasted work for an
+    active conversation, but keeping a converted copy for every idle one
+    would undo the compact records, so only recently used ones keep theirs.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._histories: "OrderedDict[int, weakref.ref]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def touch(self, history: "ConversationHistory") -> None:
+        with self._lock:
+            key = id(history)
+            self._histories[key] = weakref.ref(history)
+            self._histories.move_to_end(key)
+            while len(self._histories) > self.maxsize:
+                _, ref = self._histories.popitem(last=False)
+                evicted = ref()
+                if evicted is not None:
+                    evicted._converted = []
+
+
+_converted_histories = _ConvertedHistories(CONVERTED_HISTORIES)
+
+
+class ConversationHistory(Sequence):
+    """Message list for one conversation with a running token count.
+
+    Messages are held as compact Message records and converted to LangChain
+    messages only for the model, by to_langchain().
+
+    Tokens are counted once per appended message. When the total goes over the
+    budget, compact() folds the oldest complete turns into a summary message
+    placed right after the system prompt. The split is always made at a user
+    message, so a tool call and its results are never separated.
+
+    on_append and on_rewrite, if set, are called after a message is appended
+    and after compaction replaces the messages, e.g. to persist them.
+    """
+
+    def __init__(self, messages: Iterable[Any] = (), budget: int = HISTORY_TOKEN_BUDGET,
+                 keep_tokens: int = HISTORY_KEEP_TOKENS):
+        self.budget = budget
+        self.keep_tokens = keep_tokens
+        self._messages: List[Message] = []
+        self._tokens: List[int] = []
+        # LangChain copies of a prefix of _messages, reused across model calls
+        self._converted: List[BaseMessage] = []
+        self.total_tokens = 0
+        self.on_append: Optional[Callable[[Any], None]] = None
+        self.on_rewrite: Optional[Callable[[List[Any]], None]] = None
+        self.extend(messages)
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def append(self, msg: Any) -> None:
+        msg = Message.from_message(msg)
+        tokens = count_tokens(msg)
+        self._messages.append(msg)
+        self._tokens.append(tokens)
+        self.total_tokens += tokens
+        if self.on_append:
+            self.on_append(msg)
+
+    def extend(self, messages: Iterable[Any]) -> None:
+        for msg in messages:
+            self.append(msg)
+
+    def to_langchain(self) -> List[BaseMessage]:
+        """The messages as LangChain messages, converting only those appended since the last call."""
+        if CONVERTED_HISTORIES <= 0:
+            return [msg.to_langchain() for msg in self._messages]
+        converted = self._converted
+        for msg in self._messages[len(converted):]:
+            converted.append(msg.to_langchain())
+        self._converted = converted
+        _converted_histories.touch(self)
+        return list(converted)
+
+    def estimated_bytes(self) -> int:
+        """Rough memory estimate, derived from the running token count."""
+        return self.total_tokens * 4 + len(self._messages) * 256
+
+    def over_budget(self) -> bool:
+        return self.budget > 0 and self.total_tokens > self.budget
+
+    def _split_index(self) -> Optional[int]:
+        """Index of the first message to keep, or None if there is nothing to compact."""
+        kept = 0
+        split = None
+        for i in range(len(self._messages) - 1, 0, -1):
+            kept += self._tokens[i]
+            if message_role(self._messages[i]) != "user":
+                continue
+            # Always keep the newest turn, then older turns while they fit
+            if split is not None and kept > self.keep_tokens:
+                break
+            split = i
+        # Nothing older than the kept turns, or only a previous summary
+        if split is None or split <= 1 or (split == 2 and self._is_summary(1)):
+            return None
+        return split
+
+    def _is_summary(self, index: int) -> bool:
+        msg = self._messages[index]
+        return message_role(msg) == "system" and message_content(msg).startswith(SUMMARY_PREFIX)
+
+    def compaction_range(self) -> Optional[List[Any]]:
+        """Messages that compact() would fold into the summary, if over budget."""
+        if not self.over_budget():
+            return None
+        split = self._split_index()
+        if split is None:
+            return None
+        return self._messages[1:split]
+
+    def compact(self, summary: str) -> None:
+        """Replace the messages returned by compaction_range() with a summary."""
+        split = self._split_index()
+        if split is None:
+            return
+        before = self.total_tokens
+        tail = self._messages[split:]
+        tail_tokens = self._tokens[split:]
+        summary_msg = ("system", SUMMARY_PREFIX + summary)
+        summary_tokens = count_tokens(summary_msg)
+        summary_msg = Message.from_message(summary_msg)
+        if len(self._converted) >= split:
+            self._converted = self._converted[:1] + [summary_msg.to_langchain()] + self._converted[split:]
+        else:
+            self._converted = []
+        self._messages = [self._messages[0], summary_msg] + tail
+        self._tokens = [self._tokens[0], summary_tokens] + tail_tokens
+        self.total_tokens = sum(self._tokens)
+        logger.info("Compacted history from %d to %d tokens", before, self.total_tokens)
+        if self.on_rewrite:
+            self.on_rewrite(self._messages)
+
+
+def transcript(messages: Iterable[Any]) -> str:
+    """Render messages as plain text for the summarizer."""
+    lines = []
+    for msg in messages:
+        line = f"{message_role(msg)}: {message_content(msg)}"
+        for tool_call in getattr(msg, "tool_calls", None) or []:
+            line += f"\n[called {tool_call['name']} with {json.dumps(tool_call['args'], default=str)}]"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the conversation below for your own later reference. Keep names, facts, "
+    "decisions, tool results and open questions. Be concise."
+)
+
+
+def summary_request(messages: Iterable[Any]) -> List[Any]:
+    """Build the model input that asks for a summary of messages."""
+    return [("system", SUMMARY_INSTRUCTIONS), ("user", transcript(messages))]
@@ -0,0 +1,354 @@
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+import asyncio
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+
+from telemetry import metrics
+
+logger = logging.getLogger(__name__)
+
+# Work item priorities, served lowest first: turns resumed after a button
+# click or background jobs, then replies in threads, then new threads
+PRIORITY_RESUME = 0
+PRIORITY_THREAD = 1
+PRIORITY_NEW_THREAD = 2
+PRIORITY_NAMES = ("resume", "thread", "new_thread")
+
+BUSY_MESSAGE = "I'm getting a lot of requests right now. Please try again in a minute."
+
+
+def ignore_unawaited(future: "asyncio.Future") -> "asyncio.Future":
+    """Let future go unawaited: once it is done its exception is retrieved, so asyncio doesn't log it."""
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    return future
+
+
+class EventDeduper:
+    """Fixed-memory index of recently seen Slack event keys.
+
+    Keys live in a ring buffer for lookup order and in a set for membership.
+    A key is forgotten once it is older than ttl seconds or pushed out of the
+    ring by maxsize newer keys, whichever comes first.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._ring: Deque[Tuple[str, float]] = deque()
+        self._keys: Set[str] = set()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def _forget(self) -> None:
+        self._keys.discard(self._ring.popleft()[0])
+
+    def seen(self, *keys: Optional[str]) -> bool:
+        """Record keys and return True if any of them was seen before."""
+        keys = [k for k in keys if k]
+        if not keys:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            while self._ring and now - self._ring[0][1] > self.ttl:
+                self._forget()
+            duplicate = any(k in self._keys for k in keys)
+            for k in keys:
+                if k not in self._keys:
+                    self._keys.add(k)
+                    self._ring.append((k, now))
+            while len(self._ring) > self.maxsize:
+                self._forget()
+            if duplicate:
+                self.duplicates += 1
+            return duplicate
+
+    def __len__(self) -> int:
+        return len(self._ring)
+
+
+def event_keys(event: Dict[str, Any], body: Optional[Dict[str, Any]] = None) -> List[Optional[str]]:
+    """Keys identifying one delivery of a user message.
+
+    event_id is stable across Slack's retries of one event; client_msg_id is
+    stable across different events carrying the same user message.
+    """
+    return [(body or {}).get("event_id"), event.get("client_msg_id")]
+
+
+def message_priority(event: Dict[str, Any], bot_user_id: str) -> Optional[int]:
+    """The priority of a message event, or None if it isn't directed at the bot."""
+    if event.get("thread_ts"):
+        return PRIORITY_THREAD
+    if f"<@{bot_user_id}>" in event.get("text", ""):
+        return PRIORITY_NEW_THREAD
+    return None
+
+
+class Admission:
+    """Decides whether a message is queued or turned away with a busy reply.
+
+    New threads are refused once new_thread_depth admitted messages are
+    waiting for a worker, thread replies once max_depth are. A user may have
+    at most per_user messages queued or running, a channel per_channel.
+    Resumed turns are submitted directly and never refused. A limit of 0
+    disables it.
+    """
+
+    def __init__(self, max_depth: int = 256, new_thread_depth: int = 128, per_user: int = 4,
+                 per_channel: int = 32):
+        self.max_depth = max_depth
+        self.new_thread_depth = new_thread_depth
+        self.per_user = per_user
+        self.per_channel = per_channel
+        self._lock = threading.Lock()
+        self._queued = [0] * len(PRIORITY_NAMES)
+        self._users: Dict[str, int] = {}
+        self._channels: Dict[str, int] = {}
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {}
+        self.wait_seconds = 0.0
+        self.started_count = 0
+
+    def _refusal(self, priority: int, user: Optional[str], channel: Optional[str]) -> Optional[str]:
+        queued = sum(self._queued)
+        if priority == PRIORITY_NEW_THREAD and 0 < self.new_thread_depth <= queued:
+            return "depth"
+        if 0 < self.max_depth <= queued:
+            return "depth"
+        if user and 0 < self.per_user <= self._users.get(user, 0):
+            return "user"
+        if channel and 0 < self.per_channel <= self._channels.get(channel, 0):
+            return "channel"
+        return None
+
+    def admit(self, priority: int, user: Optional[str], channel: Optional[str]) -> Optional[str]:
+        """Take a place in the queue, or return why there is none ("depth", "user" or "channel")."""
+        with self._lock:
+            reason = self._refusal(priority, user, channel)
+            if reason is None:
+                self._queued[priority] += 1
+                if user:
+                    self._users[user] = self._users.get(user, 0) + 1
+                if channel:
+                    self._channels[channel] = self._channels.get(channel, 0) + 1
+                self.admitted += 1
+            else:
+                self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        if reason is not None:
+            metrics.inc("admission_rejected_total", (("priority", PRIORITY_NAMES[priority]), ("reason", reason)))
+        return reason
+
+    def started(self, priority: int, waited: float) -> None:
+        with self._lock:
+            self._queued[priority] -= 1
+            self.wait_seconds += waited
+            self.started_count += 1
+
+    def finished(self, user: Optional[str], channel: Optional[str]) -> None:
+        with self._lock:
+            for counts, key in ((self._users, user), (self._channels, channel)):
+                if key:
+                    counts[key] -= 1
+                    if not counts[key]:
+                        del counts[key]
+
+    def queued(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(zip(PRIORITY_NAMES, self._queued))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queued": dict(zip(PRIORITY_NAMES, self._queued)),
+                "users": len(self._users),
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "mean_wait_ms": self.wait_seconds * 1000 / self.started_count if self.started_count else None,
+            }
+
+
+class _Item:
+    """A queued work item; ordered by priority, then arrival."""
+
+    __slots__ = ("priority", "seq", "queued_at", "future", "fn", "args", "kwargs", "ticket")
+
+    def __init__(self, priority: int, seq: int, future: Any, fn: Callable, args: tuple, kwargs: dict,
+                 ticket: Optional[Tuple[Optional[str], Optional[str]]] = None):
+        self.priority = priority
+        self.seq = seq
+        self.queued_at = time.perf_counter()
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.ticket = ticket
+
+    def __lt__(self, other: "_Item") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _Admitting:
+    """Priority ordering and admission accounting shared by WorkQueue and AsyncWorkQueue."""
+
+    name: str
+    admission: Optional[Admission]
+
+    def _item(self, priority: int, future: Any, fn: Callable, args: tuple, kwargs: dict,
+              ticket: Optional[Tuple[Optional[str], Optional[str]]] = None) -> _Item:
+        return _Item(priority, next(self._seq), future, fn, args, kwargs, ticket)
+
+    def _started(self, item: _Item) -> None:
+        waited = time.perf_counter() - item.queued_at
+        metrics.observe(f"{self.name}_wait", (("priority", PRIORITY_NAMES[item.priority]),), waited)
+        if item.ticket is not None and self.admission is not None:
+            self.admission.started(item.priority, waited)
+
+    def _finished(self, item: _Item) -> None:
+        if item.ticket is not None and self.admission is not None:
+            self.admission.finished(*item.ticket)
+
+    def _admit(self, priority: int, user: Optional[str], channel: Optional[str]) -> bool:
+        if self.admission is None:
+            return True
+        reason = self.admission.admit(priority, user, channel)
+        if reason is not None:
+            logger.warning("Refusing %s message from %s in %s: %s limit reached",
+                           PRIORITY_NAMES[priority], user, channel, reason)
+        return reason is None
+
+
+class WorkQueue(_Admitting):
+    """Internal priority queue of work items run by a fixed pool of daemon threads."""
+
+    def __init__(self, workers: int = 16, name: str = "intake", admission: Optional[Admission] = None):
+        self.workers = workers
+        self.name = name
+        self.admission = admission
+        self._queue: "queue.PriorityQueue[_Item]" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def _start(self) -> None:
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"{self.name}-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            self._started(item)
+            future, fn = item.future, item.fn
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*item.args, **item.kwargs))
+                    except Exception as e:
+                        logger.error("Work item %s failed: %s", getattr(fn, "__name__", fn), str(e), exc_info=True)
+                        future.set_exception(e)
+            finally:
+                self._finished(item)
+                self._queue.task_done()
+
+    def _put(self, priority: int, fn: Callable, args: tuple, kwargs: dict,
+             ticket: Optional[Tuple[Optional[str], Optional[str]]] = None) -> Future:
+        if len(self._threads) < self.workers:
+            self._start()
+        future: Future = Future()
+        self._queue.put(self._item(priority, future, fn, args, kwargs, ticket))
+        return future
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Queue fn to run on a worker, ahead of admitted messages; the returned future can be waited on."""
+        return self._put(PRIORITY_RESUME, fn, args, kwargs)
+
+    def offer(self, priority: int, user: Optional[str], channel: Optional[str], fn: Callable,
+              *args, **kwargs) -> Optional[Future]:
+        """Queue fn for a message from user in channel, or return None if admission refuses it."""
+        if not self._admit(priority, user, channel):
+            return None
+        return self._put(priority, fn, args, kwargs, (user, channel))
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def join(self) -> None:
+        self._queue.join()
+
+
+class AsyncWorkQueue(_Admitting):
+    """asyncio counterpart of WorkQueue; workers are tasks on the running loop."""
+
+    def __init__(self, workers: int = 256, name: str = "intake", admission: Optional[Admission] = None):
+        self.workers = workers
+        self.name = name
+        self.admission = admission
+        self._seq = itertools.count()
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def _start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._work(), name=f"{self.name}-{i}") for i in range(self.workers)]
+
+    async def _work(self) -> None:
+        while True:
+            item = await self._queue.get()
+            self._started(item)
+            future, fn = item.future, item.fn
+            try:
+                if not future.cancelled():
+                    try:
+                        future.set_result(await fn(*item.args, **item.kwargs))
+                    except Exception as e:
+                        logger.error("Work item %s failed: %s", getattr(fn, "__name__", fn), str(e), exc_info=True)
+                        future.set_exception(e)
+            finally:
+                self._finished(item)
+                self._queue.task_done()
+
+    def _put(self, priority: int, fn: Callable, args: tuple, kwargs: dict,
+             ticket: Optional[Tuple[Optional[str], Optional[str]]] = None) -> "asyncio.Future":
+        if self._loop is not asyncio.get_running_loop():
+            self._start()
+        future = ignore_unawaited(self._loop.create_future())
+        self._queue.put_nowait(self._item(priority, future, fn, args, kwargs, ticket))
+        return future
+
+    def submit(self, fn: Callable, *args, **kwargs) -> "asyncio.Future":
+        """Queue coroutine function fn to run on a worker task, ahead of admitted messages; must be called from the loop."""
+        return self._put(PRIORITY_RESUME, fn, args, kwargs)
+
+    def offer(self, priority: int, user: Optional[str], channel: Optional[str], fn: Callable,
+              *args, **kwargs) -> Optional["asyncio.Future"]:
+        """Queue coroutine function fn for a message, or return None if admission refuses it."""
+        if not self._admit(priority, user, channel):
+            return None
+        return self._put(priority, fn, args, kwargs, (user, channel))
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+
+event_deduper = EventDeduper(
+    maxsize=int(os.getenv('SLACK_DEDUP_SIZE', '10000')),
+    ttl=float(os.getenv('SLACK_DEDUP_TTL', '3600'))
+)
+
+admission = Admission(
+    max_depth=int(os.getenv('ADMISSION_MAX_DEPTH', '256')),
+    new_thread_depth=int(os.getenv('ADMISSION_NEW_THREAD_DEPTH', '128')),
+    per_user=int(os.getenv('ADMISSION_PER_USER', '4')),
+    per_channel=int(os.getenv('ADMISSION_PER_CHANNEL', '32'))
+)
+metrics.gauge("admission_queue_depth", lambda: {(("priority", p),): n for p, n in admission.queued().items()})
@@ -0,0 +1,256 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional
+import logging
+import os
+import threading
+import time
+import uuid
+
+from telemetry import metrics, span
+from tools import BACKGROUND_JOBS
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ("succeeded", "failed", "cancelled")
+JOBS_RUNNING_MESSAGE = "I'm still working on the background job from earlier. I'll answer this message along with its results here when it's done. Press Cancel to stop it."
+
+
+class Job:
+    """One tool call running in the background.
+
+    A tool that opted in with @background_job finds its Job in opts["job"]:
+    it can report progress with job.progress(...) and should stop early once
+    job.cancelled is set.
+    """
+
+    def __init__(self, conversation_id: str, tool_call: Dict[str, Any]):
+        self.id = uuid.uuid4().hex[:12]
+        self.conversation_id = conversation_id
+        self.tool_call = tool_call
+        self.tool_name = tool_call["name"].lower()
+        self.status = "queued"
+        self.progress_text = ""
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.batch: Optional["JobBatch"] = None
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED
+
+    def progress(self, text: str) -> None:
+        """Report progress; it is shown in the job's Slack message."""
+        self.progress_text = text
+        if self.batch is not None:
+            self.batch.notify_progress()
+
+
+class JobBatch:
+    """The background jobs started by one model reply.
+
+    The model loop can only resume once every tool call in the reply has a
+    result, so a batch reports done when its last job finishes, whatever the
+    outcome. Listeners may be attached after the batch has started; one
+    attached after it finished is called straight away.
+    """
+
+    def __init__(self, conversation_id: str, tool_calls: List[Dict[str, Any]], run: Callable[[Job], Any]):
+        self.conversation_id = conversation_id
+        self.run = run
+        self.jobs = [Job(conversation_id, tool_call) for tool_call in tool_calls]
+        for job in self.jobs:
+            job.batch = self
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._on_progress: Optional[Callable[["JobBatch"], Any]] = None
+        self._on_done: Optional[Callable[["JobBatch"], Any]] = None
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def listen(self, on_progress: Optional[Callable[["JobBatch"], Any]] = None,
+               on_done: Optional[Callable[["JobBatch"], Any]] = None) -> None:
+        with self._lock:
+            self._on_progress = on_progress
+            self._on_done = on_done
+            finished = self.done
+        if finished and on_done is not None:
+            on_done(self)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def notify_progress(self) -> None:
+        with self._lock:
+            callback = self._on_progress
+        if callback is not None and not self.done:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error("Job progress listener for %s failed: %s", self.conversation_id, str(e), exc_info=True)
+
+    def _job_finished(self) -> None:
+        with self._lock:
+            if self.done or not all(job.done for job in self.jobs):
+                return
+            self._done.set()
+            callback = self._on_done
+        if callback is not None:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error("Job completion listener for %s failed: %s", self.conversation_id, str(e), exc_info=True)
+
+
+class JobEngine:
+    """Runs background jobs on a worker pool, outside any Slack request.
+
+    Each tool has its own FIFO queue and at most its limit of jobs running at
+    once (default_limit unless configured); workers bounds the total. A
+    cancelled job is finished right away. A running one is asked to stop
+    through job.cancelled, and since its thread can't be interrupted, its
+    late result is discarded.
+    """
+
+    def __init__(self, workers: int = 4, limits: Optional[Dict[str, int]] = None, default_limit: int = 1):
+        self.workers = workers
+        self.limits = limits if limits is not None else {}
+        self.default_limit = default_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        # Notified whenever a job finishes or a worker frees up, for join()
+        self._changed = threading.Condition(self._lock)
+        self._queued: Dict[str, Deque[Job]] = {}
+        self._running: Dict[str, int] = {}
+        self._batches: Dict[str, JobBatch] = {}
+        self.finished = {status: 0 for status in FINISHED}
+
+    def submit(self, batch: JobBatch) -> JobBatch:
+        """Queue every job in batch; it becomes the conversation's active batch."""
+        with self._lock:
+            self._batches[batch.conversation_id] = batch
+            for job in batch.jobs:
+                self._queued.setdefault(job.tool_name, deque()).append(job)
+            self._dispatch()
+        logger.info("Queued %d background jobs for %s", len(batch.jobs), batch.conversation_id)
+        return batch
+
+    def _limit(self, tool_name: str) -> int:
+        return self.limits.get(tool_name, self.default_limit)
+
+    def _dispatch(self) -> None:
+        for tool_name, queued in self._queued.items():
+            while queued and (self._limit(tool_name) <= 0 or self._running.get(tool_name, 0) < self._limit(tool_name)):
+                job = queued.popleft()
+                if job.done:
+                    continue
+                self._running[tool_name] = self._running.get(tool_name, 0) + 1
+                job.status = "running"
+                job.started_at = time.time()
+                self._executor.submit(self._run, job)
+
+    def _run(self, job: Job) -> None:
+        job.batch.notify_progress()
+        try:
+            with span("job", tool=job.tool_name):
+                result = job.batch.run(job)
+            self._finish(job, "succeeded", result=result)
+        except Exception as e:
+            logger.error("Background job %s (%s) failed: %s", job.id, job.tool_name, str(e), exc_info=True)
+            self._finish(job, "failed", error=e)
+        finally:
+            with self._lock:
+                self._running[job.tool_name] -= 1
+                self._dispatch()
+                self._changed.notify_all()
+
+    def _finish(self, job: Job, status: str, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            if job.done:
+                # Already cancelled; the late result is discarded
+                return
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished_at = time.time()
+            self.finished[status] += 1
+            if self._batches.get(job.conversation_id) is job.batch and all(j.done for j in job.batch.jobs):
+                del self._batches[job.conversation_id]
+            self._changed.notify_all()
+        metrics.inc("jobs_total", (("status", status), ("tool", job.tool_name)))
+        logger.info("Background job %s (%s) for %s %s", job.id, job.tool_name, job.conversation_id, status)
+        job.batch._job_finished()
+
+    def active(self, conversation_id: str) -> Optional[JobBatch]:
+        """The conversation's unfinished batch, if any."""
+        with self._lock:
+            return self._batches.get(conversation_id)
+
+    def cancel(self, conversation_id: str) -> bool:
+        """Cancel the conversation's unfinished jobs. Returns False if it had none."""
+        batch = self.active(conversation_id)
+        if batch is None:
+            return False
+        for job in batch.jobs:
+            job._cancel.set()
+        for job in batch.jobs:
+            self._finish(job, "cancelled")
+        return True
+
+    def _busy(self) -> bool:
+        return (any(self._running.values())
+                or any(not job.done for queued in self._queued.values() for job in queued))
+
+    def busy(self) -> bool:
+        """Whether any job is queued, or any job thread is still running, even a cancelled one."""
+        with self._lock:
+            return self._busy()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until no job is queued or running. Returns False if timeout passed first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while self._busy():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+        return True
+
+    def drain(self, timeout: float) -> int:
+        """Wait up to timeout for every job to finish, then cancel the rest.
+
+        Cancelling finishes the batches, so their completion listeners still
+        resume the turns. Returns the number of conversations cancelled.
+        """
+        if self.join(timeout):
+            return 0
+        with self._lock:
+            conversation_ids = list(self._batches)
+        return sum(self.cancel(conversation_id) for conversation_id in conversation_ids)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queued": {tool: len(q) for tool, q in self._queued.items() if q},
+                "running": {tool: n for tool, n in self._running.items() if n},
+                "finished": dict(self.finished),
+            }
+
+
+job_engine = JobEngine(
+    workers=int(os.getenv('JOB_WORKERS', '4')),
+    limits=BACKGROUND_JOBS
+)
+metrics.gauge("jobs_queued", lambda: {(("tool", t),): n for t, n in job_engine.stats()["queued"].items()})
+metrics.gauge("jobs_running", lambda: {(("tool", t),): n for t, n in job_engine.stats()["running"].items()})
@@ -1,55 +1,268 @@
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, Callable, List, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import asyncio
+import contextvars
+import inspect
+import itertools
 import logging
 import os
 import os.path
+import threading
+import time
 logger = logging.getLogger(__name__)
-from langchain.chat_models import init_chat_model
+from langchain_core.messages import AIMessage, ToolMessage, message_chunk_to_message
 
+from backends import Backend, HedgedModel, parse_backends
+from history import ConversationHistory, message_role, summary_request
+from jobs import JOBS_RUNNING_MESSAGE, Job, JobBatch, job_engine
+from store import ConversationStore, StoredConversation, get_store
 from tools import (
+    BACKGROUND_JOBS,
     NEEDS_APPROVAL,
     AVAILABLE_TOOLS,
-    TOOL_MAP
+    TOOL_MAP,
+    TOOL_TIMEOUTS,
+    TOOL_CACHES,
+    DEFAULT_TOOL_TIMEOUT
 )
+from tool_registry import tool_schemas
+from tool_pool import ToolPool
+from cache import MISSING
+from response_cache import RESPONSE_CACHE_ENABLED, response_cache
+from telemetry import metrics, record_usage, span, trace
+from router import ROUTER_ENABLED, match_route, router_stats
+from scheduler import MAX_TURN_ITERATIONS, MAX_TURN_TOKENS, TURN_LIMIT_MESSAGE, scheduler
 
-def get_llm_model() -> Any:
+class StreamAborted(Exception):
+    """A streamed model call failed after text reached on_token, or on_token itself failed.
+
+    The scheduler only retries the provider's own errors, and retrying this
+    one would repeat text the caller has already sent on.
+    """
+
+
+SYSTEM_PATH = os.path.join(os.path.dirname(__file__), 'system.md')
+DEFAULT_SYSTEM_MESSAGE = "You are called Batman"
+
+_http_clients = None
+_http_clients_lock = threading.Lock()
+
+_bound_models: Dict[Tuple[str, str, Tuple[str, ...]], Any] = {}
+_bound_models_lock = threading.Lock()
+
+# Bounded pool shared by all conversations for running a turn's tool calls concurrently
+_tool_pool = ToolPool(
+    workers=int(os.getenv('TOOL_POOL_SIZE', '8')),
+    per_tool=int(os.getenv('TOOL_WORKERS_PER_TOOL', '4'))
+)
+
+_system_message = DEFAULT_SYSTEM_MESSAGE
+_system_mtime = None
+_system_lock = threading.Lock()
+
+def get_http_clients() -> Tuple[Any, Any]:
+    """Get the process-wide pooled sync and async HTTP clients."""
+    global _http_clients
+    with _http_clients_lock:
+        if _http_clients is None:
+            import httpx
+            limits = httpx.Limits(
+                max_connections=int(os.getenv('HTTP_MAX_CONNECTIONS', '100')),
+                max_keepalive_connections=int(os.getenv('HTTP_MAX_KEEPALIVE', '20'))
+            )
+            _http_clients = (httpx.Client(limits=limits), httpx.AsyncClient(limits=limits))
+        return _http_clients
+
+def get_llm_model(model_name: Optional[str] = None, model_provider: Optional[str] = None) -> Any:
     """Get the appropriate LLM model based on environment variables."""
-    model_name = os.getenv('MODEL_NAME', 'gpt-4o')
-    model_provider = os.getenv('MODEL_PROVIDER', 'openai')
+    # Imported on first use; it pulls in much of langchain, which slows startup
+    from langchain.chat_models import init_chat_model
+    model_name = model_name or os.getenv('MODEL_NAME', 'gpt-4o')
+    model_provider = model_provider or os.getenv('MODEL_PROVIDER', 'openai')
+    kwargs = {}
+    if model_provider in ('openai', 'azure_openai'):
+        # OpenAI clients accept injected httpx clients, so every model shares one connection pool.
+        kwargs['http_client'], kwargs['http_async_client'] = get_http_clients()
     return init_chat_model(
         model_name,
         model_provider=model_provider,
-        max_tokens=1024*8
+        max_tokens=1024*8,
+        **kwargs
+    )
+
+def get_llm_backends() -> Any:
+    """Get the model, or a HedgedModel over MODEL_BACKENDS if it lists more than one."""
+    backends = parse_backends(os.getenv('MODEL_BACKENDS', ''))
+    if len(backends) <= 1:
+        return get_llm_model(*(reversed(backends[0]) if backends else ()))
+    return HedgedModel([
+        Backend(f"{provider}:{name}", get_llm_model(name, provider)) for provider, name in backends
+    ])
+
+def _model_key(tools: List[Any]) -> Tuple[str, str, Tuple[str, ...]]:
+    if os.getenv('MODEL_BACKENDS'):
+        return ('backends', os.getenv('MODEL_BACKENDS'), tuple(t.name for t in tools))
+    return (
+        os.getenv('MODEL_PROVIDER', 'openai'),
+        os.getenv('MODEL_NAME', 'gpt-4o'),
+        tuple(t.name for t in tools)
+    )
+
+def register_model(model: Any, tools: List[Any] = AVAILABLE_TOOLS) -> None:
+    """Install a ready-made model, e.g. a local fake, as the shared model for tools."""
+    with _bound_models_lock:
+        _bound_models[_model_key(tools)] = model.bind_tools(tool_schemas(tools)) if tools else model
+
+def get_bound_model(tools: List[Any] = AVAILABLE_TOOLS) -> Any:
+    """Get the shared chat model with tools bound, creating it on first use.
+
+    With several backends each is bound to the same tools, so tool calls look
+    the same whichever backend answers.
+    """
+    key = _model_key(tools)
+    with _bound_models_lock:
+        if key not in _bound_models:
+            logger.info("Creating chat model for %s", key)
+            llm = get_llm_backends()
+            _bound_models[key] = llm.bind_tools(tool_schemas(tools)) if tools else llm
+        return _bound_models[key]
+
+def load_system_message() -> str:
+    """Get the system message, re-reading system.md only when its mtime changes."""
+    global _system_message, _system_mtime
+    with _system_lock:
+        try:
+            mtime = os.stat(SYSTEM_PATH).st_mtime_ns
+        except FileNotFoundError:
+            logger.info("could not load : %s", SYSTEM_PATH)
+            _system_message, _system_mtime = DEFAULT_SYSTEM_MESSAGE, None
+            return _system_message
+        if mtime != _system_mtime:
+            with open(SYSTEM_PATH, 'r') as f:
+                _system_message = f.read()
+            _system_mtime = mtime
+        return _system_message
+
+def chunk_text(chunk: Any) -> str:
+    """Extract the text of a streamed message chunk, whether content is a string or content blocks."""
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    return "".join(
+        block if isinstance(block, str) else block.get("text", "")
+        for block in content
+        if isinstance(block, str) or block.get("type") == "text"
     )
 
 class LangGraphManager:
-    def __init__(self):
+    def __init__(self, conversation_id: Optional[str] = None, store: Optional[ConversationStore] = None):
         self.external_params = {"age": 2}
         self.model = Any
         self.messages = []
-        self.approval_message_ts = ""
-        self.pendig_approval = None
+        self.conversation_id = conversation_id
+        # Set before any state changes so the initial system message is persisted too
+        self.store = store
+        self._approval_message_ts = ""
+        self._pendig_approval = None
+        # Background jobs the turn is waiting on before the model loop can resume
+        self.job_batch: Optional[JobBatch] = None
+        # Messages sent while those jobs ran; they go to the model with the jobs' results
+        self.deferred_messages: List[str] = []
+        # Prompt tokens sent to the model during the current turn and over the conversation's lifetime
+        self.turn_tokens_sent = 0
+        self.total_tokens_sent = 0
+        # Per-conversation switch for the exact-match model response cache
+        self.response_cache_enabled = RESPONSE_CACHE_ENABLED
+        # Per-conversation switch for answering deterministic tool requests without the model
+        self.router_enabled = ROUTER_ENABLED
+        # Serializes turns so two Slack events in one thread can't interleave on self.messages
+        self.lock = threading.Lock()
         self._create_agent()
         logger.info("Initialized LangGraphManager with external_params: %s", self.external_params)
+
+    @classmethod
+    def rehydrate(cls, conversation_id: str, store: ConversationStore, stored: StoredConversation) -> "LangGraphManager":
+        """Rebuild a manager from its persisted state without writing it back."""
+        manager = cls(conversation_id)
+        manager.messages = ConversationHistory(stored.messages)
+        manager._track_history()
+        manager._pendig_approval = stored.pendig_approval
+        manager._approval_message_ts = stored.approval_message_ts
+        manager.store = store
+        if not stored.pendig_approval:
+            manager._resolve_interrupted_tool_calls()
+        return manager
+
+    def _resolve_interrupted_tool_calls(self) -> None:
+        """Answer tool calls left without a result, e.g. background jobs cut off by a restart.
+
+        They are not run again, since a half-finished job may already have had
+        side effects; the model is told instead and can ask to retry.
+        """
+        answered = set()
+        for msg in reversed(self.messages):
+            role = message_role(msg)
+            if role == "tool":
+                answered.add(msg.get("tool_call_id") if isinstance(msg, dict) else msg.tool_call_id)
+                continue
+            if role == "assistant":
+                for tool_call in getattr(msg, "tool_calls", None) or []:
+                    if tool_call.get("id") not in answered:
+                        logger.warning("Tool call %s in %s was interrupted", tool_call["name"], self.conversation_id)
+                        self.messages.append(self._tool_error_message(
+                            tool_call, f"{tool_call['name']} was interrupted by a restart before it finished"))
+            return
+
+    # Approval state is persisted whenever it changes, from here or from the Slack front ends
+    @property
+    def pendig_approval(self) -> Optional[List[Dict]]:
+        return self._pendig_approval
+
+    @pendig_approval.setter
+    def pendig_approval(self, value: Optional[List[Dict]]) -> None:
+        self._pendig_approval = value
+        self._save_state()
+
+    @property
+    def approval_message_ts(self) -> str:
+        return self._approval_message_ts
+
+    @approval_message_ts.setter
+    def approval_message_ts(self, value: str) -> None:
+        self._approval_message_ts = value
+        self._save_state()
+
+    def _save_state(self) -> None:
+        if self.store:
+            self.store.save_state(self.conversation_id, self._pendig_approval, self._approval_message_ts)
+
+    def _track_history(self) -> None:
+        self.messages.on_append = self._store_append
+        self.messages.on_rewrite = self._store_rewrite
+
+    def _store_append(self, msg: Any) -> None:
+        if self.store:
+            self.store.append(self.conversation_id, msg)
+
+    def _store_rewrite(self, messages: List[Any]) -> None:
+        if self.store:
+            self.store.rewrite(self.conversation_id, messages)
+
+    def estimated_bytes(self) -> int:
+        """Rough estimate of the memory held by this conversation's history."""
+        return self.messages.estimated_bytes()
         
     def _create_agent(self) -> Any:
-        llm = get_llm_model()
-        self.model = llm.bind_tools(AVAILABLE_TOOLS)
-        
-        # Read system message from system.md file
-        system_path = os.path.join(os.path.dirname(__file__), 'system.md')
-        system_message = "You are called Batman"
-        try:
-            with open(system_path, 'r') as f:
-                system_message = f.read()
-        except FileNotFoundError:
-            logger.info("could not load : %s", system_path)
-            
-        self.messages = [
+        self.model = get_bound_model()
+        self.messages = ConversationHistory()
+        self._track_history()
+        self.messages.append(
             (
                 "system",
-                system_message
+                load_system_message()
             )
-        ]
+        )
 
     def ask_for_approval(self, tool_calls: List[Dict]) -> tuple[str, Dict]:
         """Create a json for name and arguments for the tool calls."""
@@ -61,93 +274,725 @@ class LangGraphManager:
             })
         return "", {"pending_tool_calls": tool_info}
 
+    def _rejection_message(self, tool_call: Dict) -> Dict:
+        return {
+            "role": "tool",
+            "tool_call_id": tool_call.get("id", "unknown"),
+            "name": tool_call["name"].lower(),
+            "content": "User rejected your request to run the function. Consider our options or discuss the matter with the user."
+        }
+
+    def _tool_error_message(self, tool_call: Dict, error: str) -> Dict:
+        return {
+            "role": "tool",
+            "tool_call_id": tool_call.get("id", "unknown"),
+            "name": tool_call["name"].lower(),
+            "content": f"Error: {error}"
+        }
+
+    def _tool_cache(self, tool_name: str) -> Any:
+        # Approval-gated tools always run, so the user sees exactly what they approved
+        if NEEDS_APPROVAL.get(tool_name, False):
+            return None
+        return TOOL_CACHES.get(tool_name)
+
+    def _cached_tool_message(self, tool_call: Dict) -> Optional[ToolMessage]:
+        tool_name = tool_call["name"].lower()
+        cache = self._tool_cache(tool_name)
+        if cache is None:
+            return None
+        content = cache.get(tool_call["args"])
+        if content is MISSING:
+            return None
+        return ToolMessage(content=content, tool_call_id=tool_call.get("id", "unknown"), name=tool_name)
+
+    def _cache_tool_message(self, tool_call: Dict, tool_msg: Any) -> None:
+        cache = self._tool_cache(tool_call["name"].lower())
+        if cache is not None and isinstance(tool_msg, ToolMessage) and tool_msg.status == "success":
+            cache.set(tool_call["args"], tool_msg.content)
+
+    def _run_tool(self, tool_call: Dict) -> Any:
+        tool_name = tool_call["name"].lower()
+        try:
+            with span("tool", tool=tool_name):
+                tool_msg = TOOL_MAP[tool_name].invoke(tool_call)
+            self._cache_tool_message(tool_call, tool_msg)
+            return tool_msg
+        except Exception as e:
+            logger.error("Tool %s failed: %s", tool_name, str(e), exc_info=True)
+            return self._tool_error_message(tool_call, f"{tool_name} failed: {e}")
+
+    async def _arun_tool(self, tool_call: Dict) -> Any:
+        tool_name = tool_call["name"].lower()
+        tool_timeout = TOOL_TIMEOUTS.get(tool_name, DEFAULT_TOOL_TIMEOUT)
+        try:
+            with span("tool", tool=tool_name):
+                tool_msg = await asyncio.wait_for(TOOL_MAP[tool_name].ainvoke(tool_call), tool_timeout)
+            self._cache_tool_message(tool_call, tool_msg)
+            return tool_msg
+        except asyncio.TimeoutError:
+            logger.error("Tool %s timed out after %ss", tool_name, tool_timeout)
+            return self._tool_error_message(tool_call, f"{tool_name} timed out after {tool_timeout}s")
+        except Exception as e:
+            logger.error("Tool %s failed: %s", tool_name, str(e), exc_info=True)
+            return self._tool_error_message(tool_call, f"{tool_name} failed: {e}")
+
     def _execute_tool_calls(self, tool_calls: List[Dict], approved: bool = False) -> List[Dict]:
-        """Execute tool calls and return their messages."""
-        tool_messages = []
+        """Execute tool calls concurrently and return their messages in call order."""
+        pending = []
         for tool_call in tool_calls:
             tool_name = tool_call["name"].lower()
             if NEEDS_APPROVAL.get(tool_name, False) and not approved:
                 # Create a rejection message
-                tool_messages.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call.get("id", "unknown"),
-                    "name": tool_name,
-                    "content": "User rejected your request to run the function. Consider our options or discuss the matter with the user."
-                })
+                pending.append((tool_call, self._rejection_message(tool_call), None))
             else:
-                selected_tool = TOOL_MAP[tool_name]
                 tool_call["args"].update({"opts": self.external_params})
-                tool_msg = selected_tool.invoke(tool_call)
-                tool_messages.append(tool_msg)
+                cached_msg = self._cached_tool_message(tool_call)
+                if cached_msg is not None:
+                    pending.append((tool_call, cached_msg, None))
+                    continue
+                # Run in a copy of this context so the tool's span lands in the current turn's trace
+                context = contextvars.copy_context()
+                call = _tool_pool.submit(tool_name, context.run, self._run_tool, tool_call)
+                pending.append((tool_call, call, TOOL_TIMEOUTS.get(tool_name, DEFAULT_TOOL_TIMEOUT)))
+
+        tool_messages = []
+        for tool_call, call, tool_timeout in pending:
+            if tool_timeout is None:
+                # Rejected or served from the cache
+                tool_messages.append(call)
+                continue
+            try:
+                tool_messages.append(_tool_pool.result(call, tool_timeout))
+            except FutureTimeoutError:
+                # The worker thread can't be interrupted; its late result is discarded.
+                tool_name = tool_call["name"].lower()
+                if not call.started.is_set():
+                    logger.error("Tool %s did not start within %ss", tool_name, tool_timeout)
+                    error = f"{tool_name} did not start within {tool_timeout}s because earlier calls are still running"
+                else:
+                    logger.error("Tool %s timed out after %ss", tool_name, tool_timeout)
+                    error = f"{tool_name} timed out after {tool_timeout}s"
+                tool_messages.append(self._tool_error_message(tool_call, error))
         return tool_messages
 
-    def process_message(self, text: str, conversation_id: str, approved_functions: bool = False) -> Tuple[str, Dict[str, Any]]:
-        """Process a message using the provided agent."""
-        logger.info("Processing message for conversation_id: %s", conversation_id)
-        logger.info("Input text: %s", text)
+    async def _aexecute_tool_calls(self, tool_calls: List[Dict], approved: bool = False) -> List[Dict]:
+        """Async variant of _execute_tool_calls."""
+        async def ready(tool_msg):
+            return tool_msg
+
+        calls = []
+        for tool_call in tool_calls:
+            tool_name = tool_call["name"].lower()
+            if NEEDS_APPROVAL.get(tool_name, False) and not approved:
+                calls.append(ready(self._rejection_message(tool_call)))
+            else:
+                tool_call["args"].update({"opts": self.external_params})
+                cached_msg = self._cached_tool_message(tool_call)
+                calls.append(ready(cached_msg) if cached_msg is not None else self._arun_tool(tool_call))
+        # gather keeps results in call order
+        return list(await asyncio.gather(*calls))
+
+    def _start_jobs(self, tool_calls: List[Dict], approved: bool = False) -> List[Dict]:
+        """Hand calls to background-job tools to the job engine and return the calls to run inline."""
+        job_calls = [
+            tool_call for tool_call in tool_calls
+            if tool_call["name"].lower() in BACKGROUND_JOBS
+            and (approved or not NEEDS_APPROVAL.get(tool_call["name"].lower(), False))
+        ]
+        if not job_calls:
+            return tool_calls
+        self.job_batch = job_engine.submit(JobBatch(self.conversation_id or "", job_calls, self._run_job))
+        return [tool_call for tool_call in tool_calls if not any(tool_call is job_call for job_call in job_calls)]
+
+    def _run_job(self, job: Job) -> Any:
+        # A copy, so the Job handle never ends up in the persisted tool call
+        tool_call = dict(job.tool_call, args={**job.tool_call["args"], "opts": {**self.external_params, "job": job}})
+        return TOOL_MAP[job.tool_name].invoke(tool_call)
+
+    def _job_messages(self) -> List[Any]:
+        """Tool messages for the finished background jobs, in call order."""
+        tool_messages = []
+        for job in self.job_batch.jobs:
+            if job.status == "succeeded":
+                tool_messages.append(job.result)
+            elif job.status == "cancelled":
+                tool_messages.append(self._tool_error_message(job.tool_call, f"{job.tool_name} was cancelled by the user"))
+            else:
+                tool_messages.append(self._tool_error_message(job.tool_call, f"{job.tool_name} failed: {job.error}"))
+        return tool_messages
+
+    def _take_job_results(self, text: str) -> None:
+        """Add the finished jobs' results to history, then the messages that waited on them."""
+        self.messages.extend(self._job_messages())
+        self.job_batch = None
+        for deferred in self.deferred_messages + ([text] if text else []):
+            self.messages.append({"role": "user", "content": deferred})
+        self.deferred_messages = []
+
+    def _jobs_started(self, conversation_id: str) -> Tuple[str, Dict[str, Any]]:
+        self._log_turn(conversation_id)
+        return "", {"background_jobs": [
+            {"id": job.id, "name": job.tool_name, "arguments": job.tool_call["args"]}
+            for job in self.job_batch.jobs
+        ]}
+
+    def _compact_history(self) -> None:
+        """Summarize older turns once the history is over its token budget."""
+        to_summarize = self.messages.compaction_range()
+        if to_summarize is None:
+            return
+        try:
+            with span("summarize"):
+                summary = scheduler.run(self._scheduler_key(), lambda: get_bound_model([]).invoke(summary_request(to_summarize)))
+        except Exception as e:
+            logger.error("Could not summarize history, sending it in full: %s", str(e))
+            return
+        self.messages.compact(summary.content)
+
+    async def _acompact_history(self) -> None:
+        to_summarize = self.messages.compaction_range()
+        if to_summarize is None:
+            return
         try:
-            # Check for pending approvals first
-            if hasattr(self, 'pendig_approval') and self.pendig_approval:
-                if approved_functions:
-                    # Execute pending tool calls with approval
-                    tool_messages = self._execute_tool_calls(self.pendig_approval, approved=True)
-                    for msg in tool_messages:
-                        self.messages.append(msg)
+            with span("summarize"):
+                summary = await scheduler.arun(self._scheduler_key(), lambda: get_bound_model([]).ainvoke(summary_request(to_summarize)))
+        except Exception as e:
+            logger.error("Could not summarize history, sending it in full: %s", str(e))
+            return
+        self.messages.compact(summary.content)
+
+    def _count_sent(self) -> None:
+        self.turn_tokens_sent += self.messages.total_tokens
+        self.total_tokens_sent += self.messages.total_tokens
+
+    def _turn_limit_reached(self, iterations: int) -> bool:
+        """Whether a turn that already made `iterations` model calls must stop."""
+        if MAX_TURN_ITERATIONS > 0 and iterations >= MAX_TURN_ITERATIONS:
+            return True
+        return MAX_TURN_TOKENS > 0 and self.turn_tokens_sent >= MAX_TURN_TOKENS
+
+    def _stop_turn(self, conversation_id: str) -> Tuple[str, Dict[str, Any]]:
+        logger.warning("Turn for %s stopped at its limit after sending %d prompt tokens",
+                       conversation_id, self.turn_tokens_sent)
+        metrics.inc("turns_limited_total")
+        self.messages.append({"role": "assistant", "content": TURN_LIMIT_MESSAGE})
+        self._log_turn(conversation_id)
+        return TURN_LIMIT_MESSAGE, {}
+
+    def _log_turn(self, conversation_id: str) -> None:
+        logger.info("Turn for %s sent %d prompt tokens (history now %d tokens)",
+                    conversation_id, self.turn_tokens_sent, self.messages.total_tokens)
+
+    def _response_cache_key(self) -> Optional[str]:
+        if not self.response_cache_enabled:
+            return None
+        # The same identity the shared model is cached under, so MODEL_BACKENDS is part of it;
+        # tools are fingerprinted by the cache itself
+        model_id = ":".join(_model_key(AVAILABLE_TOOLS)[:2])
+        return response_cache.key(self.messages, model_id, AVAILABLE_TOOLS)
+
+    def _scheduler_key(self) -> str:
+        return self.conversation_id or ""
+
+    def _call_model(self, on_token: Optional[Callable[[str], Any]] = None) -> Any:
+        with span("llm"):
+            if on_token is None:
+                return self.model.invoke(self.messages.to_langchain())
+            # Chunks are summed so tool_call_chunks are assembled into complete tool_calls
+            gathered = None
+            sent = False
+            try:
+                for chunk in self.model.stream(self.messages.to_langchain()):
+                    gathered = chunk if gathered is None else gathered + chunk
+                    text = chunk_text(chunk)
+                    if text:
+                        sent = True
+                        try:
+                            on_token(text)
+                        except Exception as e:
+                            raise StreamAborted(f"Streaming the reply failed: {e}") from e
+            except StreamAborted:
+                raise
+            except Exception as e:
+                if sent:
+                    raise StreamAborted(f"Model stream failed after text was sent: {e}") from e
+                raise
+            return message_chunk_to_message(gathered)
+
+    async def _acall_model(self, on_token: Optional[Callable[[str], Any]] = None) -> Any:
+        with span("llm"):
+            if on_token is None:
+                return await self.model.ainvoke(self.messages.to_langchain())
+            gathered = None
+            sent = False
+            try:
+                async for chunk in self.model.astream(self.messages.to_langchain()):
+                    gathered = chunk if gathered is None else gathered + chunk
+                    text = chunk_text(chunk)
+                    if text:
+                        sent = True
+                        try:
+                            result = on_token(text)
+                            if inspect.isawaitable(result):
+                                await result
+                        except Exception as e:
+                            raise StreamAborted(f"Streaming the reply failed: {e}") from e
+            except StreamAborted:
+                raise
+            except Exception as e:
+                if sent:
+                    raise StreamAborted(f"Model stream failed after text was sent: {e}") from e
+                raise
+            return message_chunk_to_message(gathered)
+
+    def _invoke_model(self, on_token: Optional[Callable[[str], Any]] = None) -> Any:
+        """Call the model on the current history, streaming text to on_token if given."""
+        self._compact_history()
+        start = time.perf_counter()
+        cache_key = self._response_cache_key()
+        if cache_key:
+            ai_msg = response_cache.get(cache_key)
+            if ai_msg is not None:
+                response_cache.record_hit(time.perf_counter() - start)
+                metrics.inc("response_cache_hits_total")
+                if on_token and chunk_text(ai_msg):
+                    on_token(chunk_text(ai_msg))
+                return ai_msg
+
+        self._count_sent()
+        start = time.perf_counter()
+        ai_msg = scheduler.run(self._scheduler_key(), lambda: self._call_model(on_token))
+        record_usage(ai_msg)
+        router_stats.record_model_call(time.perf_counter() - start)
+        if cache_key:
+            response_cache.record_model_call(time.perf_counter() - start)
+            response_cache.set(cache_key, ai_msg)
+        return ai_msg
+
+    async def _ainvoke_model(self, on_token: Optional[Callable[[str], Any]] = None) -> Any:
+        """Async variant of _invoke_model; on_token may be a coroutine function."""
+        await self._acompact_history()
+        start = time.perf_counter()
+        cache_key = self._response_cache_key()
+        if cache_key:
+            ai_msg = response_cache.get(cache_key)
+            if ai_msg is not None:
+                response_cache.record_hit(time.perf_counter() - start)
+                metrics.inc("response_cache_hits_total")
+                if on_token and chunk_text(ai_msg):
+                    result = on_token(chunk_text(ai_msg))
+                    if inspect.isawaitable(result):
+                        await result
+                return ai_msg
+
+        self._count_sent()
+        start = time.perf_counter()
+        ai_msg = await scheduler.arun(self._scheduler_key(), lambda: self._acall_model(on_token))
+        record_usage(ai_msg)
+        router_stats.record_model_call(time.perf_counter() - start)
+        if cache_key:
+            response_cache.record_model_call(time.perf_counter() - start)
+            response_cache.set(cache_key, ai_msg)
+        return ai_msg
+
+    def _match_route(self, text: str) -> Optional[Tuple[Any, Dict]]:
+        if not self.router_enabled:
+            return None
+        matched = match_route(text)
+        # Background jobs need the front end to follow them up, which only the model loop does
+        if matched is None or matched[0].tool_name in BACKGROUND_JOBS:
+            router_stats.record_fallthrough()
+            return None
+        route, args = matched
+        return route, route.tool_call(args)
+
+    def _routed_reply(self, route: Any, tool_msg: Any) -> Optional[str]:
+        """Record a routed tool result and the reply phrased from it, or None if the tool failed."""
+        self.messages.append(tool_msg)
+        if isinstance(tool_msg, dict) or getattr(tool_msg, "status", "success") != "success":
+            # Let the model explain the failure
+            router_stats.record_fallthrough()
+            return None
+        reply = route.reply.format(result=tool_msg.content)
+        self.messages.append(AIMessage(content=reply))
+        return reply
+
+    def _route(self, text: str, conversation_id: str,
+               on_token: Optional[Callable[[str], Any]] = None) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Answer a request that maps to one deterministic tool without calling the model.
+
+        The tool call and its result are recorded in history as if the model had
+        made them. Approval-gated tools go through the normal approval flow.
+        Returns None when the model should handle the message.
+        """
+        matched = self._match_route(text)
+        if matched is None:
+            return None
+        route, tool_call = matched
+        start = time.perf_counter()
+        with span("route", tool=route.tool_name):
+            result = self._handle_ai_message(AIMessage(content="", tool_calls=[tool_call]))
+            if result is None:
+                reply = self._routed_reply(route, self._execute_tool_calls([tool_call])[0])
+                if reply is None:
+                    return None
+                if on_token:
+                    on_token(reply)
+                result = reply, {}
+        router_stats.record_routed(time.perf_counter() - start)
+        self._log_turn(conversation_id)
+        return result
+
+    async def _aroute(self, text: str, conversation_id: str,
+                      on_token: Optional[Callable[[str], Any]] = None) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Async variant of _route."""
+        matched = self._match_route(text)
+        if matched is None:
+            return None
+        route, tool_call = matched
+        start = time.perf_counter()
+        with span("route", tool=route.tool_name):
+            result = self._handle_ai_message(AIMessage(content="", tool_calls=[tool_call]))
+            if result is None:
+                reply = self._routed_reply(route, (await self._aexecute_tool_calls([tool_call]))[0])
+                if reply is None:
+                    return None
+                if on_token:
+                    token_result = on_token(reply)
+                    if inspect.isawaitable(token_result):
+                        await token_result
+                result = reply, {}
+        router_stats.record_routed(time.perf_counter() - start)
+        self._log_turn(conversation_id)
+        return result
+
+    def _handle_ai_message(self, ai_msg: Any) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Record a model reply and return the turn result, or None if tools should run next."""
+        self.messages.append(ai_msg)
+
+        if not ai_msg.tool_calls:
+            return ai_msg.content, {}
+
+        needs_approval = False
+        for tool_call in ai_msg.tool_calls:
+            tool_name = tool_call["name"].lower()
+            if NEEDS_APPROVAL.get(tool_name, False):
+                needs_approval = True
+                break
+
+        if needs_approval:
+            self.pendig_approval = ai_msg.tool_calls
+            return self.ask_for_approval(ai_msg.tool_calls)
+        return None
+
+    def process_message(self, text: str, conversation_id: str, approved_functions: bool = False,
+                        on_token: Optional[Callable[[str], Any]] = None) -> Tuple[str, Dict[str, Any]]:
+        """Process a message using the provided agent.
+
+        If on_token is given, the model's replies are streamed and each text fragment is passed to it as it arrives.
+        """
+        logger.info("Processing message for conversation_id: %s", conversation_id)
+        logger.info("Input length: %d chars", len(text))
+        self.turn_tokens_sent = 0
+        with trace("turn", conversation_id=conversation_id):
+            try:
+                if self.job_batch:
+                    # Nothing can be sent to the model until every job has its result
+                    if not self.job_batch.done:
+                        if text:
+                            self.deferred_messages.append(text)
+                        return JOBS_RUNNING_MESSAGE, {}
+                    self._take_job_results(text)
+                # Check for pending approvals first
+                elif self.pendig_approval:
+                    # Execute pending tool calls if approved, otherwise reject them
+                    tool_calls = self._start_jobs(self.pendig_approval, approved=approved_functions)
+                    tool_messages = self._execute_tool_calls(tool_calls, approved=approved_functions)
+                    self.messages.extend(tool_messages)
                     self.pendig_approval = None
+                    if self.job_batch:
+                        return self._jobs_started(conversation_id)
+                elif not text:
+                    # E.g. a job resume after a newer message already took the results; nothing to answer
+                    return "", {}
                 else:
-                    # Reject all pending tool calls
-                    tool_messages = self._execute_tool_calls(self.pendig_approval, approved=False)
-                    for msg in tool_messages:
-                        self.messages.append(msg)
+                    # Normal message processing
+                    user_message = {"role": "user", "content": text}
+                    self.messages.append(user_message)
+                    routed = self._route(text, conversation_id, on_token)
+                    if routed is not None:
+                        return routed
+
+                for iterations in itertools.count():
+                    if iterations and self._turn_limit_reached(iterations):
+                        return self._stop_turn(conversation_id)
+                    ai_msg = self._invoke_model(on_token)
+                    result = self._handle_ai_message(ai_msg)
+                    if result is not None:
+                        self._log_turn(conversation_id)
+                        return result
+
+                    # Execute tool calls without approval needed
+                    tool_messages = self._execute_tool_calls(self._start_jobs(ai_msg.tool_calls))
+                    self.messages.extend(tool_messages)
+                    if self.job_batch:
+                        return self._jobs_started(conversation_id)
+
+            except Exception as e:
+                logger.error("Error processing message: %s", str(e), exc_info=True)
+                raise
+
+    async def aprocess_message(self, text: str, conversation_id: str, approved_functions: bool = False,
+                               on_token: Optional[Callable[[str], Any]] = None) -> Tuple[str, Dict[str, Any]]:
+        """Async variant of process_message that awaits the model instead of blocking a thread."""
+        logger.info("Processing message for conversation_id: %s", conversation_id)
+        logger.info("Input length: %d chars", len(text))
+        self.turn_tokens_sent = 0
+        with trace("turn", conversation_id=conversation_id):
+            try:
+                if self.job_batch:
+                    if not self.job_batch.done:
+                        if text:
+                            self.deferred_messages.append(text)
+                        return JOBS_RUNNING_MESSAGE, {}
+                    self._take_job_results(text)
+                elif self.pendig_approval:
+                    tool_calls = self._start_jobs(self.pendig_approval, approved=approved_functions)
+                    tool_messages = await self._aexecute_tool_calls(tool_calls, approved=approved_functions)
+                    self.messages.extend(tool_messages)
                     self.pendig_approval = None
-                
-                # # Continue with normal processing after handling pending approvals
-                # ai_msg = self.model.invoke(self.messages)
-                # self.messages.append(ai_msg)
-                # print(ai_msg)
-                # return ai_msg.content, {}
-            else:
-                # Normal message processing
-                user_message = {"role": "user", "content": text}
-                self.messages.append(user_message)
-
-            while True:
-                ai_msg = self.model.invoke(self.messages)
-                self.messages.append(ai_msg)
-                
-                if not ai_msg.tool_calls:
-                    return ai_msg.content, {}
-
-                needs_approval = False
-                for tool_call in ai_msg.tool_calls:
-                    tool_name = tool_call["name"].lower()
-                    if NEEDS_APPROVAL.get(tool_name, False):
-                        needs_approval = True
-                        break
-
-                if needs_approval:
-                    self.pendig_approval = ai_msg.tool_calls
-                    return self.ask_for_approval(ai_msg.tool_calls)
-
-                # Execute tool calls without approval needed
-                tool_messages = self._execute_tool_calls(ai_msg.tool_calls)
-                for msg in tool_messages:
-                    self.messages.append(msg)
+                    if self.job_batch:
+                        return self._jobs_started(conversation_id)
+                elif not text:
+                    return "", {}
+                else:
+                    user_message = {"role": "user", "content": text}
+                    self.messages.append(user_message)
+                    routed = await self._aroute(text, conversation_id, on_token)
+                    if routed is not None:
+                        return routed
 
-        except Exception as e:
-            logger.error("Error processing message: %s", str(e), exc_info=True)
-            raise
+                for iterations in itertools.count():
+                    if iterations and self._turn_limit_reached(iterations):
+                        return self._stop_turn(conversation_id)
+                    ai_msg = await self._ainvoke_model(on_token)
+                    result = self._handle_ai_message(ai_msg)
+                    if result is not None:
+                        self._log_turn(conversation_id)
+                        return result
 
-# Dictionary to store LangGraphManager instances per conversation
-conversation_managers: Dict[str, LangGraphManager] = {}
+                    tool_messages = await self._aexecute_tool_calls(self._start_jobs(ai_msg.tool_calls))
+                    self.messages.extend(tool_messages)
+                    if self.job_batch:
+                        return self._jobs_started(conversation_id)
+
+            except Exception as e:
+                logger.error("Error processing message: %s", str(e), exc_info=True)
+                raise
+
+class ConversationRegistry:
+    """Bounded store of LangGraphManager instances keyed by conversation ID.
+
+    Conversations are kept in LRU order. Idle conversations older than the TTL
+    are dropped, and the least recently used ones are evicted once the count or
+    estimated byte limits are exceeded. A conversation with a pending approval
+    is never evicted, since its approval buttons are still live in Slack, and
+    neither is one waiting on background jobs or in the middle of a turn.
+
+    With a store, conversations missing from memory (evicted, or from before a
+    restart) are rehydrated from it on first access. Store reads can block, so
+    code on an event loop uses acontains, aget and aget_or_create, which run
+    them in a thread.
+    """
+
+    def __init__(self, max_conversations: int = 1000, max_bytes: int = 256 * 1024 * 1024,
+                 ttl_seconds: float = 24 * 60 * 60, store: Optional[ConversationStore] = None):
+        self.store = store
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._managers: "OrderedDict[str, LangGraphManager]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+        self._sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, conversation_id: str) -> bool:
+        if self._in_memory(conversation_id):
+            return True
+        return self.store is not None and self.store.exists(conversation_id)
+
+    async def acontains(self, conversation_id: str) -> bool:
+        """`in` for the event loop."""
+        if self._in_memory(conversation_id):
+            return True
+        return self.store is not None and await asyncio.to_thread(self.store.exists, conversation_id)
+
+    def __len__(self) -> int:
+        return len(self._managers)
+
+    def __getitem__(self, conversation_id: str) -> "LangGraphManager":
+        manager = self._cached(conversation_id)
+        return manager if manager is not None else self._rehydrate(conversation_id)
+
+    async def aget(self, conversation_id: str) -> "LangGraphManager":
+        """Indexing for the event loop."""
+        manager = self._cached(conversation_id)
+        if manager is not None:
+            return manager
+        if self.store is None:
+            raise KeyError(conversation_id)
+        return await asyncio.to_thread(self._rehydrate, conversation_id)
+
+    def _in_memory(self, conversation_id: str) -> bool:
+        with self._lock:
+            self._expire(time.monotonic())
+            return conversation_id in self._managers
+
+    def _cached(self, conversation_id: str) -> Optional["LangGraphManager"]:
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            if conversation_id in self._managers:
+                self.hits += 1
+                self._touch(conversation_id, now)
+                return self._managers[conversation_id]
+            self.misses += 1
+            return None
+
+    def _rehydrate(self, conversation_id: str) -> "LangGraphManager":
+        # Loading from the store happens outside the lock so other conversations aren't held up
+        stored = self.store.load(conversation_id) if self.store else None
+        if stored is None:
+            raise KeyError(conversation_id)
+        with self._lock:
+            if conversation_id in self._managers:
+                # Rehydrated concurrently by another event
+                return self._managers[conversation_id]
+            logger.info("Rehydrated conversation %s with %d messages", conversation_id, len(stored.messages))
+            manager = LangGraphManager.rehydrate(conversation_id, self.store, stored)
+            self[conversation_id] = manager
+            return manager
+
+    def __setitem__(self, conversation_id: str, manager: "LangGraphManager") -> None:
+        with self._lock:
+            self._managers[conversation_id] = manager
+            self._touch(conversation_id, time.monotonic())
+            self._enforce_limits()
+
+    def get_or_create(self, conversation_id: str) -> "LangGraphManager":
+        """Return the manager for conversation_id, creating it on a miss."""
+        try:
+            return self[conversation_id]
+        except KeyError:
+            return self._create(conversation_id)
+
+    async def aget_or_create(self, conversation_id: str) -> "LangGraphManager":
+        """get_or_create for the event loop."""
+        try:
+            return await self.aget(conversation_id)
+        except KeyError:
+            return self._create(conversation_id)
+
+    def _create(self, conversation_id: str) -> "LangGraphManager":
+        with self._lock:
+            if conversation_id in self._managers:
+                return self._managers[conversation_id]
+            manager = LangGraphManager(conversation_id, store=self.store)
+            self[conversation_id] = manager
+            return manager
+
+    def discard(self, conversation_id: str) -> None:
+        """Drop a conversation from memory; the store, if any, keeps it."""
+        with self._lock:
+            if conversation_id in self._managers:
+                self._remove(conversation_id, "discarded")
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for sizing the registry."""
+        with self._lock:
+            return {
+                "conversations": len(self._managers),
+                "estimated_bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _touch(self, conversation_id: str, now: float) -> None:
+        # Sizes are refreshed whenever a conversation is accessed, so the
+        # total reflects each conversation as of its previous turn.
+        self._managers.move_to_end(conversation_id)
+        self._last_access[conversation_id] = now
+        size = self._managers[conversation_id].estimated_bytes()
+        self._total_bytes += size - self._sizes.get(conversation_id, 0)
+        self._sizes[conversation_id] = size
+
+    def _evictable(self, conversation_id: str) -> bool:
+        manager = self._managers[conversation_id]
+        # A held lock means a turn is in progress on this manager
+        return not manager.pendig_approval and manager.job_batch is None and not manager.lock.locked()
+
+    def _remove(self, conversation_id: str, reason: str) -> None:
+        del self._managers[conversation_id]
+        del self._last_access[conversation_id]
+        self._total_bytes -= self._sizes.pop(conversation_id, 0)
+        self.evictions += 1
+        logger.info("Evicted conversation %s (%s)", conversation_id, reason)
+
+    def _expire(self, now: float) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        for conversation_id in list(self._managers):
+            if now - self._last_access[conversation_id] < self.ttl_seconds:
+                # Entries are in access order, so the rest are fresher.
+                break
+            if self._evictable(conversation_id):
+                self._remove(conversation_id, "ttl")
+
+    def _enforce_limits(self) -> None:
+        self._expire(time.monotonic())
+        for conversation_id in list(self._managers):
+            over_count = self.max_conversations > 0 and len(self._managers) > self.max_conversations
+            over_bytes = self.max_bytes > 0 and self._total_bytes > self.max_bytes
+            if not (over_count or over_bytes):
+                break
+            # Never evict the conversation that was just inserted.
+            if conversation_id == next(reversed(self._managers)):
+                break
+            if self._evictable(conversation_id):
+                self._remove(conversation_id, "count" if over_count else "bytes")
+
+
+# Registry of LangGraphManager instances per conversation
+conversation_managers = ConversationRegistry(
+    max_conversations=int(os.getenv('MAX_CONVERSATIONS', '1000')),
+    max_bytes=int(os.getenv('MAX_CONVERSATION_BYTES', str(256 * 1024 * 1024))),
+    ttl_seconds=float(os.getenv('CONVERSATION_TTL_SECONDS', str(24 * 60 * 60))),
+    store=get_store()
+)
+metrics.gauge("conversations", lambda: len(conversation_managers))
+metrics.gauge("tool_queue_depth", _tool_pool.qsize)
 
 def get_manager(conversation_id: str) -> LangGraphManager:
-    """Get an existing manager or create a new one for the given conversation ID."""
+    """Get an existing manager for the given conversation ID."""
     return conversation_managers[conversation_id]
 
 
 def get_or_create_manager(conversation_id: str) -> LangGraphManager:
     """Get an existing manager or create a new one for the given conversation ID."""
-    if conversation_id not in conversation_managers:
-        conversation_managers[conversation_id] = LangGraphManager()
-    return conversation_managers[conversation_id]
+    return conversation_managers.get_or_create(conversation_id)
+
+
+async def aget_manager(conversation_id: str) -> LangGraphManager:
+    """get_manager for the event loop; a store load runs in a thread."""
+    return await conversation_managers.aget(conversation_id)
+
+
+async def aget_or_create_manager(conversation_id: str) -> LangGraphManager:
+    """get_or_create_manager for the event loop; a store load runs in a thread."""
+    return await conversation_managers.aget_or_create(conversation_id)
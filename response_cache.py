@@ -0,0 +1,139 @@
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from langchain_core.messages import AIMessage, message_to_dict, messages_from_dict
+
+from cache import MISSING, TTLCache
+from history import message_content, message_role
+from tool_registry import tool_schemas
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE', 'false').lower() == 'true'
+
+
+def canonical_message(msg: Any) -> Dict[str, Any]:
+    """Reduce a history message to the fields that determine the model's reply.
+
+    Tool call IDs are left out: providers generate fresh ones on every call,
+    and a message's position already ties a tool result to its call.
+    """
+    canonical = {"role": message_role(msg), "content": message_content(msg)}
+    tool_calls = getattr(msg, "tool_calls", None)
+    if tool_calls:
+        canonical["tool_calls"] = [{"name": tc["name"], "args": tc["args"]} for tc in tool_calls]
+    return canonical
+
+
+_tool_fingerprints: Dict[Tuple[int, ...], str] = {}
+
+def tools_fingerprint(tools: List[Any]) -> str:
+    """Hash of the JSON schemas of the bound tools."""
+    ids = tuple(id(t) for t in tools)
+    if ids not in _tool_fingerprints:
+        schemas = tool_schemas(tools)
+        _tool_fingerprints[ids] = hashlib.sha256(
+            json.dumps(schemas, sort_keys=True, default=str).encode()
+        ).hexdigest()
+    return _tool_fingerprints[ids]
+
+
+class ResponseCache:
+    """Exact-match cache of model replies keyed on the canonicalized request.
+
+    Entries live in an in-memory LRU and, if a directory is given, in a JSON
+    file per key on disk so they survive restarts. Cache hit latency and model
+    latency are recorded side by side.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None, directory: Optional[str] = None):
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.directory = directory
+        self._lock = threading.Lock()
+        self.disk_hits = 0
+        self.hit_seconds = 0.0
+        self.model_calls = 0
+        self.model_seconds = 0.0
+
+    def key(self, messages: List[Any], model_id: str, tools: List[Any]) -> str:
+        request = {
+            "model": model_id,
+            "tools": tools_fingerprint(tools),
+            "messages": [canonical_message(m) for m in messages],
+        }
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key: str) -> Optional[AIMessage]:
+        msg = self.memory.get(key)
+        if msg is MISSING and self.directory:
+            path = self._path(key)
+            try:
+                if self.ttl is not None and time.time() - os.path.getmtime(path) > self.ttl:
+                    raise FileNotFoundError(path)
+                with open(path, 'r') as f:
+                    msg = messages_from_dict([json.load(f)])[0]
+                self.memory.set(key, msg)
+                with self._lock:
+                    self.disk_hits += 1
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError) as e:
+                logger.error("Could not read cached response %s: %s", key, str(e))
+        if msg is MISSING:
+            return None
+        # Callers mutate tool call args, so each hit gets its own copy
+        return msg.model_copy(deep=True)
+
+    def set(self, key: str, msg: AIMessage) -> None:
+        msg = msg.model_copy(deep=True)
+        self.memory.set(key, msg)
+        if self.directory:
+            path = self._path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = path + ".tmp"
+                with open(tmp, 'w') as f:
+                    json.dump(message_to_dict(msg), f, default=str)
+                os.replace(tmp, path)
+            except OSError as e:
+                logger.error("Could not write cached response %s: %s", key, str(e))
+
+    def record_hit(self, seconds: float) -> None:
+        with self._lock:
+            self.hit_seconds += seconds
+
+    def record_model_call(self, seconds: float) -> None:
+        with self._lock:
+            self.model_calls += 1
+            self.model_seconds += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.memory.stats()
+        with self._lock:
+            # A disk hit is first counted as a memory miss
+            hits = stats["hits"] + self.disk_hits
+            stats.update({
+                "hits": hits,
+                "misses": stats["misses"] - self.disk_hits,
+                "disk_hits": self.disk_hits,
+                "mean_hit_ms": self.hit_seconds * 1000 / hits if hits else None,
+                "model_calls": self.model_calls,
+                "mean_model_ms": self.model_seconds * 1000 / self.model_calls if self.model_calls else None,
+            })
+        return stats
+
+
+response_cache = ResponseCache(
+    maxsize=int(os.getenv('RESPONSE_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('RESPONSE_CACHE_TTL', '3600')) or None,
+    directory=os.getenv('RESPONSE_CACHE_DIR') or None
+)
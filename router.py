@@ -0,0 +1,137 @@
+from typing import Any, Callable, Dict, List, Optional, Pattern, Tuple
+import logging
+import os
+import re
+import threading
+import uuid
+
+from telemetry import metrics
+
+logger = logging.getLogger(__name__)
+
+ROUTER_ENABLED = os.getenv('ROUTER', 'false').lower() == 'true'
+
+# Slack prefixes channel messages with the bot's mention
+MENTION = re.compile(r"<@[A-Z0-9]+>")
+
+
+class Route:
+    """A high-confidence phrasing that maps straight to one tool call."""
+
+    def __init__(self, tool_name: str, patterns: List[Pattern], args: Callable[[re.Match], Dict[str, Any]],
+                 reply: str):
+        self.tool_name = tool_name
+        self.patterns = patterns
+        self.args = args
+        self.reply = reply
+
+    def match(self, text: str) -> Optional[Dict[str, Any]]:
+        for pattern in self.patterns:
+            m = pattern.fullmatch(text)
+            if m:
+                return self.args(m)
+        return None
+
+    def tool_call(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        return {"name": self.tool_name, "args": args, "id": f"call_route_{uuid.uuid4().hex[:24]}", "type": "tool_call"}
+
+
+ROUTES: List[Route] = []
+
+def route(tool_name: str, *patterns: str, reply: str = "{result}"):
+    """Route messages fully matching one of patterns to tool_name.
+
+    The decorated function turns the regex match into the tool's arguments;
+    reply is formatted with the tool's result to answer the user.
+    """
+    def decorator(func):
+        compiled = [re.compile(p, re.IGNORECASE) for p in patterns]
+        ROUTES.append(Route(tool_name, compiled, func, reply))
+        return func
+    return decorator
+
+
+def match_route(text: str) -> Optional[Tuple[Route, Dict[str, Any]]]:
+    """Return the single route matching text, or None if none or several match."""
+    text = MENTION.sub("", text).strip()
+    matches = []
+    for candidate in ROUTES:
+        args = candidate.match(text)
+        if args is not None:
+            matches.append((candidate, args))
+    # Ambiguous or unknown requests are the model's job
+    return matches[0] if len(matches) == 1 else None
+
+
+# An unquoted payload is one line with no further clause: anything after a
+# comma, semicolon or "and"/"then"/"also" could be another instruction
+_UPPER = r"(?:please\s+)?(?:convert\s+)?(?:to\s+)?(?:upper\s*case|capitali[sz]e)(?:\s+(?:this|the following|text))?"
+_PAYLOAD = r"(?P<text>(?:(?!\b(?:and|then|also)\b)[^\n,;\"])*[^\s,;\".!])"
+
+
+@route("to_upper",
+       _UPPER + r"\s*:[ \t]*" + _PAYLOAD + r"[ \t]*[.!]?",
+       _UPPER + r"\s*:?[ \t]*\"(?P<text>[^\"\n]+)\"[ \t]*[.!]?")
+def _to_upper_args(m: re.Match) -> Dict[str, Any]:
+    return {"input_text": m["text"].strip()}
+
+
+@route("get_date",
+       r"(?:what(?:'s| is)\s+)?(?:today'?s|the current|the)\s+date(?:\s+today)?\s*\??",
+       r"what(?:'s| is)\s+the\s+date\s+today\s*\??",
+       r"date\s*\??",
+       reply="Today's date is {result}.")
+def _get_date_args(m: re.Match) -> Dict[str, Any]:
+    return {}
+
+
+class RouterStats:
+    """Bypass rate of the router and an estimate of the latency it saved.
+
+    A routed turn replaces two model calls, one to pick the tool and one to
+    phrase its result, so the saving is estimated from the mean model call
+    latency measured alongside.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routed = 0
+        self.routed_seconds = 0.0
+        self.fallthrough = 0
+        self.model_calls = 0
+        self.model_seconds = 0.0
+
+    def record_routed(self, seconds: float) -> None:
+        with self._lock:
+            self.routed += 1
+            self.routed_seconds += seconds
+        metrics.inc("router_turns_total", (("path", "routed"),))
+
+    def record_fallthrough(self) -> None:
+        with self._lock:
+            self.fallthrough += 1
+        metrics.inc("router_turns_total", (("path", "model"),))
+
+    def record_model_call(self, seconds: float) -> None:
+        with self._lock:
+            self.model_calls += 1
+            self.model_seconds += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            turns = self.routed + self.fallthrough
+            mean_model = self.model_seconds / self.model_calls if self.model_calls else None
+            saved = None
+            if mean_model is not None:
+                saved = self.routed * 2 * mean_model - self.routed_seconds
+            return {
+                "routed": self.routed,
+                "fallthrough": self.fallthrough,
+                "bypass_rate": self.routed / turns if turns else None,
+                "mean_routed_ms": self.routed_seconds * 1000 / self.routed if self.routed else None,
+                "mean_model_ms": mean_model * 1000 if mean_model is not None else None,
+                "estimated_seconds_saved": saved,
+            }
+
+
+router_stats = RouterStats()
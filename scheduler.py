@@ -0,0 +1,286 @@
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+
+from telemetry import metrics, record_span
+
+logger = logging.getLogger(__name__)
+
+# Channel of the slot held by the current thread or task, for extra calls made under it
+_slot_channel: ContextVar[Optional[str]] = ContextVar("scheduler_slot_channel", default=None)
+
+# Per-turn caps on the model/tool loop in LangGraphManager (0 disables a cap)
+MAX_TURN_ITERATIONS = int(os.getenv('MAX_TURN_ITERATIONS', '10'))
+MAX_TURN_TOKENS = int(os.getenv('MAX_TURN_TOKENS', '200000'))
+TURN_LIMIT_MESSAGE = "I had to stop working on this request because it took too many steps. Please narrow it down and try again."
+
+
+def channel_of(conversation_id: str) -> str:
+    """Conversation IDs are "<channel>::<thread_ts>"; other IDs are their own channel."""
+    return conversation_id.split("::", 1)[0]
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """Parse "C123=2,C456=0.5" into channel weights."""
+    weights = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        channel, _, weight = item.partition("=")
+        weights[channel.strip()] = float(weight)
+    return weights
+
+
+def is_rate_limit(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after", headers.get("Retry-After"))
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class _Waiter:
+    __slots__ = ("channel", "granted", "cancelled", "event", "loop", "future")
+
+    def __init__(self, channel: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.channel = channel
+        self.granted = False
+        self.cancelled = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def grant(self) -> None:
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class FairScheduler:
+    """Admission control for model calls, shared by every conversation.
+
+    At most max_concurrency calls run at once, and at most channel_quota of
+    them for any one channel. Waiting calls are ordered by weighted fair
+    queuing: each channel's calls get virtual finish tags spaced 1/weight
+    apart, so a busy channel can't starve the others. A provider rate limit
+    pauses every call, not just the one that hit it, and the call is retried
+    with exponential backoff.
+
+    Sync callers block a thread and async callers await, against the same
+    queue and limits.
+    """
+
+    def __init__(self, max_concurrency: int = 16, channel_quota: int = 4, weights: Optional[Dict[str, float]] = None,
+                 max_retries: int = 5, base_backoff: float = 1.0, max_backoff: float = 60.0):
+        self.max_concurrency = max_concurrency
+        self.channel_quota = channel_quota
+        self.weights = weights or {}
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._heap: List[Tuple[float, int, _Waiter]] = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._channel_in_flight: Dict[str, int] = {}
+        self._finish: Dict[str, float] = {}
+        self._vtime = 0.0
+        self._paused_until = 0.0
+        self.granted = 0
+        self.rate_limited = 0
+        self.wait_seconds = 0.0
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        start = max(self._vtime, self._finish.get(waiter.channel, 0.0))
+        tag = start + 1.0 / self.weights.get(waiter.channel, 1.0)
+        self._finish[waiter.channel] = tag
+        heapq.heappush(self._heap, (tag, next(self._seq), waiter))
+
+    def _dispatch(self) -> None:
+        skipped = []
+        while self._heap and (self.max_concurrency <= 0 or self._in_flight < self.max_concurrency):
+            tag, seq, waiter = heapq.heappop(self._heap)
+            if waiter.cancelled:
+                continue
+            if 0 < self.channel_quota <= self._channel_in_flight.get(waiter.channel, 0):
+                skipped.append((tag, seq, waiter))
+                continue
+            self._in_flight += 1
+            self._channel_in_flight[waiter.channel] = self._channel_in_flight.get(waiter.channel, 0) + 1
+            self._vtime = max(self._vtime, tag)
+            self.granted += 1
+            waiter.grant()
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+
+    def _release(self, channel: str) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._channel_in_flight[channel] -= 1
+            if not self._channel_in_flight[channel]:
+                del self._channel_in_flight[channel]
+                # An idle channel whose tags are behind virtual time starts fresh next time
+                if self._finish.get(channel, 0.0) <= self._vtime:
+                    self._finish.pop(channel, None)
+            self._dispatch()
+
+    def _record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.wait_seconds += seconds
+        record_span("scheduler_wait", seconds)
+
+    @contextmanager
+    def slot(self, conversation_id: str):
+        """Hold one model call slot for conversation_id, blocking until it is granted."""
+        waiter = _Waiter(channel_of(conversation_id))
+        start = time.perf_counter()
+        with self._lock:
+            self._enqueue(waiter)
+            self._dispatch()
+        waiter.event.wait()
+        self._record_wait(time.perf_counter() - start)
+        token = _slot_channel.set(waiter.channel)
+        try:
+            yield
+        finally:
+            _slot_channel.reset(token)
+            self._release(waiter.channel)
+
+    @asynccontextmanager
+    async def aslot(self, conversation_id: str):
+        """Async variant of slot."""
+        waiter = _Waiter(channel_of(conversation_id), asyncio.get_running_loop())
+        start = time.perf_counter()
+        with self._lock:
+            self._enqueue(waiter)
+            self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                waiter.cancelled = True
+                granted = waiter.granted
+            if granted:
+                self._release(waiter.channel)
+            raise
+        self._record_wait(time.perf_counter() - start)
+        token = _slot_channel.set(waiter.channel)
+        try:
+            yield
+        finally:
+            _slot_channel.reset(token)
+            self._release(waiter.channel)
+
+    def spare_slot(self) -> Optional[Callable[[], None]]:
+        """Take a slot for an extra call made under the caller's slot, if one is free right now.
+
+        Only spare capacity is used, so the extra call never runs ahead of a
+        queued one. Returns the function that releases the slot, or None if
+        there is no spare slot. Outside a slot there is nothing to count
+        against, and a no-op is returned.
+        """
+        channel = _slot_channel.get()
+        if channel is None:
+            return lambda: None
+        with self._lock:
+            if any(not waiter.cancelled for _, _, waiter in self._heap):
+                return None
+            if 0 < self.max_concurrency <= self._in_flight:
+                return None
+            if 0 < self.channel_quota <= self._channel_in_flight.get(channel, 0):
+                return None
+            self._in_flight += 1
+            self._channel_in_flight[channel] = self._channel_in_flight.get(channel, 0) + 1
+        return lambda: self._release(channel)
+
+    def _backoff(self, error: Exception, attempt: int) -> float:
+        delay = retry_after(error)
+        if delay is None:
+            delay = min(self.max_backoff, self.base_backoff * 2 ** attempt) * (0.5 + random.random() / 2)
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self.rate_limited += 1
+        metrics.inc("model_rate_limited_total")
+        logger.warning("Model provider rate limited us, pausing model calls for %.1fs (attempt %d)", delay, attempt + 1)
+        return delay
+
+    def _pause_remaining(self) -> float:
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def run(self, conversation_id: str, fn: Callable[[], Any]) -> Any:
+        """Run a model call fn() in a slot, retrying it after provider rate limits."""
+        for attempt in itertools.count():
+            with self.slot(conversation_id):
+                pause = self._pause_remaining()
+                if pause:
+                    time.sleep(pause)
+                try:
+                    return fn()
+                except Exception as e:
+                    if not is_rate_limit(e) or attempt >= self.max_retries:
+                        raise
+                    self._backoff(e, attempt)
+
+    async def arun(self, conversation_id: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Async variant of run; fn returns an awaitable."""
+        for attempt in itertools.count():
+            async with self.aslot(conversation_id):
+                pause = self._pause_remaining()
+                if pause:
+                    await asyncio.sleep(pause)
+                try:
+                    return await fn()
+                except Exception as e:
+                    if not is_rate_limit(e) or attempt >= self.max_retries:
+                        raise
+                    self._backoff(e, attempt)
+
+    def queue_depths(self) -> Dict[str, int]:
+        """Waiting calls per channel."""
+        depths: Dict[str, int] = {}
+        with self._lock:
+            for _, _, waiter in self._heap:
+                if not waiter.cancelled:
+                    depths[waiter.channel] = depths.get(waiter.channel, 0) + 1
+        return depths
+
+    def stats(self) -> Dict[str, Any]:
+        depths = self.queue_depths()
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "queued": sum(depths.values()),
+                "granted": self.granted,
+                "rate_limited": self.rate_limited,
+                "mean_wait_ms": self.wait_seconds * 1000 / self.granted if self.granted else None,
+            }
+
+
+scheduler = FairScheduler(
+    max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '16')),
+    channel_quota=int(os.getenv('LLM_CHANNEL_CONCURRENCY', '4')),
+    weights=parse_weights(os.getenv('LLM_CHANNEL_WEIGHTS', '')),
+    max_retries=int(os.getenv('LLM_RATE_LIMIT_RETRIES', '5'))
+)
+metrics.gauge("scheduler_in_flight", lambda: scheduler.stats()["in_flight"])
+metrics.gauge("scheduler_queue_depth", lambda: {(("channel", c),): n for c, n in scheduler.queue_depths().items()})
@@ -0,0 +1,436 @@
+"""Multi-process mode: one Socket Mode front end routing to N worker processes.
+
+Each Slack conversation (channel::thread_ts) is owned by exactly one worker,
+picked by a consistent hash of its ID, so its LangGraphManager only ever
+lives in that worker's memory. Approval buttons carry the conversation ID as
+their value and are routed the same way.
+
+The front end remembers every envelope it has handed to a worker until the
+worker reports it done. If a worker dies, it is restarted and its unfinished
+envelopes are sent again, so events are processed at least once.
+
+Admission happens in the front end, and refused messages get the busy
+reply there. A message counts as queued until its worker starts it, as in
+single-process mode, and against its user and channel until it is done.
+The worker queues it at the priority the front end gave it.
+
+    python sharding.py            # SHARD_WORKERS worker processes
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from intake import BUSY_MESSAGE, PRIORITY_RESUME, Admission, event_deduper, event_keys, message_priority
+
+logger = logging.getLogger(__name__)
+
+# Sequence number a worker reports once it has finished starting up
+READY = -1
+# Result a worker reports when it starts an envelope; the finished envelope's result is a dict
+STARTED = None
+# How long a stopping worker waits for background jobs before cancelling them; keep it under
+# the timeout given to ShardRouter.restart and stop
+DRAIN_SECONDS = float(os.getenv('SHARD_DRAIN_SECONDS', '20'))
+# Conversations the front end remembers as active, for busy replies to thread messages
+ACTIVE_CONVERSATIONS = 10000
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring over worker indexes with virtual nodes.
+
+    Changing the number of workers only moves the conversations whose ring
+    segment changes owner, about 1/N of them.
+    """
+
+    def __init__(self, nodes: int, replicas: int = 64):
+        points = sorted((_hash(f"{node}:{replica}"), node) for node in range(nodes) for replica in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [n for _, n in points]
+
+    def node_for(self, key: str) -> int:
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+def conversation_id_for(event: Dict[str, Any]) -> str:
+    return event.get("channel", "") + "::" + event.get("thread_ts", event.get("ts", ""))
+
+
+def default_client_factory() -> Any:
+    from slack_sdk import WebClient
+    return WebClient(token=os.environ.get("SLACK_BOT_TOKEN"))
+
+
+def _say_for(client: Any, channel: str) -> Callable[..., Any]:
+    def say(text: str = None, blocks=None, thread_ts: str = None, **kwargs):
+        return client.chat_postMessage(channel=channel, text=text, blocks=blocks, thread_ts=thread_ts, **kwargs)
+    return say
+
+
+def _worker_main(index: int, inbox, outbox, client_factory: Callable[[], Any],
+                 initializer: Optional[Callable[[], None]]) -> None:
+    """Worker process: run envelopes from inbox through the slack.py handlers."""
+    if initializer is not None:
+        initializer()
+    import manager
+    import slack
+    from jobs import job_engine
+    from telemetry import start_metrics_server
+    client = client_factory()
+    try:
+        # The front end serves METRICS_PORT; worker i serves METRICS_PORT + 1 + i
+        start_metrics_server(port_offset=index + 1)
+    except OSError as e:
+        # E.g. the process being replaced still holds the port
+        logger.error("Shard worker %d could not serve metrics: %s", index, str(e))
+
+    def run(seq: int, kind: str, payload: Dict[str, Any]) -> None:
+        outbox.put((index, seq, STARTED))
+        result: Dict[str, Any] = {}
+        try:
+            if kind == "message":
+                event = payload["event"]
+                slack.process_message_event(event=event, say=_say_for(client, event["channel"]), client=client,
+                                            bot_user_id=payload.get("bot_user_id"))
+                conversation_id = conversation_id_for(event)
+            else:
+                # Already on the worker's intake queue, so the click is processed directly
+                process = slack.process_approval if kind == "approve" else slack.process_cancellation
+                process(body=payload, say=_say_for(client, payload["channel"]["id"]), client=client)
+                conversation_id = payload["actions"][0]["value"]
+            # Reported back so callers can tell whether the turn is waiting on an approval
+            if conversation_id in manager.conversation_managers:
+                result["active"] = True
+                mgr = manager.conversation_managers[conversation_id]
+                if mgr.pendig_approval:
+                    result["approval_message_ts"] = mgr.approval_message_ts
+        except Exception as e:
+            logger.error("Worker %d failed on envelope %d: %s", index, seq, str(e), exc_info=True)
+            result["error"] = str(e)
+        finally:
+            outbox.put((index, seq, result))
+
+    # The front end already admitted every envelope; here they are only ordered by priority
+    slack.intake_queue.admission = None
+    logger.info("Shard worker %d started (pid %d)", index, os.getpid())
+    outbox.put((index, READY, {}))
+    while True:
+        envelope = inbox.get()
+        if envelope is None:
+            break
+        seq, kind, priority, payload = envelope
+        slack.intake_queue.offer(priority, None, None, run, seq, kind, payload)
+    # Graceful stop: finish what was already accepted, then the background jobs and the
+    # turns they resume. Jobs still running at the deadline are cancelled, so their turns
+    # end and are persisted instead of being cut off.
+    deadline = time.monotonic() + DRAIN_SECONDS
+    slack.intake_queue.join()
+    while job_engine.busy():
+        cancelled = job_engine.drain(max(0.0, deadline - time.monotonic()))
+        slack.intake_queue.join()
+        if cancelled:
+            logger.warning("Shard worker %d cancelled background jobs in %d conversations to stop",
+                           index, cancelled)
+        if time.monotonic() >= deadline:
+            # A cancelled job's thread can't be interrupted; its late result is discarded anyway
+            break
+    if manager.conversation_managers.store is not None:
+        manager.conversation_managers.store.flush()
+    logger.info("Shard worker %d stopped", index)
+    if job_engine.busy():
+        # A normal exit would wait for the cancelled job threads; send the last results and leave
+        outbox.close()
+        outbox.join_thread()
+        os._exit(0)
+
+
+class _Shard:
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.inbox = None
+        self.in_flight: "OrderedDict[int, Tuple[int, str, int, Dict[str, Any]]]" = OrderedDict()
+        self.restarts = 0
+        self.stopping = False
+        self.ready = threading.Event()
+
+
+class ShardRouter:
+    """Routes Slack events and actions to worker processes by conversation ID."""
+
+    def __init__(self, workers: int = 4, client_factory: Callable[[], Any] = default_client_factory,
+                 initializer: Optional[Callable[[], None]] = None, start_method: str = "spawn",
+                 admission: Optional[Admission] = None):
+        self.ring = HashRing(workers)
+        self.client_factory = client_factory
+        self.initializer = initializer
+        self.admission = admission
+        self._context = multiprocessing.get_context(start_method)
+        self._outbox = self._context.Queue()
+        self._shards = [_Shard(i) for i in range(workers)]
+        self._futures: Dict[int, Future] = {}
+        # Admission places held by dispatched messages: seq -> (priority, user, channel, dispatched at)
+        self._tickets: Dict[int, Tuple[int, Optional[str], Optional[str], float]] = {}
+        # Dispatched messages a worker has started, so a replayed envelope isn't started twice
+        self._started: Set[int] = set()
+        self._active: "OrderedDict[str, bool]" = OrderedDict()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._running = False
+        self._collector = None
+        self.replayed = 0
+
+    def start(self, wait: bool = True, timeout: float = 120.0) -> None:
+        """Start the workers, by default waiting until each has imported the bot and is ready."""
+        self._running = True
+        with self._lock:
+            for shard in self._shards:
+                self._spawn(shard)
+        self._collector = threading.Thread(target=self._collect, name="shard-collector", daemon=True)
+        self._collector.start()
+        deadline = time.monotonic() + timeout
+        for shard in self._shards if wait else []:
+            if not shard.ready.wait(max(0.0, deadline - time.monotonic())):
+                raise TimeoutError(f"shard worker {shard.index} did not start within {timeout}s")
+
+    def _spawn(self, shard: _Shard) -> None:
+        shard.inbox = self._context.Queue()
+        shard.stopping = False
+        shard.ready.clear()
+        shard.process = self._context.Process(
+            target=_worker_main,
+            args=(shard.index, shard.inbox, self._outbox, self.client_factory, self.initializer),
+            name=f"shard-{shard.index}",
+            daemon=True
+        )
+        shard.process.start()
+        # Anything the previous process accepted but never finished goes to the new one
+        for envelope in shard.in_flight.values():
+            shard.inbox.put(envelope)
+            self.replayed += 1
+
+    def _dispatch(self, conversation_id: str, kind: str, priority: int, payload: Dict[str, Any],
+                  ticket: Optional[Tuple[int, Optional[str], Optional[str]]] = None) -> Future:
+        future: Future = Future()
+        with self._lock:
+            shard = self._shards[self.ring.node_for(conversation_id)]
+            seq = next(self._seq)
+            envelope = (seq, kind, priority, payload)
+            shard.in_flight[seq] = envelope
+            self._futures[seq] = future
+            if ticket is not None:
+                self._tickets[seq] = ticket + (time.perf_counter(),)
+            shard.inbox.put(envelope)
+        return future
+
+    def route_event(self, event: Dict[str, Any], body: Optional[Dict[str, Any]] = None,
+                    context: Optional[Dict[str, Any]] = None,
+                    say: Optional[Callable[..., Any]] = None) -> Optional[Future]:
+        """Send a message event to its conversation's worker, dropping redeliveries.
+
+        Messages not directed at the bot are dropped, and ones admission
+        refuses get a busy reply through say.
+        """
+        if event_deduper.seen(*event_keys(event, body)):
+            logger.info("Dropping duplicate delivery of event in %s (ts %s)", event.get("channel"), event.get("ts"))
+            return None
+        bot_user_id = context.get("bot_user_id") if context else None
+        priority = message_priority(event, bot_user_id)
+        if priority is None:
+            logger.info("Message not directed to bot, ignoring")
+            return None
+        conversation_id = conversation_id_for(event)
+        ticket = None
+        if self.admission is not None:
+            ticket = (priority, event.get("user"), event.get("channel"))
+            reason = self.admission.admit(*ticket)
+            if reason is not None:
+                logger.warning("Refusing message from %s in %s: %s limit reached",
+                               event.get("user"), event.get("channel"), reason)
+                self._reply_busy(event, conversation_id, bot_user_id, say)
+                return None
+        payload = {"event": event, "bot_user_id": bot_user_id}
+        return self._dispatch(conversation_id, "message", priority, payload, ticket)
+
+    def _reply_busy(self, event: Dict[str, Any], conversation_id: str, bot_user_id: Optional[str],
+                    say: Optional[Callable[..., Any]]) -> None:
+        """Tell the user to retry, unless the message is in a thread the bot isn't part of."""
+        with self._lock:
+            active = conversation_id in self._active
+        if say is None or (event.get("thread_ts") and f"<@{bot_user_id}>" not in event.get("text", "")
+                           and not active):
+            return
+        try:
+            say(text=BUSY_MESSAGE, thread_ts=event.get("thread_ts", event.get("ts")))
+        except Exception as e:
+            logger.error("Error sending busy reply: %s", str(e))
+
+    def _begun(self, seq: int) -> None:
+        """Stop counting a message as queued once its worker starts it."""
+        ticket = self._tickets.get(seq)
+        if ticket is not None and seq not in self._started:
+            self._started.add(seq)
+            priority, _, _, dispatched = ticket
+            self.admission.started(priority, time.perf_counter() - dispatched)
+
+    def _finished(self, seq: int, envelope: Optional[Tuple[int, str, int, Dict[str, Any]]],
+                  result: Dict[str, Any]) -> None:
+        """Release a finished message's admission place and remember whether its conversation is active."""
+        self._begun(seq)
+        self._started.discard(seq)
+        ticket = self._tickets.pop(seq, None)
+        if ticket is not None:
+            self.admission.finished(*ticket[1:3])
+        if envelope is not None and envelope[1] == "message" and result.get("active"):
+            conversation_id = conversation_id_for(envelope[3]["event"])
+            self._active[conversation_id] = True
+            self._active.move_to_end(conversation_id)
+            if len(self._active) > ACTIVE_CONVERSATIONS:
+                self._active.popitem(last=False)
+
+    def route_action(self, kind: str, body: Dict[str, Any]) -> Future:
+        """Send an approve or cancel click to the worker owning the conversation in the button value."""
+        return self._dispatch(body["actions"][0]["value"], kind, PRIORITY_RESUME, body)
+
+    def _collect(self) -> None:
+        while self._running:
+            try:
+                index, seq, result = self._outbox.get(timeout=0.5)
+            except queue.Empty:
+                self._revive_dead()
+                continue
+            if seq == READY:
+                self._shards[index].ready.set()
+                continue
+            if result is STARTED:
+                with self._lock:
+                    self._begun(seq)
+                continue
+            with self._lock:
+                envelope = self._shards[index].in_flight.pop(seq, None)
+                future = self._futures.pop(seq, None)
+                self._finished(seq, envelope, result)
+            if future is not None:
+                future.set_result(result)
+            self._revive_dead()
+
+    def _revive_dead(self) -> None:
+        with self._lock:
+            for shard in self._shards:
+                if self._running and not shard.stopping and not shard.process.is_alive():
+                    logger.warning("Shard worker %d exited with %s, restarting with %d in-flight envelopes",
+                                   shard.index, shard.process.exitcode, len(shard.in_flight))
+                    shard.restarts += 1
+                    self._spawn(shard)
+
+    def restart(self, index: int, graceful: bool = True, timeout: float = 30.0) -> None:
+        """Restart one worker. A graceful restart drains it first; otherwise it is killed and its work replayed."""
+        shard = self._shards[index]
+        if graceful:
+            with self._lock:
+                shard.stopping = True
+                old_inbox = shard.inbox
+            old_inbox.put(None)
+            deadline = time.monotonic() + timeout
+            shard.process.join(timeout)
+            if shard.process.is_alive():
+                # Never let two processes own the same conversations
+                logger.warning("Shard worker %d did not stop within %ss, killing it", index, timeout)
+                shard.process.kill()
+                shard.process.join()
+            # Let the collector take the last completions off the outbox before anything is replayed
+            while shard.in_flight and time.monotonic() < deadline:
+                time.sleep(0.05)
+            with self._lock:
+                shard.restarts += 1
+                self._spawn(shard)
+        else:
+            # The collector notices the dead process and restarts it
+            shard.process.kill()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Drain every worker and stop the collector."""
+        with self._lock:
+            for shard in self._shards:
+                shard.stopping = True
+                shard.inbox.put(None)
+        deadline = time.monotonic() + timeout
+        for shard in self._shards:
+            shard.process.join(max(0.0, deadline - time.monotonic()))
+        self._running = False
+        if self._collector is not None:
+            self._collector.join()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": len(self._shards),
+                "in_flight": {s.index: len(s.in_flight) for s in self._shards},
+                "restarts": {s.index: s.restarts for s in self._shards},
+                "replayed": self.replayed,
+                "admission": self.admission.stats() if self.admission is not None else None,
+            }
+
+
+def build_app(router: ShardRouter):
+    """Bolt app for the front end: it only acks, de-duplicates and routes."""
+    from slack_bolt import App
+    app = App(
+        token=os.environ.get("SLACK_BOT_TOKEN"),
+        token_verification_enabled=os.getenv("SLACK_TOKEN_VERIFICATION", "true").lower() == "true"
+    )
+
+    @app.event("message")
+    def handle_message(event, context, body, say):
+        router.route_event(event, body=body, context=context, say=say)
+
+    @app.action("approve_function")
+    def handle_approval(ack, body):
+        ack()
+        router.route_action("approve", body)
+
+    @app.action("cancel_function")
+    def handle_cancellation(ack, body):
+        ack()
+        router.route_action("cancel", body)
+
+    return app
+
+
+def main():
+    """Run the Socket Mode front end and SHARD_WORKERS worker processes."""
+    from dotenv import load_dotenv
+    from slack_bolt.adapter.socket_mode import SocketModeHandler
+    load_dotenv()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    from intake import admission
+    from telemetry import start_metrics_server
+    router = ShardRouter(workers=int(os.getenv("SHARD_WORKERS", str(os.cpu_count() or 4))), admission=admission)
+    start_metrics_server()
+    router.start()
+    handler = SocketModeHandler(app=build_app(router), app_token=os.environ.get("SLACK_APP_TOKEN"))
+    logger.info("⚡️ Bolt front end is running with %d shard workers!", router.stats()["workers"])
+    try:
+        handler.start()
+    finally:
+        router.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,16 @@ load_dotenv()
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from typing import Dict, List, Any
 from manager import get_or_create_manager, get_manager, conversation_managers
+from slack_blocks import approval_blocks, job_blocks, status_blocks
+from telemetry import start_metrics_server, traced_handler
+from slack_stream import STREAMING_ENABLED, StreamingReply
+from backfill import BACKFILL_ENABLED, thread_backfill
+from intake import BUSY_MESSAGE, WorkQueue, admission, event_deduper, event_keys, message_priority
+from jobs import job_engine
+from store import start_compaction
+from telemetry import metrics
 import logging
+import threading
 from datetime import datetime
 
 # Initialize logging
@@ -18,123 +27,172 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Initialize the Slack app
-app = App(token=os.environ.get("SLACK_BOT_TOKEN"))
+app = App(
+    token=os.environ.get("SLACK_BOT_TOKEN"),
+    # Disabled by the benchmark harness, which drives the handlers with a fake client
+    token_verification_enabled=os.getenv("SLACK_TOKEN_VERIFICATION", "true").lower() == "true"
+)
+
+# Message events are processed here, off the listener thread, so intake returns immediately
+intake_queue = WorkQueue(workers=int(os.getenv("INTAKE_WORKERS", "16")), admission=admission)
+metrics.gauge("intake_queue_depth", intake_queue.qsize)
+
+_bot_user_id = None
+_bot_user_id_lock = threading.Lock()
+
+def get_bot_user_id(client) -> str:
+    """Resolve the bot's user ID with auth.test once and cache it."""
+    global _bot_user_id
+    with _bot_user_id_lock:
+        if _bot_user_id is None:
+            _bot_user_id = client.auth_test()["user_id"]
+            logger.info("Bot app_id: %s", _bot_user_id)
+        return _bot_user_id
+
+def follow_jobs(manager, conversation_history_id: str, say, thread_ts: str, client, reply=None) -> None:
+    """Post the turn's background jobs with a Cancel button and resume the turn once they finish."""
+    batch = manager.job_batch
+    text = "Running in the background: " + ", ".join(job.tool_name for job in batch.jobs)
+    blocks = job_blocks(batch.jobs, conversation_history_id)
+    if reply:
+        reply.finish(text, blocks=blocks)
+        status = reply
+    else:
+        status = StreamingReply(client, say, thread_ts)
+        status.start(text, blocks)
+
+    def on_progress(batch):
+        # chat.update is limited per workspace, so progress edits share the streamed replies' budget
+        status.refresh(text, job_blocks(batch.jobs, conversation_history_id))
+
+    def on_done(batch):
+        try:
+            status.finish(text, blocks=job_blocks(batch.jobs, conversation_history_id))
+        except Exception as e:
+            logger.error("Could not update background job status: %s", str(e))
+        # The follow-up model loop is queued like a new message, so the job worker is freed
+        intake_queue.submit(bot_man, "", conversation_history_id, say, thread_ts, client=client, job_batch=batch, manager=manager)
 
-def bot_man(text: str, conversation_history_id: str, say, thread_ts: str, approved_functions: bool = False, call_from_button: bool = False) -> None:
-    """Process a message using the LangGraph agent and handle Slack interactions."""
+    batch.listen(on_progress=on_progress, on_done=on_done)
+
+def bot_man(text: str, conversation_history_id: str, say, thread_ts: str, approved_functions: bool = False, call_from_button: bool = False, client=None, job_batch=None, manager=None) -> None:
+    """Process a message using the LangGraph agent and handle Slack interactions.
+
+    job_batch is set when resuming after background jobs; the resume is skipped if it already ran.
+    Callers that already hold the conversation's manager pass it, so it isn't looked up again
+    after the registry may have evicted it.
+    """
     logger.info("bot_man called with conversation_history_id: %s, approved_functions: %s",
                 conversation_history_id, approved_functions)
     
+    reply = None
     try:
-        manager = get_manager(conversation_history_id)
-        response = None
-        tool_info = None
-
-        # Check for pending approvals first
-        if hasattr(manager, 'pendig_approval') and manager.pendig_approval:
-            if approved_functions:
-                # Execute pending approvals and get new state
-                response, tool_info = manager.process_message(
-                    text="",
-                    conversation_id=conversation_history_id,
-                    approved_functions=True
-                )
-            else:
-                # Reject pending approvals and get new state
-                response, tool_info = manager.process_message(
-                    text="",
-                    conversation_id=conversation_history_id,
-                    approved_functions=False
-                )
-        else:
-            # Process new message
+        manager = manager or get_manager(conversation_history_id)
+        # Only one turn per conversation at a time
+        with manager.lock:
+            if job_batch is not None and manager.job_batch is not job_batch:
+                # A newer message in the thread already took these jobs' results
+                logger.info("Jobs for %s were already resumed", conversation_history_id)
+                return
+            if STREAMING_ENABLED:
+                # Post a placeholder and edit it as the model streams its reply
+                reply = StreamingReply(client or app.client, say, thread_ts)
+                reply.start()
+
+            # A pending approval is resolved by approved_functions; otherwise text is a new message
             response, tool_info = manager.process_message(
-                text=text,
+                text=text if not manager.pendig_approval else "",
                 conversation_id=conversation_history_id,
-                approved_functions=False
+                approved_functions=approved_functions,
+                on_token=reply.on_token if reply else None
             )
 
-        logger.info("Message processed successfully, response: %s, tool_info: %s", response, tool_info)
-
-        # Handle response based on tool_info state
-        if tool_info and "pending_tool_calls" in tool_info:
-            # New approval needed, create approval message
-            blocks = [
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*Approval Required*\n{response}"
-                    }
-                }
-            ]
-            
-            # Add tool call information
-            for tool_call in tool_info["pending_tool_calls"]:
-                blocks.append({
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*Function:* {tool_call['name']}\n*Arguments:* ```{tool_call['arguments']}```"
-                    }
-                })
-            
-            # Add approval buttons
-            blocks.append({
-                "type": "actions",
-                "elements": [
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "Approve"
-                        },
-                        "style": "primary",
-                        "value": conversation_history_id,
-                        "action_id": "approve_function"
-                    },
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "Cancel"
-                        },
-                        "style": "danger",
-                        "value": conversation_history_id,
-                        "action_id": "cancel_function"
-                    }
-                ]
-            })
-            
-            # Send message and store the response which contains the message timestamp
-            approval_text = f"Approval Required: {response}"
-            result = say(blocks=blocks, text=approval_text, thread_ts=thread_ts)
-            # Store the message ts in the manager for later updates
-            manager.approval_message_ts = result['ts']
-        else:
-            # No approval needed, just send the response
-            # Ensure there's always a text value, use a default if response is None
-            text_response = response if response else "Processing your request..."
-            say(text=text_response, thread_ts=thread_ts)
+            logger.info("Message processed successfully, response length: %d, pending tool calls: %d",
+                    len(response or ""), len(tool_info.get("pending_tool_calls", [])))
+
+            # Handle response based on tool_info state
+            if tool_info and "pending_tool_calls" in tool_info:
+                # New approval needed, create approval message
+                blocks = approval_blocks(response, tool_info, conversation_history_id)
+
+                # Send message and store the response which contains the message timestamp
+                approval_text = f"Approval Required: {response}"
+                if reply:
+                    reply.finish(approval_text, blocks=blocks)
+                    manager.approval_message_ts = reply.ts
+                else:
+                    result = say(blocks=blocks, text=approval_text, thread_ts=thread_ts)
+                    # Store the message ts in the manager for later updates
+                    manager.approval_message_ts = result['ts']
+            elif tool_info and "background_jobs" in tool_info:
+                follow_jobs(manager, conversation_history_id, say, thread_ts, client or app.client, reply)
+            else:
+                # No approval needed, just send the response
+                # Ensure there's always a text value, use a default if response is None
+                text_response = response if response else "Processing your request..."
+                if reply:
+                    reply.finish(text_response)
+                else:
+                    say(text=text_response, thread_ts=thread_ts)
         
     except Exception as e:
         logger.error("Error in bot_man: %s", str(e), exc_info=True)
-        say(text=f"Sorry, I encountered an error: {str(e)}", thread_ts=thread_ts)
+        error_text = f"Sorry, I encountered an error: {str(e)}"
+        if reply and reply.ts:
+            reply.finish(error_text)
+        else:
+            say(text=error_text, thread_ts=thread_ts)
         raise
 
 @app.event("message")
-def handle_message(event, say, client):
+def handle_message(event, say, client, context=None, body=None):
+    """Accept a message event and queue it, dropping Slack's redeliveries.
+
+    Messages not directed at the bot are dropped here, and ones admission
+    refuses get a busy reply. Returns the queued work item's future, which
+    Bolt ignores.
+    """
+    logger.info("Received message event in %s (ts %s)", event.get("channel"), event.get("ts"))
+    if event_deduper.seen(*event_keys(event, body)):
+        logger.info("Dropping duplicate delivery of event in %s (ts %s)", event.get("channel"), event.get("ts"))
+        metrics.inc("slack_events_deduplicated_total")
+        return None
+    bot_user_id = (context.get("bot_user_id") if context else None) or get_bot_user_id(client)
+    priority = message_priority(event, bot_user_id)
+    if priority is None:
+        logger.info("Message not directed to bot, ignoring")
+        return None
+    future = intake_queue.offer(
+        priority, event.get("user"), event.get("channel"), process_message_event,
+        event=event, say=say, client=client, bot_user_id=bot_user_id
+    )
+    if future is None:
+        reply_busy(event, say, bot_user_id)
+    return future
+
+def reply_busy(event, say, bot_user_id: str) -> None:
+    """Tell the user to retry, unless the message is in a thread the bot isn't part of."""
+    thread_ts = event.get("thread_ts", event.get("ts"))
+    conversation_history_id = event.get("channel", "") + "::" + thread_ts
+    if (event.get("thread_ts") and f"<@{bot_user_id}>" not in event.get("text", "")
+            and conversation_history_id not in conversation_managers):
+        return
+    try:
+        say(text=BUSY_MESSAGE, thread_ts=thread_ts)
+    except Exception as e:
+        logger.error("Error sending busy reply: %s", str(e))
+
+@traced_handler("slack_message")
+def process_message_event(event, say, client, bot_user_id=None):
     """Handle all messages, including mentions and thread replies."""
-    logger.info("Received message event: %s", event)
     try:
         channel_id = event.get("channel")
         thread_ts = event.get("thread_ts", event.get("ts"))
         conversation_history_id = channel_id + "::" + thread_ts
         text = event.get("text", "")
         
-        # Get app's user ID
-        app_id = app.client.auth_test()["user_id"]
-        logger.info("Bot app_id: %s", app_id)
+        # Get app's user ID, from the authorization Bolt already did if available
+        app_id = bot_user_id or get_bot_user_id(client)
 
         # Check if message in the channel is directed to the app
         if not event.get("thread_ts") and f"<@{app_id}>" not in text:
@@ -143,104 +201,93 @@ def handle_message(event, say, client):
 
         # Check if this is a thread message
         if event.get("thread_ts") and conversation_history_id not in conversation_managers:
-            logger.info("Thread unknown or unrelated")
-            return
+            # Threads from before a restart, or handled elsewhere, are fetched from Slack
+            if not BACKFILL_ENABLED or not thread_backfill.resume(
+                    client, channel_id, thread_ts, event["ts"], app_id, mentioned=f"<@{app_id}>" in text):
+                logger.info("Thread unknown or unrelated")
+                return
         
         manager = get_or_create_manager(conversation_history_id)
         if manager.approval_message_ts:
-            app.client.chat_update(
+            client.chat_update(
                 channel=channel_id,
                 ts=manager.approval_message_ts,
                 text="Function Cancelled",
-                blocks=[{
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": "❌ *Function Cancelled*"
-                    }
-                }]
+                blocks=status_blocks("❌ *Function Cancelled*")
             )
 
         logger.info("Processing message in conversation: %s", conversation_history_id)
-        bot_man(text, conversation_history_id, say, thread_ts)
+        bot_man(text, conversation_history_id, say, thread_ts, client=client, manager=manager)
         logger.info("Message processed by bot_man")
             
     except Exception as e:
         logger.error(f"Error handling message: {str(e)}")
         say(text="Sorry, I encountered an error processing your message.", thread_ts=thread_ts)
 
-@app.action("approve_function")
-def handle_approval(ack, body, say):
-    """Handle approval button click."""
+def _resolve_approval(body, say, client, approved: bool) -> None:
+    conversation_history_id = body["actions"][0]["value"]
+    thread_ts = body["message"]["thread_ts"]
     try:
-        ack()
-        conversation_history_id = body["actions"][0]["value"]
-        thread_ts = body["message"]["thread_ts"]
-        logger.info("Function approval received for conversation: %s", conversation_history_id)
-        
-        # Get the original message timestamp
-        message_ts = body["message"]["ts"]
-        # Update the original message to show approval
-        app.client.chat_update(
+        if not approved and job_engine.cancel(conversation_history_id):
+            # The jobs' completion listener updates their message and resumes the turn
+            logger.info("Cancelled background jobs for conversation: %s", conversation_history_id)
+            return
+
+        manager = get_manager(conversation_history_id)
+        if not manager.pendig_approval:
+            # Already resolved by an earlier click or a new message in the thread
+            return
+        # Update the original message to show the decision
+        status = "✅ *Function Approved and Executed*" if approved else "❌ *Function Cancelled*"
+        client.chat_update(
             channel=body["channel"]["id"],
-            ts=message_ts,
-            text="Function Approved and Executed",
-            blocks=[{
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": "✅ *Function Approved and Executed*"
-                }
-            }]
+            ts=body["message"]["ts"],
+            text="Function Approved and Executed" if approved else "Function Cancelled",
+            blocks=status_blocks(status)
         )
-        manager = get_manager(conversation_history_id)
         if manager.approval_message_ts:
             manager.approval_message_ts = ""
-        # Process the approval
-        bot_man("", conversation_history_id, say, thread_ts, approved_functions=True, call_from_button=True)
-        
+        bot_man("", conversation_history_id, say, thread_ts, approved_functions=approved, call_from_button=True, client=client, manager=manager)
+
     except Exception as e:
-        logger.error(f"Error handling approval: {str(e)}")
-        say(text="Sorry, I encountered an error processing the approval.",
-            thread_ts=body["message"]["thread_ts"])
+        action = "approval" if approved else "cancellation"
+        logger.error("Error handling %s: %s", action, str(e))
+        say(text=f"Sorry, I encountered an error processing the {action}.", thread_ts=thread_ts)
+
+@traced_handler("slack_approval")
+def process_approval(body, say, client) -> None:
+    """Run an approved tool call and resume the turn."""
+    _resolve_approval(body, say, client, approved=True)
+
+@traced_handler("slack_cancellation")
+def process_cancellation(body, say, client) -> None:
+    """Cancel the pending tool call or background jobs and resume the turn."""
+    _resolve_approval(body, say, client, approved=False)
+
+@app.action("approve_function")
+def handle_approval(ack, body, say, client):
+    """Acknowledge an approval click and queue the resumed turn ahead of new messages.
+
+    Returns the queued work item's future, which Bolt ignores.
+    """
+    ack()
+    logger.info("Function approval received for conversation: %s", body["actions"][0]["value"])
+    return intake_queue.submit(process_approval, body=body, say=say, client=client)
 
 @app.action("cancel_function")
-def handle_cancellation(ack, body, say):
-    """Handle cancellation button click."""
-    try:
-        ack()
-        conversation_history_id = body["actions"][0]["value"]
-        thread_ts = body["message"]["thread_ts"]
-        logger.info("Function cancellation received for conversation: %s", conversation_history_id)
-        
-        # Get the original message timestamp
-        message_ts = body["message"]["ts"]
-        # Update the original message to show cancellation
-        app.client.chat_update(
-            channel=body["channel"]["id"],
-            ts=message_ts,
-            text="Function Cancelled",
-            blocks=[{
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": "❌ *Function Cancelled*"
-                }
-            }]
-        )
-        manager = get_manager(conversation_history_id)
-        if manager.approval_message_ts:
-            manager.approval_message_ts = ""
-        # Process the cancellation
-        bot_man("", conversation_history_id, say, thread_ts, approved_functions=False, call_from_button=True)
-        
-    except Exception as e:
-        logger.error(f"Error handling cancellation: {str(e)}")
-        say(text="Sorry, I encountered an error processing the cancellation.",
-            thread_ts=body["message"]["thread_ts"])
+def handle_cancellation(ack, body, say, client):
+    """Acknowledge a cancellation click and queue it ahead of new messages.
+
+    Returns the queued work item's future, which Bolt ignores.
+    """
+    ack()
+    logger.info("Function cancellation received for conversation: %s", body["actions"][0]["value"])
+    return intake_queue.submit(process_cancellation, body=body, say=say, client=client)
 
 def main():
     """Main entry point for the Slack bot."""
+    start_metrics_server()
+    start_compaction(conversation_managers.store)
     handler = SocketModeHandler(
         app=app,
         app_token=os.environ.get("SLACK_APP_TOKEN")
@@ -0,0 +1,320 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from slack_bolt.async_app import AsyncApp
+
+# Load environment variables from .env file
+load_dotenv()
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from typing import Dict
+from manager import aget_or_create_manager, aget_manager, conversation_managers
+from slack_blocks import approval_blocks, job_blocks, status_blocks
+from telemetry import metrics, start_metrics_server, traced_handler
+from backfill import BACKFILL_ENABLED, thread_backfill
+from intake import BUSY_MESSAGE, AsyncWorkQueue, admission, event_deduper, event_keys, message_priority
+from jobs import job_engine
+from store import start_compaction
+from slack_stream import STREAMING_ENABLED, AsyncStreamingReply
+import logging
+
+# Initialize logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Initialize the Slack app
+app = AsyncApp(token=os.environ.get("SLACK_BOT_TOKEN"))
+
+
+class ConversationLocks:
+    """Per-conversation asyncio locks so turns in one thread run in arrival order.
+
+    A lock only exists while a turn holds or waits on it, so idle threads cost nothing.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._users: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, conversation_id: str):
+        lock = self._locks.setdefault(conversation_id, asyncio.Lock())
+        self._users[conversation_id] = self._users.get(conversation_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[conversation_id] -= 1
+            if not self._users[conversation_id]:
+                del self._users[conversation_id]
+                del self._locks[conversation_id]
+
+
+conversation_locks = ConversationLocks()
+
+# Message events are processed by worker tasks so intake returns immediately
+intake_queue = AsyncWorkQueue(workers=int(os.getenv("ASYNC_INTAKE_WORKERS", "256")), admission=admission)
+metrics.gauge("intake_queue_depth", intake_queue.qsize)
+
+_bot_user_id = None
+_bot_user_id_lock = asyncio.Lock()
+
+async def get_bot_user_id(client) -> str:
+    """Resolve the bot's user ID with auth.test once and cache it."""
+    global _bot_user_id
+    async with _bot_user_id_lock:
+        if _bot_user_id is None:
+            _bot_user_id = (await client.auth_test())["user_id"]
+            logger.info("Bot app_id: %s", _bot_user_id)
+        return _bot_user_id
+
+
+async def follow_jobs(manager, conversation_history_id: str, say, thread_ts: str, client, reply=None) -> None:
+    """Post the turn's background jobs with a Cancel button and resume the turn once they finish.
+
+    Job listeners run on job worker threads, so they hand their Slack calls to the loop.
+    """
+    loop = asyncio.get_running_loop()
+    batch = manager.job_batch
+    text = "Running in the background: " + ", ".join(job.tool_name for job in batch.jobs)
+    blocks = job_blocks(batch.jobs, conversation_history_id)
+    if reply:
+        await reply.finish(text, blocks=blocks)
+        status = reply
+    else:
+        status = AsyncStreamingReply(client, say, thread_ts)
+        await status.start(text, blocks)
+
+    def on_progress(batch):
+        # Shares the streamed replies' chat.update budget, as slack.py does
+        asyncio.run_coroutine_threadsafe(status.refresh(text, job_blocks(batch.jobs, conversation_history_id)), loop)
+
+    async def resume(batch):
+        try:
+            await status.finish(text, blocks=job_blocks(batch.jobs, conversation_history_id))
+        except Exception as e:
+            logger.error("Could not update background job status: %s", str(e))
+        async with conversation_locks.hold(conversation_history_id):
+            await bot_man("", conversation_history_id, say, thread_ts, client=client, job_batch=batch, manager=manager)
+
+    def on_done(batch):
+        # Queued ahead of new messages, as slack.py does
+        loop.call_soon_threadsafe(intake_queue.submit, resume, batch)
+
+    batch.listen(on_progress=on_progress, on_done=on_done)
+
+async def bot_man(text: str, conversation_history_id: str, say, thread_ts: str, approved_functions: bool = False, call_from_button: bool = False, client=None, job_batch=None, manager=None) -> None:
+    """Process a message using the LangGraph agent and handle Slack interactions.
+
+    job_batch is set when resuming after background jobs; the resume is skipped if it already ran.
+    Callers that already hold the conversation's manager pass it, so it isn't looked up again
+    after the registry may have evicted it.
+    """
+    logger.info("bot_man called with conversation_history_id: %s, approved_functions: %s",
+                conversation_history_id, approved_functions)
+
+    reply = None
+    try:
+        manager = manager or await aget_manager(conversation_history_id)
+        # Callers hold conversation_locks, so this never waits. Holding it through the turn,
+        # as slack.py does, keeps the registry from evicting the conversation mid-turn.
+        with manager.lock:
+            if job_batch is not None and manager.job_batch is not job_batch:
+                # A newer message in the thread already took these jobs' results
+                logger.info("Jobs for %s were already resumed", conversation_history_id)
+                return
+            if STREAMING_ENABLED:
+                reply = AsyncStreamingReply(client or app.client, say, thread_ts)
+                await reply.start()
+
+            # A pending approval is resolved by approved_functions; otherwise text is a new message
+            response, tool_info = await manager.aprocess_message(
+                text=text if not manager.pendig_approval else "",
+                conversation_id=conversation_history_id,
+                approved_functions=approved_functions,
+                on_token=reply.on_token if reply else None
+            )
+
+            logger.info("Message processed successfully, response length: %d, pending tool calls: %d",
+                        len(response or ""), len(tool_info.get("pending_tool_calls", [])))
+
+            if tool_info and "pending_tool_calls" in tool_info:
+                blocks = approval_blocks(response, tool_info, conversation_history_id)
+                approval_text = f"Approval Required: {response}"
+                if reply:
+                    await reply.finish(approval_text, blocks=blocks)
+                    manager.approval_message_ts = reply.ts
+                else:
+                    result = await say(blocks=blocks, text=approval_text, thread_ts=thread_ts)
+                    # Store the message ts in the manager for later updates
+                    manager.approval_message_ts = result['ts']
+            elif tool_info and "background_jobs" in tool_info:
+                await follow_jobs(manager, conversation_history_id, say, thread_ts, client or app.client, reply)
+            else:
+                text_response = response if response else "Processing your request..."
+                if reply:
+                    await reply.finish(text_response)
+                else:
+                    await say(text=text_response, thread_ts=thread_ts)
+
+    except Exception as e:
+        logger.error("Error in bot_man: %s", str(e), exc_info=True)
+        error_text = f"Sorry, I encountered an error: {str(e)}"
+        if reply and reply.ts:
+            await reply.finish(error_text)
+        else:
+            await say(text=error_text, thread_ts=thread_ts)
+        raise
+
+@app.event("message")
+async def handle_message(event, say, client, context=None, body=None):
+    """Accept a message event and queue it, dropping Slack's redeliveries.
+
+    Messages not directed at the bot are dropped here, and ones admission
+    refuses get a busy reply. Returns the queued work item's future, which
+    Bolt ignores.
+    """
+    logger.info("Received message event in %s (ts %s)", event.get("channel"), event.get("ts"))
+    if event_deduper.seen(*event_keys(event, body)):
+        logger.info("Dropping duplicate delivery of event in %s (ts %s)", event.get("channel"), event.get("ts"))
+        metrics.inc("slack_events_deduplicated_total")
+        return None
+    bot_user_id = (context.get("bot_user_id") if context else None) or await get_bot_user_id(client)
+    priority = message_priority(event, bot_user_id)
+    if priority is None:
+        logger.info("Message not directed to bot, ignoring")
+        return None
+    future = intake_queue.offer(
+        priority, event.get("user"), event.get("channel"), process_message_event,
+        event=event, say=say, client=client, bot_user_id=bot_user_id
+    )
+    if future is None:
+        await reply_busy(event, say, bot_user_id)
+    return future
+
+async def reply_busy(event, say, bot_user_id: str) -> None:
+    """Tell the user to retry, unless the message is in a thread the bot isn't part of."""
+    thread_ts = event.get("thread_ts", event.get("ts"))
+    conversation_history_id = event.get("channel", "") + "::" + thread_ts
+    if (event.get("thread_ts") and f"<@{bot_user_id}>" not in event.get("text", "")
+            and not await conversation_managers.acontains(conversation_history_id)):
+        return
+    try:
+        await say(text=BUSY_MESSAGE, thread_ts=thread_ts)
+    except Exception as e:
+        logger.error("Error sending busy reply: %s", str(e))
+
+@traced_handler("slack_message")
+async def process_message_event(event, say, client, bot_user_id=None):
+    """Handle all messages, including mentions and thread replies."""
+    thread_ts = event.get("thread_ts", event.get("ts"))
+    try:
+        channel_id = event.get("channel")
+        conversation_history_id = channel_id + "::" + thread_ts
+        text = event.get("text", "")
+
+        # Get app's user ID, from the authorization Bolt already did if available
+        app_id = bot_user_id or await get_bot_user_id(client)
+
+        # Check if message in the channel is directed to the app
+        if not event.get("thread_ts") and f"<@{app_id}>" not in text:
+            logger.info("Message not directed to bot, ignoring")
+            return
+
+        # Check if this is a thread message
+        if event.get("thread_ts") and not await conversation_managers.acontains(conversation_history_id):
+            # Threads from before a restart, or handled elsewhere, are fetched from Slack
+            if not BACKFILL_ENABLED or not await thread_backfill.aresume(
+                    client, channel_id, thread_ts, event["ts"], app_id, mentioned=f"<@{app_id}>" in text):
+                logger.info("Thread unknown or unrelated")
+                return
+
+        async with conversation_locks.hold(conversation_history_id):
+            manager = await aget_or_create_manager(conversation_history_id)
+            if manager.approval_message_ts:
+                await client.chat_update(
+                    channel=channel_id,
+                    ts=manager.approval_message_ts,
+                    text="Function Cancelled",
+                    blocks=status_blocks("❌ *Function Cancelled*")
+                )
+
+            logger.info("Processing message in conversation: %s", conversation_history_id)
+            await bot_man(text, conversation_history_id, say, thread_ts, client=client, manager=manager)
+            logger.info("Message processed by bot_man")
+
+    except Exception as e:
+        logger.error(f"Error handling message: {str(e)}")
+        await say(text="Sorry, I encountered an error processing your message.", thread_ts=thread_ts)
+
+async def _resolve_approval(body, say, client, approved: bool) -> None:
+    conversation_history_id = body["actions"][0]["value"]
+    thread_ts = body["message"]["thread_ts"]
+    try:
+        if not approved and job_engine.cancel(conversation_history_id):
+            # The jobs' completion listener updates their message and resumes the turn
+            logger.info("Cancelled background jobs for conversation: %s", conversation_history_id)
+            return
+
+        async with conversation_locks.hold(conversation_history_id):
+            manager = await aget_manager(conversation_history_id)
+            if not manager.pendig_approval:
+                # Already resolved by an earlier click or a new message in the thread
+                return
+            # Update the original message to show the decision
+            status = "✅ *Function Approved and Executed*" if approved else "❌ *Function Cancelled*"
+            await client.chat_update(
+                channel=body["channel"]["id"],
+                ts=body["message"]["ts"],
+                text="Function Approved and Executed" if approved else "Function Cancelled",
+                blocks=status_blocks(status)
+            )
+            manager.approval_message_ts = ""
+            await bot_man("", conversation_history_id, say, thread_ts, approved_functions=approved, call_from_button=True, client=client, manager=manager)
+
+    except Exception as e:
+        action = "approval" if approved else "cancellation"
+        logger.error("Error handling %s: %s", action, str(e))
+        await say(text=f"Sorry, I encountered an error processing the {action}.", thread_ts=thread_ts)
+
+@traced_handler("slack_approval")
+async def process_approval(body, say, client) -> None:
+    """Run an approved tool call and resume the turn."""
+    await _resolve_approval(body, say, client, approved=True)
+
+@traced_handler("slack_cancellation")
+async def process_cancellation(body, say, client) -> None:
+    """Cancel the pending tool call or background jobs and resume the turn."""
+    await _resolve_approval(body, say, client, approved=False)
+
+@app.action("approve_function")
+async def handle_approval(ack, body, say, client):
+    """Acknowledge an approval click and queue the resumed turn ahead of new messages."""
+    await ack()
+    logger.info("Function approval received for conversation: %s", body["actions"][0]["value"])
+    return intake_queue.submit(process_approval, body=body, say=say, client=client)
+
+@app.action("cancel_function")
+async def handle_cancellation(ack, body, say, client):
+    """Acknowledge a cancellation click and queue it ahead of new messages."""
+    await ack()
+    logger.info("Function cancellation received for conversation: %s", body["actions"][0]["value"])
+    return intake_queue.submit(process_cancellation, body=body, say=say, client=client)
+
+async def main():
+    """Main entry point for the asyncio Slack bot."""
+    start_metrics_server()
+    # Compaction runs on its own thread, so a VACUUM never blocks the event loop
+    start_compaction(conversation_managers.store)
+    handler = AsyncSocketModeHandler(
+        app=app,
+        app_token=os.environ.get("SLACK_APP_TOKEN")
+    )
+    logger.info("⚡️ Bolt app is running in async mode!")
+    await handler.start_async()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+from typing import Dict, List, Any
+
+
+def approval_blocks(response: str, tool_info: Dict[str, Any], conversation_history_id: str) -> List[Dict]:
+    """Build the approval request message with Approve/Cancel buttons."""
+    blocks = [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Approval Required*\n{response}"
+            }
+        }
+    ]
+
+    # Add tool call information
+    for tool_call in tool_info["pending_tool_calls"]:
+        blocks.append({
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Function:* {tool_call['name']}\n*Arguments:* ```{tool_call['arguments']}```"
+            }
+        })
+
+    # Add approval buttons
+    blocks.append({
+        "type": "actions",
+        "elements": [
+            {
+                "type": "button",
+                "text": {
+                    "type": "plain_text",
+                    "text": "Approve"
+                },
+                "style": "primary",
+                "value": conversation_history_id,
+                "action_id": "approve_function"
+            },
+            {
+                "type": "button",
+                "text": {
+                    "type": "plain_text",
+                    "text": "Cancel"
+                },
+                "style": "danger",
+                "value": conversation_history_id,
+                "action_id": "cancel_function"
+            }
+        ]
+    })
+    return blocks
+
+
+def status_blocks(text: str) -> List[Dict]:
+    """Build the single-section blocks used to replace a resolved approval message."""
+    return [{
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": text
+        }
+    }]
+
+
+JOB_STATUS_ICONS = {"queued": "🕒", "running": "⏳", "succeeded": "✅", "failed": "⚠️", "cancelled": "❌"}
+
+
+def job_blocks(jobs: List[Any], conversation_history_id: str) -> List[Dict]:
+    """Build the background job status message, with a Cancel button while any job is unfinished."""
+    lines = []
+    for job in jobs:
+        line = f"{JOB_STATUS_ICONS[job.status]} *{job.tool_name}* {job.status}"
+        if job.progress_text and not job.done:
+            line += f": {job.progress_text}"
+        lines.append(line)
+    blocks = [{
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": "*Background Jobs*\n" + "\n".join(lines)
+        }
+    }]
+    if not all(job.done for job in jobs):
+        blocks.append({
+            "type": "actions",
+            "elements": [
+                {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "Cancel"
+                    },
+                    "style": "danger",
+                    "value": conversation_history_id,
+                    "action_id": "cancel_function"
+                }
+            ]
+        })
+    return blocks
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from scheduler import is_rate_limit, retry_after
+from telemetry import metrics
+
+logger = logging.getLogger(__name__)
+
+STREAMING_ENABLED = os.getenv('SLACK_STREAMING', 'true').lower() == 'true'
+# Each streamed reply edits its message at most this often
+STREAM_UPDATE_INTERVAL = float(os.getenv('SLACK_STREAM_INTERVAL', '1.0'))
+PLACEHOLDER_TEXT = "_Thinking..._"
+# Attempts at the final edit when Slack rate limits it
+FINISH_ATTEMPTS = 3
+
+
+class UpdateBudget:
+    """Process-wide budget for interim chat.update calls.
+
+    chat.update is a Tier 3 method, limited per workspace rather than per
+    channel, so many replies streaming at once share one allowance: a token
+    bucket refilled at per_minute. Interim edits that find it empty are
+    skipped; final edits always go through but still spend from it. After a
+    rate limit, interim edits stop until Slack's Retry-After has passed.
+    """
+
+    def __init__(self, per_minute: float = 50, burst: Optional[float] = None):
+        self.rate = per_minute / 60
+        self.burst = burst if burst is not None else max(1.0, per_minute / 6)
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def try_acquire(self) -> bool:
+        """Spend a token for an interim edit, or return False to skip it."""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._paused_until:
+                return False
+            self._refill(now)
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def spend(self) -> None:
+        """Account for an edit that is made regardless, such as a final reply."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+update_budget = UpdateBudget(per_minute=float(os.getenv('SLACK_STREAM_UPDATES_PER_MINUTE', '50')))
+
+
+class StreamingReply:
+    """Posts a placeholder reply in a thread and edits it as streamed text arrives.
+
+    Interim edits are best-effort: one that is over the update budget or
+    fails is skipped, and the next one carries the text so far. Only the
+    final edit is retried. Background job status messages are edited
+    through it too, with refresh.
+    """
+
+    def __init__(self, client, say, thread_ts: str, interval: float = STREAM_UPDATE_INTERVAL,
+                 budget: UpdateBudget = update_budget):
+        self.client = client
+        self.say = say
+        self.thread_ts = thread_ts
+        self.interval = interval
+        self.budget = budget
+        self.channel = None
+        self.ts = None
+        self.text = ""
+        self._last_update = 0.0
+
+    def start(self, text: str = PLACEHOLDER_TEXT, blocks: Optional[List[Dict]] = None) -> None:
+        kwargs = {"blocks": blocks} if blocks is not None else {}
+        result = self.say(text=text, thread_ts=self.thread_ts, **kwargs)
+        self.channel = result["channel"]
+        self.ts = result["ts"]
+        self._last_update = time.monotonic()
+
+    def _due(self) -> bool:
+        if time.monotonic() - self._last_update < self.interval:
+            return False
+        # Whether or not the edit is made, wait a full interval before the next attempt
+        self._last_update = time.monotonic()
+        if not self.budget.try_acquire():
+            metrics.inc("slack_stream_updates_total", (("result", "skipped"),))
+            return False
+        return True
+
+    def _failed(self, error: Exception) -> Optional[float]:
+        """Log a failed edit; returns how long to wait before retrying if it was rate limited."""
+        if not is_rate_limit(error):
+            logger.warning("Streamed reply update failed: %s", str(error))
+            return None
+        delay = retry_after(error) or self.interval
+        self.budget.pause(delay)
+        metrics.inc("slack_rate_limited_total", (("method", "chat.update"),))
+        logger.warning("chat.update rate limited, pausing streamed updates for %.1fs", delay)
+        return delay
+
+    def on_token(self, text: str) -> None:
+        self.text += text
+        self.refresh(self.text)
+
+    def refresh(self, text: str, blocks: Optional[List[Dict]] = None) -> None:
+        """Make an interim edit if one is due and the update budget allows it."""
+        if self._due():
+            try:
+                self._update(text, blocks)
+                metrics.inc("slack_stream_updates_total", (("result", "sent"),))
+            except Exception as e:
+                self._failed(e)
+                metrics.inc("slack_stream_updates_total", (("result", "failed"),))
+
+    def finish(self, text: str, blocks: Optional[List[Dict]] = None) -> None:
+        """Replace the placeholder with the final text, or blocks such as an approval request."""
+        self.budget.spend()
+        for attempt in range(FINISH_ATTEMPTS):
+            try:
+                return self._update(text, blocks)
+            except Exception as e:
+                delay = self._failed(e)
+                if delay is None or attempt == FINISH_ATTEMPTS - 1:
+                    raise
+                time.sleep(delay)
+
+    def _update(self, text: str, blocks: Optional[List[Dict]] = None) -> None:
+        kwargs = {"blocks": blocks} if blocks is not None else {}
+        self.client.chat_update(channel=self.channel, ts=self.ts, text=text, **kwargs)
+        self._last_update = time.monotonic()
+
+
+class AsyncStreamingReply(StreamingReply):
+    """StreamingReply for the AsyncApp front end."""
+
+    async def start(self, text: str = PLACEHOLDER_TEXT, blocks: Optional[List[Dict]] = None) -> None:
+        kwargs = {"blocks": blocks} if blocks is not None else {}
+        result = await self.say(text=text, thread_ts=self.thread_ts, **kwargs)
+        self.channel = result["channel"]
+        self.ts = result["ts"]
+        self._last_update = time.monotonic()
+
+    async def on_token(self, text: str) -> None:
+        self.text += text
+        await self.refresh(self.text)
+
+    async def refresh(self, text: str, blocks: Optional[List[Dict]] = None) -> None:
+        if self._due():
+            try:
+                await self._update(text, blocks)
+                metrics.inc("slack_stream_updates_total", (("result", "sent"),))
+            except Exception as e:
+                self._failed(e)
+                metrics.inc("slack_stream_updates_total", (("result", "failed"),))
+
+    async def finish(self, text: str, blocks: Optional[List[Dict]] = None) -> None:
+        self.budget.spend()
+        for attempt in range(FINISH_ATTEMPTS):
+            try:
+                return await self._update(text, blocks)
+            except Exception as e:
+                delay = self._failed(e)
+                if delay is None or attempt == FINISH_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(delay)
+
+    async def _update(self, text: str, blocks: Optional[List[Dict]] = None) -> None:
+        kwargs = {"blocks": blocks} if blocks is not None else {}
+        await self.client.chat_update(channel=self.channel, ts=self.ts, text=text, **kwargs)
+        self._last_update = time.monotonic()
@@ -0,0 +1,327 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from typing import Any, Dict, List, NamedTuple, Optional
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+from history import Message
+
+logger = logging.getLogger(__name__)
+
+# How often the Slack front ends compact the store, and how long a conversation may sit idle before it is dropped
+COMPACT_INTERVAL = float(os.getenv('CONVERSATION_COMPACT_INTERVAL', str(24 * 60 * 60)))
+MAX_IDLE_SECONDS = float(os.getenv('CONVERSATION_MAX_IDLE_SECONDS', str(30 * 24 * 60 * 60)))
+
+
+class StoredConversation(NamedTuple):
+    messages: List[Any]
+    pendig_approval: Optional[List[Dict]]
+    approval_message_ts: str
+
+
+def encode_message(msg: Any) -> str:
+    """Serialize a history message (record, tuple, dict or LangChain message) to JSON."""
+    if isinstance(msg, Message):
+        data = {"kind": "dict", "data": msg.to_dict()}
+    elif isinstance(msg, tuple):
+        data = {"kind": "tuple", "data": list(msg)}
+    elif isinstance(msg, dict):
+        data = {"kind": "dict", "data": msg}
+    elif isinstance(msg, BaseMessage):
+        data = {"kind": "lc", "data": message_to_dict(msg)}
+    else:
+        raise TypeError(f"Cannot store message of type {type(msg).__name__}")
+    return json.dumps(data, default=str)
+
+
+def decode_message(payload: str) -> Any:
+    data = json.loads(payload)
+    if data["kind"] == "tuple":
+        return tuple(data["data"])
+    if data["kind"] == "dict":
+        return data["data"]
+    return messages_from_dict([data["data"]])[0]
+
+
+class ConversationStore(ABC):
+    """Persistence interface for conversation state.
+
+    Writes may be applied asynchronously; load() must observe every write made
+    before it was called.
+    """
+
+    @abstractmethod
+    def append(self, conversation_id: str, msg: Any) -> None:
+        ...
+
+    @abstractmethod
+    def rewrite(self, conversation_id: str, messages: List[Any]) -> None:
+        """Replace a conversation's stored messages, e.g. after history compaction."""
+
+    @abstractmethod
+    def save_state(self, conversation_id: str, pendig_approval: Optional[List[Dict]], approval_message_ts: str) -> None:
+        ...
+
+    @abstractmethod
+    def exists(self, conversation_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    def load(self, conversation_id: str) -> Optional[StoredConversation]:
+        ...
+
+    @abstractmethod
+    def compact(self, max_idle_seconds: Optional[float] = None) -> None:
+        """Drop conversations idle longer than max_idle_seconds and reclaim disk space."""
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    conversation_id TEXT PRIMARY KEY,
+    pending_approval TEXT,
+    approval_message_ts TEXT NOT NULL DEFAULT '',
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    conversation_id TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation_id, id);
+"""
+
+_TOUCH = ("INSERT INTO conversations (conversation_id, updated_at) VALUES (?, ?) "
+          "ON CONFLICT (conversation_id) DO UPDATE SET updated_at = excluded.updated_at")
+
+
+class SQLiteStore(ConversationStore):
+    """ConversationStore on SQLite in WAL mode.
+
+    Messages are kept as an append-only log. Writes are queued and applied by a
+    single writer thread, which commits everything queued so far in one
+    transaction, so callers never wait on disk I/O.
+    """
+
+    def __init__(self, path: str, batch_size: int = 512):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue: "queue.Queue" = queue.Queue()
+        # Conversations with writes that are queued but not yet committed
+        self._unflushed: Dict[str, int] = {}
+        self._unflushed_lock = threading.Lock()
+        # Notified when a batch commits, for load() waiting on one conversation's writes
+        self._committed = threading.Condition(self._unflushed_lock)
+        self._reader = self._connect()
+        self._reader_lock = threading.Lock()
+        self._reader.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-store", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode NORMAL only fsyncs at checkpoints, which is safe against corruption
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _enqueue(self, conversation_id: Optional[str], op: tuple) -> None:
+        if conversation_id is not None:
+            with self._unflushed_lock:
+                self._unflushed[conversation_id] = self._unflushed.get(conversation_id, 0) + 1
+        self._queue.put((conversation_id, op))
+
+    def append(self, conversation_id: str, msg: Any) -> None:
+        self._enqueue(conversation_id, ("append", encode_message(msg), time.time()))
+
+    def rewrite(self, conversation_id: str, messages: List[Any]) -> None:
+        self._enqueue(conversation_id, ("rewrite", [encode_message(m) for m in messages], time.time()))
+
+    def save_state(self, conversation_id: str, pendig_approval: Optional[List[Dict]], approval_message_ts: str) -> None:
+        pending = json.dumps(pendig_approval, default=str) if pendig_approval else None
+        self._enqueue(conversation_id, ("state", pending, approval_message_ts, time.time()))
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            compactions = [op[2] for _, op in batch if op[0] == "compact"]
+            try:
+                with conn:
+                    for conversation_id, op in batch:
+                        if op[0] == "stop":
+                            stop = True
+                        else:
+                            self._apply(conn, conversation_id, op)
+            except sqlite3.Error as e:
+                logger.error("Conversation store write of %d operations failed: %s", len(batch), str(e), exc_info=True)
+                for future in compactions:
+                    future.set_exception(e)
+                compactions = []
+            for future in compactions:
+                self._reclaim(conn, future)
+            with self._committed:
+                for conversation_id, _ in batch:
+                    if conversation_id is None:
+                        continue
+                    self._unflushed[conversation_id] -= 1
+                    if not self._unflushed[conversation_id]:
+                        del self._unflushed[conversation_id]
+                self._committed.notify_all()
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                conn.close()
+                return
+
+    def _apply(self, conn: sqlite3.Connection, conversation_id: str, op: tuple) -> None:
+        kind = op[0]
+        if kind == "append":
+            _, payload, now = op
+            conn.execute(_TOUCH, (conversation_id, now))
+            conn.execute("INSERT INTO messages (conversation_id, payload) VALUES (?, ?)", (conversation_id, payload))
+        elif kind == "rewrite":
+            _, payloads, now = op
+            conn.execute(_TOUCH, (conversation_id, now))
+            conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            conn.executemany("INSERT INTO messages (conversation_id, payload) VALUES (?, ?)",
+                             [(conversation_id, payload) for payload in payloads])
+        elif kind == "state":
+            _, pending, approval_message_ts, now = op
+            conn.execute(
+                "INSERT INTO conversations (conversation_id, pending_approval, approval_message_ts, updated_at) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (conversation_id) DO UPDATE SET "
+                "pending_approval = excluded.pending_approval, "
+                "approval_message_ts = excluded.approval_message_ts, updated_at = excluded.updated_at",
+                (conversation_id, pending, approval_message_ts, now)
+            )
+        elif kind == "compact":
+            _, cutoff, _ = op
+            if cutoff is not None:
+                conn.execute("DELETE FROM messages WHERE conversation_id IN "
+                             "(SELECT conversation_id FROM conversations WHERE updated_at < ?)", (cutoff,))
+                conn.execute("DELETE FROM conversations WHERE updated_at < ?", (cutoff,))
+
+    @staticmethod
+    def _reclaim(conn: sqlite3.Connection, future: Future) -> None:
+        # VACUUM can't run inside a transaction, so it follows the commit; it rewrites the
+        # database through the WAL, which the checkpoint then truncates
+        try:
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            future.set_exception(e)
+            return
+        future.set_result(None)
+
+    def flush(self) -> None:
+        """Block until every queued write is committed."""
+        self._queue.join()
+
+    def exists(self, conversation_id: str) -> bool:
+        with self._unflushed_lock:
+            if conversation_id in self._unflushed:
+                return True
+        with self._reader_lock:
+            row = self._reader.execute("SELECT 1 FROM conversations WHERE conversation_id = ?",
+                                       (conversation_id,)).fetchone()
+        return row is not None
+
+    def load(self, conversation_id: str) -> Optional[StoredConversation]:
+        # Only this conversation's writes need to be committed, not everything queued
+        with self._committed:
+            while conversation_id in self._unflushed:
+                self._committed.wait()
+        with self._reader_lock:
+            state = self._reader.execute(
+                "SELECT pending_approval, approval_message_ts FROM conversations WHERE conversation_id = ?",
+                (conversation_id,)
+            ).fetchone()
+            if state is None:
+                return None
+            rows = self._reader.execute(
+                "SELECT payload FROM messages WHERE conversation_id = ? ORDER BY id",
+                (conversation_id,)
+            ).fetchall()
+        pending, approval_message_ts = state
+        return StoredConversation(
+            messages=[decode_message(payload) for (payload,) in rows],
+            pendig_approval=json.loads(pending) if pending else None,
+            approval_message_ts=approval_message_ts
+        )
+
+    def compact(self, max_idle_seconds: Optional[float] = None) -> None:
+        cutoff = time.time() - max_idle_seconds if max_idle_seconds else None
+        # Runs on the writer thread, so it is ordered with the queued writes and never
+        # competes with them for the database lock
+        done: Future = Future()
+        self._enqueue(None, ("compact", cutoff, done))
+        done.result()
+
+    def close(self) -> None:
+        if self._writer.is_alive():
+            self._enqueue(None, ("stop",))
+            self._writer.join()
+        with self._reader_lock:
+            self._reader.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> Optional[ConversationStore]:
+    """Get the process-wide conversation store configured by CONVERSATION_DB, if any."""
+    global _store
+    path = os.getenv('CONVERSATION_DB')
+    if not path:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = SQLiteStore(path)
+            atexit.register(_store.close)
+        return _store
+
+
+def start_compaction(store: Optional[ConversationStore], interval: float = COMPACT_INTERVAL,
+                     max_idle_seconds: float = MAX_IDLE_SECONDS) -> Optional[threading.Thread]:
+    """Compact store every interval seconds on a daemon thread (0 disables).
+
+    Conversations idle longer than max_idle_seconds are dropped; 0 keeps
+    them and only reclaims disk space.
+    """
+    if store is None or interval <= 0:
+        return None
+
+    def run() -> None:
+        while True:
+            time.sleep(interval)
+            start = time.perf_counter()
+            try:
+                store.compact(max_idle_seconds or None)
+            except Exception as e:
+                logger.error("Conversation store compaction failed: %s", str(e), exc_info=True)
+                continue
+            logger.info("Compacted conversation store in %.1fs", time.perf_counter() - start)
+
+    thread = threading.Thread(target=run, name="conversation-store-compaction", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,281 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+# Per-turn JSON records go to their own logger so they can be routed separately
+turn_logger = logging.getLogger("telemetry.turns")
+
+JSON_LOGS_ENABLED = os.getenv('TELEMETRY_JSON_LOGS', 'true').lower() == 'true'
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout."""
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Process-wide span histograms, counters and gauges."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.gauges: Dict[str, Any] = {}
+
+    def observe(self, name: str, labels: Labels, seconds: float) -> None:
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name: str, fn) -> None:
+        """Register a callable sampled at scrape time; it returns a number or a {labels: number} dict."""
+        self.gauges[name] = fn
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        lines.append("# TYPE office_manager_span_seconds histogram")
+        for (name, labels), h in histograms:
+            base = _labels((("span", name),) + labels)
+            cumulative = 0
+            for bound, count in zip(h.buckets + (float("inf"),), h.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"office_manager_span_seconds_bucket{_labels((('span', name),) + labels + (('le', le),))} {cumulative}")
+            lines.append(f"office_manager_span_seconds_sum{base} {h.sum}")
+            lines.append(f"office_manager_span_seconds_count{base} {h.count}")
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE office_manager_{name} counter")
+                seen.add(name)
+            lines.append(f"office_manager_{name}{_labels(labels)} {value}")
+        for name, fn in sorted(self.gauges.items()):
+            try:
+                value = fn()
+            except Exception as e:
+                logger.error("Gauge %s failed: %s", name, str(e))
+                continue
+            lines.append(f"# TYPE office_manager_{name} gauge")
+            if isinstance(value, dict):
+                for labels, v in sorted(value.items()):
+                    lines.append(f"office_manager_{name}{_labels(labels)} {v}")
+            else:
+                lines.append(f"office_manager_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    parts = ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels)
+    return "{" + parts + "}"
+
+
+metrics = Metrics()
+
+
+class Trace:
+    """Timings and token usage collected over one turn."""
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.spans: List[Tuple[str, Labels, float]] = []
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def to_record(self, seconds: float) -> Dict[str, Any]:
+        record = {"event": self.name, **self.attributes, "duration_ms": round(seconds * 1000, 3)}
+        for name, labels, span_seconds in self.spans:
+            key = name if not labels else f"{name}.{'.'.join(v for _, v in labels)}"
+            record.setdefault(f"{key}_ms", []).append(round(span_seconds * 1000, 3))
+        record["input_tokens"] = self.input_tokens
+        record["output_tokens"] = self.output_tokens
+        return record
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """Time a whole turn. Nested inside another trace it is recorded as a plain span."""
+    outer = _current_trace.get()
+    if outer is not None:
+        for key, value in attributes.items():
+            outer.attributes.setdefault(key, value)
+        with span(name):
+            yield
+        return
+    current = Trace(name, attributes)
+    token = _current_trace.set(current)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _current_trace.reset(token)
+        metrics.observe(name, (), seconds)
+        if JSON_LOGS_ENABLED:
+            turn_logger.info(json.dumps(current.to_record(seconds), default=str))
+
+
+def record_span(name: str, seconds: float, **labels) -> None:
+    label_items = tuple(sorted(labels.items()))
+    metrics.observe(name, label_items, seconds)
+    current = _current_trace.get()
+    if current is not None:
+        current.spans.append((name, label_items, seconds))
+
+
+@contextmanager
+def span(name: str, **labels):
+    """Time a block as one span of the current turn."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start, **labels)
+
+
+def record_usage(ai_msg: Any) -> None:
+    """Add the token usage reported on a model reply to the counters and current turn."""
+    usage = getattr(ai_msg, "usage_metadata", None)
+    if not usage:
+        return
+    input_tokens = usage.get("input_tokens", 0)
+    output_tokens = usage.get("output_tokens", 0)
+    metrics.inc("tokens_total", (("kind", "input"),), input_tokens)
+    metrics.inc("tokens_total", (("kind", "output"),), output_tokens)
+    current = _current_trace.get()
+    if current is not None:
+        current.input_tokens += input_tokens
+        current.output_tokens += output_tokens
+
+
+class TracedSlackClient:
+    """Proxy for a Slack WebClient (sync or async) that records a span per API call."""
+
+    def __init__(self, client: Any):
+        self._client = client
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+        return traced_call("slack", attr, method=name)
+
+
+def traced_call(span_name: str, fn, **labels):
+    """Wrap fn so each call records a span; works for functions returning awaitables."""
+    def call(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            record_span(span_name, time.perf_counter() - start, **labels)
+            raise
+        if inspect.isawaitable(result):
+            async def finish():
+                try:
+                    return await result
+                finally:
+                    record_span(span_name, time.perf_counter() - start, **labels)
+            return finish()
+        record_span(span_name, time.perf_counter() - start, **labels)
+        return result
+    return call
+
+
+def traced_handler(name: str):
+    """Decorate a Bolt listener so it runs as one trace with its say and client calls timed.
+
+    Bolt unwraps listeners to choose which arguments to inject, so the
+    decorated function keeps its original signature.
+    """
+    def instrument(kwargs: Dict[str, Any]) -> None:
+        if kwargs.get("say") is not None:
+            kwargs["say"] = traced_call("slack", kwargs["say"], method="say")
+        if kwargs.get("client") is not None:
+            kwargs["client"] = TracedSlackClient(kwargs["client"])
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(**kwargs):
+                instrument(kwargs)
+                with trace(name):
+                    return await fn(**kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(**kwargs):
+            instrument(kwargs)
+            with trace(name):
+                return fn(**kwargs)
+        return wrapper
+    return decorator
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port_offset: int = 0) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics on METRICS_PORT + port_offset (bound to METRICS_HOST) if METRICS_PORT is set."""
+    port = os.getenv('METRICS_PORT')
+    if not port:
+        return None
+    port = int(port) + port_offset
+    server = ThreadingHTTPServer((os.getenv('METRICS_HOST', '127.0.0.1'), port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Serving Prometheus metrics on port %s", port)
+    return server
@@ -0,0 +1 @@
+"""Tool implementations, imported on first use through the manifest in tools.json."""
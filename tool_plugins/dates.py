@@ -0,0 +1,13 @@
+from datetime import datetime
+from langchain_core.tools import tool, InjectedToolArg
+from typing_extensions import Annotated
+
+from tools import cached, enabled_tool, timeout
+
+@enabled_tool
+@tool
+@timeout(5)
+@cached(ttl=60)
+def get_date(opts: Annotated[dict, InjectedToolArg]) -> str:
+    """Returns the current date as a string in the format YYYY-MM-DD."""
+    return datetime.now().strftime("%Y-%m-%d")
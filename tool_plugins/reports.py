@@ -0,0 +1,21 @@
+import time
+from langchain_core.tools import tool, InjectedToolArg
+from typing_extensions import Annotated
+
+from tools import background_job, enabled_tool, requires_approval
+
+@enabled_tool
+@tool
+@requires_approval
+@background_job(max_concurrency=2)
+def generate_report(topic: str, opts: Annotated[dict, InjectedToolArg]) -> str:
+    """Generates a report on the given topic. This takes a while; the user is told in the thread when it is done."""
+    job = opts.get("job")
+    steps = 5
+    for step in range(1, steps + 1):
+        if job and job.cancelled:
+            return "Report generation was cancelled."
+        time.sleep(2)
+        if job:
+            job.progress(f"{step * 100 // steps}% done")
+    return f"Report on {topic}: all systems nominal."
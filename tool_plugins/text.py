@@ -0,0 +1,22 @@
+from langchain_core.tools import tool, InjectedToolArg
+from typing_extensions import Annotated
+
+from tools import cached, enabled_tool, requires_approval, timeout
+
+@enabled_tool
+@tool
+@requires_approval
+@timeout(5)
+def random_string(random_number: int, opts: Annotated[dict, InjectedToolArg]) -> str:
+    """Whenever user is asking for a random string you call this function and pass a random number as the seed"""
+    print("called: " + "random_string")
+    return "RaNdOm124" * opts["age"]
+
+@enabled_tool
+@tool
+@timeout(5)
+@cached(maxsize=1024)
+def to_upper(input_text: str, opts: Annotated[dict, InjectedToolArg]) -> str:
+    """This function will convert the input_text to all upper case"""
+    print("called: " + "to_upper")
+    return input_text.upper()
@@ -0,0 +1,92 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Deque, Dict
+import threading
+import time
+
+
+class ToolCall:
+    """One tool call handed to a ToolPool; started is set once a thread begins running it."""
+
+    __slots__ = ("tool_name", "fn", "args", "future", "started", "started_at")
+
+    def __init__(self, tool_name: str, fn: Callable, args: tuple):
+        self.tool_name = tool_name
+        self.fn = fn
+        self.args = args
+        self.future: Future = Future()
+        self.started = threading.Event()
+        self.started_at = 0.0
+
+
+class ToolPool:
+    """Runs the tool calls of a turn on a thread pool shared by every conversation.
+
+    Each tool may hold at most per_tool of the threads at once (0 for no
+    limit). That includes calls that timed out but whose thread is still
+    running, so a hanging tool can't take the whole pool. The tool's other
+    calls wait in its FIFO queue without holding a thread. A call's timeout
+    starts when it starts running.
+    """
+
+    def __init__(self, workers: int = 8, per_tool: int = 4):
+        self.workers = workers
+        self.per_tool = per_tool
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tool")
+        self._lock = threading.Lock()
+        self._queued: Dict[str, Deque[ToolCall]] = {}
+        self._running: Dict[str, int] = {}
+
+    def submit(self, tool_name: str, fn: Callable, *args) -> ToolCall:
+        """Queue fn(*args) as a call to tool_name."""
+        call = ToolCall(tool_name, fn, args)
+        with self._lock:
+            self._queued.setdefault(tool_name, deque()).append(call)
+            self._dispatch()
+        return call
+
+    def _dispatch(self) -> None:
+        for tool_name, queued in self._queued.items():
+            while queued and (self.per_tool <= 0 or self._running.get(tool_name, 0) < self.per_tool):
+                call = queued.popleft()
+                if call.future.cancelled():
+                    continue
+                self._running[tool_name] = self._running.get(tool_name, 0) + 1
+                self._executor.submit(self._run, call)
+
+    def _run(self, call: ToolCall) -> None:
+        try:
+            if not call.future.set_running_or_notify_cancel():
+                return
+            call.started_at = time.monotonic()
+            call.started.set()
+            try:
+                call.future.set_result(call.fn(*call.args))
+            except Exception as e:
+                call.future.set_exception(e)
+        finally:
+            with self._lock:
+                self._running[call.tool_name] -= 1
+                self._dispatch()
+
+    def result(self, call: ToolCall, timeout: float) -> Any:
+        """Wait for call's result, giving it timeout seconds once it starts.
+
+        Raises concurrent.futures.TimeoutError if it runs longer, or if it
+        waits timeout seconds without starting; check call.started to tell
+        which. A call that never started is cancelled. A running one can't be
+        interrupted, and its thread stays counted against its tool until the
+        call returns.
+        """
+        if not call.started.wait(timeout):
+            if call.future.cancel():
+                raise FutureTimeoutError()
+            # It started just now
+            call.started.wait()
+        return call.future.result(timeout=max(0.0, call.started_at + timeout - time.monotonic()))
+
+    def qsize(self) -> int:
+        """Calls waiting for a thread, in the tools' queues or the pool's."""
+        with self._lock:
+            queued = sum(1 for q in self._queued.values() for call in q if not call.future.cancelled())
+        return queued + self._executor._work_queue.qsize()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""Tool manifest and lazily imported tools.
+
+Tools are listed in tools.json with their schema and declared metadata, so
+they can be bound to the model and gated for approval without importing
+their modules. Regenerate the manifest after adding or changing a tool:
+
+    python tool_registry.py                      # modules already listed
+    python tool_registry.py tool_plugins.new     # plus a new module
+    python tool_registry.py --check              # exit 1 if tools.json is stale
+"""
+from typing import Any, Dict, Iterable, List, Optional
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from telemetry import record_span
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools.json')
+TOOL_MANIFESTS = [p for p in (os.getenv('TOOL_MANIFEST') or MANIFEST_PATH).split(os.pathsep) if p]
+TOOL_PRELOAD = os.getenv('TOOL_PRELOAD', 'false').lower() == 'true'
+
+
+class ToolSpec:
+    """A tool's manifest entry: where it lives, its schema and what its decorators declare."""
+
+    def __init__(self, name: str, module: str, description: str, parameters: Dict[str, Any],
+                 requires_approval: bool = False, timeout: Optional[float] = None,
+                 background_job: Optional[int] = None):
+        self.name = name
+        self.module = module
+        self.description = description
+        self.parameters = parameters
+        self.requires_approval = requires_approval
+        self.timeout = timeout
+        self.background_job = background_job
+        # The same shape convert_to_openai_tool gives the implementation
+        self.schema = {
+            "type": "function",
+            "function": {"name": name, "description": description, "parameters": parameters},
+        }
+
+    @classmethod
+    def from_dict(cls, entry: Dict[str, Any]) -> "ToolSpec":
+        return cls(entry["name"], entry["module"], entry.get("description", ""), entry["parameters"],
+                   entry.get("requires_approval", False), entry.get("timeout"), entry.get("background_job"))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "module": self.module,
+            "description": self.description,
+            "parameters": self.parameters,
+            "requires_approval": self.requires_approval,
+            "timeout": self.timeout,
+            "background_job": self.background_job,
+        }
+
+
+class LazyTool:
+    """A tool bound from its manifest schema whose module is imported on its first call.
+
+    invoke and ainvoke take the same tool calls as a LangChain tool and hand
+    them to the implementation once it is loaded.
+    """
+
+    def __init__(self, spec: ToolSpec):
+        self.spec = spec
+        self.name = spec.name
+        self.schema = spec.schema
+        self._tool: Any = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._tool is not None
+
+    def load(self) -> Any:
+        """Import the tool's module, once, and return the implementation."""
+        if self._tool is None:
+            with self._lock:
+                if self._tool is None:
+                    self._tool = self._import()
+        return self._tool
+
+    def _import(self) -> Any:
+        from tools import TOOL_IMPLEMENTATIONS
+        start = time.perf_counter()
+        importlib.import_module(self.spec.module)
+        tool = TOOL_IMPLEMENTATIONS.get(self.name)
+        if tool is None:
+            raise LookupError(f"{self.spec.module} defines no tool named {self.name}; regenerate the tool manifest")
+        seconds = time.perf_counter() - start
+        record_span("tool_load", seconds, tool=self.name.lower())
+        logger.info("Loaded tool %s from %s in %.1f ms", self.name, self.spec.module, seconds * 1000)
+        self._check(tool)
+        return tool
+
+    def _check(self, tool: Any) -> None:
+        """Compare the decorators with the manifest entry; refuse a call that skipped a required approval."""
+        from tools import BACKGROUND_JOBS, NEEDS_APPROVAL, TOOL_TIMEOUTS
+        if NEEDS_APPROVAL.get(self.name, False) and not self.spec.requires_approval:
+            # The call was let through without approval on the manifest's word. The
+            # decorator has now set NEEDS_APPROVAL, so later calls are gated and load.
+            self.spec.requires_approval = True
+            logger.error("Tool %s requires approval but its manifest entry doesn't; run tool_registry.py", self.name)
+            raise PermissionError(f"{self.name} requires approval; ask the user to approve it and call it again")
+        declared = (NEEDS_APPROVAL.get(self.name, False), TOOL_TIMEOUTS.get(self.name),
+                    BACKGROUND_JOBS.get(self.name))
+        if declared != (self.spec.requires_approval, self.spec.timeout, self.spec.background_job):
+            logger.warning("Manifest entry for tool %s doesn't match its decorators; run tool_registry.py", self.name)
+
+    def invoke(self, input: Any, config: Optional[Dict[str, Any]] = None, **kwargs) -> Any:
+        return self.load().invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input: Any, config: Optional[Dict[str, Any]] = None, **kwargs) -> Any:
+        # Importing may be slow; keep it off the event loop
+        tool = self._tool or await asyncio.to_thread(self.load)
+        return await tool.ainvoke(input, config, **kwargs)
+
+
+def read_manifest(path: str) -> List[ToolSpec]:
+    with open(path, 'r') as f:
+        return [ToolSpec.from_dict(entry) for entry in json.load(f)["tools"]]
+
+
+def load_tools(paths: Iterable[str] = TOOL_MANIFESTS) -> List[LazyTool]:
+    """LazyTools for every tool listed in the manifests, in order."""
+    tools: Dict[str, LazyTool] = {}
+    for path in paths:
+        if not os.path.exists(path):
+            logger.warning("Tool manifest %s not found; run tool_registry.py to create it", path)
+            continue
+        for spec in read_manifest(path):
+            if spec.name in tools:
+                raise ValueError(f"Tool {spec.name} is listed twice (in {path} and an earlier manifest)")
+            tools[spec.name] = LazyTool(spec)
+    return list(tools.values())
+
+
+def tool_schemas(tools: List[Any]) -> List[Dict[str, Any]]:
+    """OpenAI-format schemas for bind_tools; lazy tools use their manifest schema."""
+    schemas = []
+    for t in tools:
+        if isinstance(t, LazyTool):
+            schemas.append(t.schema)
+        else:
+            from langchain_core.utils.function_calling import convert_to_openai_tool
+            schemas.append(convert_to_openai_tool(t))
+    return schemas
+
+
+def describe(modules: Iterable[str]) -> List[ToolSpec]:
+    """Import modules and build manifest entries for the tools they define."""
+    from langchain_core.utils.function_calling import convert_to_openai_tool
+    from tools import BACKGROUND_JOBS, NEEDS_APPROVAL, TOOL_IMPLEMENTATIONS, TOOL_TIMEOUTS
+    # Start from what the decorators declare, not from the current manifest
+    for declared in (NEEDS_APPROVAL, TOOL_TIMEOUTS, BACKGROUND_JOBS):
+        declared.clear()
+    specs = []
+    for module in modules:
+        before = set(TOOL_IMPLEMENTATIONS)
+        importlib.import_module(module)
+        for name, tool in TOOL_IMPLEMENTATIONS.items():
+            if name in before:
+                continue
+            function = convert_to_openai_tool(tool)["function"]
+            specs.append(ToolSpec(name, module, function.get("description", ""), function["parameters"],
+                                  NEEDS_APPROVAL.get(name, False), TOOL_TIMEOUTS.get(name),
+                                  BACKGROUND_JOBS.get(name)))
+    return specs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('modules', nargs='*', help="tool modules to add to those already in the manifest")
+    parser.add_argument('--output', default=MANIFEST_PATH)
+    parser.add_argument('--check', action='store_true', help="compare instead of writing")
+    args = parser.parse_args()
+
+    current = read_manifest(args.output) if os.path.exists(args.output) else []
+    modules = list(dict.fromkeys([spec.module for spec in current] + args.modules))
+    manifest = {"tools": [spec.to_dict() for spec in describe(modules)]}
+    if args.check:
+        stale = manifest["tools"] != [spec.to_dict() for spec in current]
+        print(f"{args.output} is {'stale' if stale else 'up to date'}")
+        sys.exit(1 if stale else 0)
+    with open(args.output, 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+    print(f"Wrote {len(manifest['tools'])} tools from {len(modules)} modules to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
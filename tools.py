@@ -1,7 +1,8 @@
-from typing import Dict, Any
-from langchain_core.tools import tool, InjectedToolArg
-from typing_extensions import Annotated
-from datetime import datetime
+from typing import Dict, Any, Optional
+import json
+import os
+from cache import TTLCache
+from tool_registry import TOOL_PRELOAD, load_tools
 
 NEEDS_APPROVAL = {}
 
@@ -9,32 +10,90 @@ def requires_approval(func):
     NEEDS_APPROVAL[func.__name__] = True
     return func
 
-AVAILABLE_TOOLS = []
+DEFAULT_TOOL_TIMEOUT = float(os.getenv('TOOL_TIMEOUT_SECONDS', '30'))
+TOOL_TIMEOUTS = {}
+
+def timeout(seconds: float):
+    """Declare how long a tool may run before its call is answered with an error."""
+    def decorator(func):
+        TOOL_TIMEOUTS[func.__name__] = seconds
+        return func
+    return decorator
+
+BACKGROUND_JOBS: Dict[str, int] = {}
+
+def background_job(max_concurrency: int = 1):
+    """Run a tool as a background job instead of inside the turn.
+
+    The job engine runs at most max_concurrency calls of the tool at once
+    (0 for no limit). The tool finds its Job in opts["job"] to report
+    progress and to check whether it was cancelled.
+    """
+    def decorator(func):
+        BACKGROUND_JOBS[func.__name__] = max_concurrency
+        return func
+    return decorator
+
+class ToolCache:
+    """Result cache for one tool, keyed by its arguments."""
+
+    def __init__(self, ttl: Optional[float], maxsize: int, include_opts: bool):
+        self.include_opts = include_opts
+        self.results = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def key(self, args: Dict[str, Any]) -> str:
+        if not self.include_opts:
+            args = {k: v for k, v in args.items() if k != "opts"}
+        return json.dumps(args, sort_keys=True, default=str)
+
+    def get(self, args: Dict[str, Any]) -> Any:
+        return self.results.get(self.key(args))
+
+    def set(self, args: Dict[str, Any], result: Any) -> None:
+        self.results.set(self.key(args), result)
+
+TOOL_CACHES: Dict[str, ToolCache] = {}
+
+def cached(ttl: Optional[float] = None, maxsize: int = 256, include_opts: bool = False):
+    """Cache a tool's results by its arguments (and opts if include_opts) for ttl seconds.
+
+    Tools that require approval are never served from the cache.
+    """
+    def decorator(func):
+        TOOL_CACHES[func.__name__] = ToolCache(ttl, maxsize, include_opts)
+        return func
+    return decorator
+
+def tool_cache_stats() -> Dict[str, Dict[str, int]]:
+    """Hit, miss and eviction counters for every cached tool."""
+    return {name: cache.results.stats() for name, cache in TOOL_CACHES.items()}
+
+TOOL_IMPLEMENTATIONS: Dict[str, Any] = {}
 
 def enabled_tool(func):
-    AVAILABLE_TOOLS.append(func)
+    """Register a tool defined in a tool_plugins module; list the module in tools.json to enable it."""
+    TOOL_IMPLEMENTATIONS[func.name] = func
     return func
 
-@enabled_tool
-@tool
-@requires_approval
-def random_string(random_number: int, opts: Annotated[dict, InjectedToolArg]) -> str:
-    """Whenever user is asking for a random string you call this function and pass a random number as the seed"""
-    print("called: " + "random_string")
-    return "RaNdOm124" * opts["age"]
-
-@enabled_tool
-@tool
-def to_upper(input_text: str, opts: Annotated[dict, InjectedToolArg]) -> str:
-    """This function will convert the input_text to all upper case"""
-    print("called: " + "to_upper")
-    return input_text.upper()
-
-@enabled_tool
-@tool
-def get_date(opts: Annotated[dict, InjectedToolArg]) -> str:
-    """Returns the current date as a string in the format YYYY-MM-DD."""
-    return datetime.now().strftime("%Y-%m-%d")
+# Tools are bound from their manifest entries and imported on first call.
+# Their declared metadata is known up front, so approval gating, timeouts
+# and job limits apply before the module is loaded.
+AVAILABLE_TOOLS = load_tools()
+for _spec in (t.spec for t in AVAILABLE_TOOLS):
+    if _spec.requires_approval:
+        NEEDS_APPROVAL[_spec.name] = True
+    if _spec.timeout is not None:
+        TOOL_TIMEOUTS[_spec.name] = _spec.timeout
+    if _spec.background_job is not None:
+        BACKGROUND_JOBS[_spec.name] = _spec.background_job
 
 # Create a dictionary mapping tool names to tool functions
 TOOL_MAP = {tool.name.lower(): tool for tool in AVAILABLE_TOOLS}
+
+if TOOL_PRELOAD:
+    for _tool in AVAILABLE_TOOLS:
+        try:
+            _tool.load()
+        except PermissionError:
+            # Its manifest entry is missing an approval; it is now gated and loads on its first call
+            pass